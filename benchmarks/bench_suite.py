@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import platform
+import resource
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yaml
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src', 'backend'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src', 'frontend'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tests'))
+
+CONFIG_FILE = os.path.join(ROOT_DIR, 'src', 'config', 'config.yaml')
+COMMITTED_DBS = os.path.join(ROOT_DIR, 'src', 'backend', 'databases', 'vectordb')
+QUERIES_FILE = os.path.join(os.path.dirname(__file__), 'queries.json')
+FIXTURE_PAGES = os.path.join(ROOT_DIR, 'tests', 'fixtures', 'text_cleaner_pages.json')
+BENCHMARKS = ('db_load', 'retrieval', 'ingestion', 'end_to_end')
+
+# Metric name suffixes and whether bigger values are better, for `compare`
+HIGHER_IS_BETTER = ('qps', 'per_second')
+LOWER_IS_BETTER = ('_ms', '_seconds', '_bytes')
+
+
+def rss_high_water_bytes():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def latency_summary(latencies_ms):
+    latencies_ms = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        'count': int(len(latencies_ms)),
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def run_concurrently(function, items, concurrency):
+    """Calls `function` on every item from `concurrency` threads; returns latencies (ms) and QPS."""
+    def timed(item):
+        start = time.perf_counter()
+        function(item)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, items))
+    wall_seconds = time.perf_counter() - start
+    return {**latency_summary(latencies), 'qps': len(items) / wall_seconds}
+
+
+def prepare_workspace(workspace, grades):
+    """
+    Copies the committed vector DBs into `workspace` and writes a benchmark config.
+
+    The committed stores are JSON only, so the copies are converted to the
+    binary embedding store (plus search indexes) once, outside the timings.
+    """
+    with open(CONFIG_FILE, 'r') as f:
+        config = yaml.safe_load(f)
+    databases_dir = os.path.join(workspace, 'vectordb')
+    for grade in grades:
+        shutil.copytree(os.path.join(COMMITTED_DBS, f'{grade}_vector_db'),
+                        os.path.join(databases_dir, f'{grade}_vector_db'))
+    config.update({
+        'root_dir': os.path.join(workspace, 'books'),
+        'databases_dir': databases_dir,
+        'grades': list(grades),
+    })
+    config['response_cache'] = {'enabled': False}
+    config['tracing'] = {'enabled': True, 'log_spans': False, 'prometheus': True}
+    config_path = os.path.join(workspace, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    from retrieval import VectorDBBuilder
+    builder = VectorDBBuilder(config_path)
+    for grade in grades:
+        builder.build_vector_db(grade)
+    return config_path
+
+
+def bench_db_load(builder, grades, repeat):
+    results = {}
+    for grade in grades:
+        timings = []
+        for _ in range(repeat):
+            builder.engine_registry.invalidate(grade)
+            start = time.perf_counter()
+            builder.get_query_engine(grade)
+            timings.append((time.perf_counter() - start) * 1000)
+        stats = builder.engine_stats()[grade]
+        results[grade] = {'best_ms': min(timings), 'mean_ms': float(np.mean(timings)),
+                          'memory_bytes': stats['memory_bytes']}
+    return results
+
+
+def bench_retrieval(builder, queries, concurrency_levels, rounds):
+    results = {}
+    for grade, questions in queries.items():
+        engine = builder.get_query_engine(grade)
+        items = questions * rounds
+        for question in questions:  # warm up the embedding service and page cache
+            engine.retrieve(question)
+
+        grade_results = {f'c{level}': run_concurrently(engine.retrieve, items, level)
+                         for level in concurrency_levels}
+
+        # All queries of a round in one embedding call and one matrix product
+        start = time.perf_counter()
+        for _ in range(rounds):
+            engine.retriever.retrieve_batch(questions)
+        grade_results['batch'] = {'qps': len(items) / (time.perf_counter() - start)}
+        results[grade] = grade_results
+    return results
+
+
+def bench_ingestion(workspace, config_path, pages, workers):
+    from llama_index.core import VectorStoreIndex
+    from ingestion import IngestionPipeline
+
+    # One source file per fixture page, cycled up to `pages`
+    with open(FIXTURE_PAGES, 'r', encoding='utf-8') as f:
+        fixture = json.load(f)
+    source_dir = os.path.join(workspace, 'ingestion_pages')
+    os.makedirs(source_dir, exist_ok=True)
+    paths = []
+    for i in range(pages):
+        path = os.path.join(source_dir, f'page_{i:05d}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(fixture[i % len(fixture)])
+        paths.append(path)
+
+    with open(config_path, 'r') as f:
+        ingestion_config = dict(yaml.safe_load(f).get('ingestion', {}))
+    if workers:
+        ingestion_config['workers'] = workers
+    pipeline = IngestionPipeline.from_config(ingestion_config)
+    try:
+        start = time.perf_counter()
+        _, pages_embedded, _ = pipeline.run(VectorStoreIndex(nodes=[]), paths)
+        seconds = time.perf_counter() - start
+    finally:
+        pipeline.shutdown()
+    return {'pages': pages_embedded, 'seconds': seconds, 'pages_per_second': pages_embedded / seconds,
+            'workers': pipeline.workers}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(base_url, timeout=300):
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        health = requests.get(f'{base_url}/healthz', timeout=5)
+        if health.status_code == 200:
+            return health.json()
+        if health.json().get('status') == 'failed':
+            raise RuntimeError(f"RAG service failed to start: {health.json().get('error')}")
+        time.sleep(0.1)
+    raise TimeoutError(f"RAG service at {base_url} was not ready after {timeout}s.")
+
+
+def bench_end_to_end(config_path, queries, concurrency_levels, chunk_delay):
+    import uvicorn
+    from groq_stub import GroqStub
+    from client import RAGClient
+
+    reply = "Plants need water, light and air to grow. They make food in their leaves."
+    with GroqStub(reply=reply, chunk_delay=chunk_delay) as stub:
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+        config['llm_client'] = {**config.get('llm_client', {}), 'base_url': stub.base_url,
+                                'requests_per_minute': None, 'hedge': False}
+        config['serving']['max_concurrent_requests_per_client'] = max(concurrency_levels)
+        config['startup'] = {'build_on_start': False, 'warm_up': True}
+        e2e_config_path = config_path.replace('.yaml', '_e2e.yaml')
+        with open(e2e_config_path, 'w') as f:
+            yaml.safe_dump(config, f)
+        os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+
+        import server
+        port = _free_port()
+        uvicorn_server = uvicorn.Server(uvicorn.Config(
+            server.create_app(e2e_config_path), host='127.0.0.1', port=port, log_level='warning'))
+        thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+        thread.start()
+        while not uvicorn_server.started:
+            time.sleep(0.01)
+        health = wait_until_ready(f'http://127.0.0.1:{port}')
+
+        model = next(iter(config['models']))
+        requests_list = [(grade, question) for grade, questions in queries.items() for question in questions]
+        local = threading.local()
+        first_token_ms = []
+
+        def chat(item):
+            if not hasattr(local, 'client'):
+                local.client = RAGClient(f'http://127.0.0.1:{port}', client_id=str(uuid.uuid4()))
+            grade, question = item
+            start = time.perf_counter()
+            first_token = None
+            for event in local.client.stream_chat(grade, model, question):
+                if event['type'] == 'delta' and first_token is None:
+                    first_token = (time.perf_counter() - start) * 1000
+                elif event['type'] == 'error':
+                    raise RuntimeError(event['message'])
+            if first_token is not None:
+                first_token_ms.append(first_token)
+
+        try:
+            chat(requests_list[0])  # warm up the engines
+            results = {'startup': {f'{phase}_seconds': seconds
+                                   for phase, seconds in health['startup_seconds'].items()}}
+            for level in concurrency_levels:
+                first_token_ms.clear()
+                result = run_concurrently(chat, requests_list, level)
+                result['time_to_first_token'] = latency_summary(first_token_ms)
+                results[f'c{level}'] = result
+        finally:
+            uvicorn_server.should_exit = True
+            thread.join()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with open(QUERIES_FILE, 'r') as f:
+        queries = {grade: questions for grade, questions in json.load(f).items() if grade in args.grades}
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+        },
+        'results': {},
+    }
+    workspace = tempfile.mkdtemp(prefix='rag_bench_')
+    try:
+        config_path = prepare_workspace(workspace, args.grades)
+        from retrieval import VectorDBBuilder
+        builder = VectorDBBuilder(config_path)
+        results = report['results']
+
+        if 'db_load' in args.benchmarks:
+            results['db_load'] = bench_db_load(builder, args.grades, args.repeat)
+        if 'retrieval' in args.benchmarks:
+            results['retrieval'] = bench_retrieval(builder, queries, args.concurrency, args.rounds)
+        if 'ingestion' in args.benchmarks:
+            results['ingestion'] = bench_ingestion(workspace, config_path, args.pages, args.workers)
+        if 'end_to_end' in args.benchmarks:
+            results['end_to_end'] = bench_end_to_end(config_path, queries, args.concurrency, args.llm_chunk_delay)
+        results['memory'] = {'rss_high_water_bytes': rss_high_water_bytes()}
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def flatten(results, prefix=''):
+    metrics = {}
+    for key, value in results.items():
+        name = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def compare_reports(baseline, candidate, threshold):
+    """
+    Compares two benchmark reports metric by metric.
+
+    Returns:
+        list: One dict per shared metric with both values, the relative change
+            and whether it is a regression beyond `threshold`.
+    """
+    base_metrics = flatten(baseline['results'])
+    new_metrics = flatten(candidate['results'])
+    rows = []
+    for name in sorted(set(base_metrics) & set(new_metrics)):
+        before, after = base_metrics[name], new_metrics[name]
+        leaf = name.rsplit('.', 1)[-1]
+        if leaf.endswith(HIGHER_IS_BETTER):
+            direction = 1
+        elif leaf.endswith(LOWER_IS_BETTER):
+            direction = -1
+        else:
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append({'metric': name, 'baseline': before, 'candidate': after, 'change': change,
+                     'regression': direction * change < -threshold})
+    return rows
+
+
+def compare(args):
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r') as f:
+        candidate = json.load(f)
+    rows = compare_reports(baseline, candidate, args.threshold)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        for row in rows:
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"{row['metric']:<50} {row['baseline']:>14.3f} -> {row['candidate']:>14.3f} "
+                  f"({row['change']:+.1%}){flag}")
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}.", file=sys.stderr)
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval, ingestion and end-to-end chat benchmarks.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Run the benchmarks and print a JSON report.")
+    run_parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    run_parser.add_argument('--grades', nargs='+', default=['Grade4', 'Grade5'])
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    run_parser.add_argument('--rounds', type=int, default=5, help="Passes over the query set per level.")
+    run_parser.add_argument('--repeat', type=int, default=3, help="Cold loads per grade.")
+    run_parser.add_argument('--pages', type=int, default=500, help="Pages ingested by the ingestion benchmark.")
+    run_parser.add_argument('--workers', type=int, default=None, help="Ingestion worker processes.")
+    run_parser.add_argument('--llm-chunk-delay', type=float, default=0.005,
+                            help="Seconds between streamed chunks of the fake Groq server.")
+    run_parser.add_argument('--output', help="Also write the report to this file.")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help="Compare two reports; exit 1 on regressions.")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.10, help="Allowed relative slowdown.")
+    compare_parser.add_argument('--json', action='store_true', help="Print the comparison as JSON.")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'backend')))
+from utils import TextCleaner  # noqa: E402
+
+FIXTURE_PAGES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'text_cleaner_pages.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pages/sec throughput of TextCleaner.clean_text_content.")
+    parser.add_argument('--pages', type=int, default=20000, help="Number of pages to clean.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs; the best one is reported.")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON.")
+    args = parser.parse_args()
+
+    with open(FIXTURE_PAGES, 'r', encoding='utf-8') as f:
+        fixture = json.load(f)
+    pages = [fixture[i % len(fixture)] for i in range(args.pages)]
+    cleaner = TextCleaner()
+
+    best = float('inf')
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for _ in cleaner.clean_pages(pages):
+            pass
+        best = min(best, time.perf_counter() - start)
+
+    result = {
+        'benchmark': 'text_cleaner',
+        'pages': args.pages,
+        'seconds': best,
+        'pages_per_second': args.pages / best,
+    }
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"Cleaned {args.pages} pages in {best:.3f}s ({result['pages_per_second']:.0f} pages/sec)")
+
+
+if __name__ == '__main__':
+    main()
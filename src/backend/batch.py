@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from model import AsyncLLMModel, load_api_key
+from rag import NO_ANSWER, build_prompt
+from cache import FAQLookup, normalize_question
+import tracing
+
+CONFIG_FILE = os.environ.get('CHATBOT_CONFIG', '../config/config.yaml')
+
+
+def question_id(grade, model, question):
+    """Stable id for questions without one, so reruns resume instead of repeating them."""
+    return hashlib.sha256('\x1f'.join((grade, model, normalize_question(question))).encode('utf-8')).hexdigest()[:16]
+
+
+def read_questions(path, default_grade=None, default_model=None):
+    """
+    Reads questions from a JSONL file.
+
+    Each line is an object with a `question` and optionally `id`, `grade`
+    and `model`; missing grades and models fall back to the defaults.
+
+    Returns:
+        list: Question dicts with `id`, `grade`, `model` and `question`.
+    """
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            grade = item.get('grade', default_grade)
+            model = item.get('model', default_model)
+            if not grade or not model or not item.get('question'):
+                raise ValueError(f"{path}:{line_number}: every question needs a grade, a model and a question.")
+            questions.append({
+                'id': str(item.get('id') or question_id(grade, model, item['question'])),
+                'grade': grade,
+                'model': model,
+                'question': item['question'],
+            })
+    return questions
+
+
+def read_results(path):
+    """Returns the successful results already in an output file, keyed by id (for resuming)."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut off by an interruption; the question is asked again
+            if 'answer' in result:
+                results[result['id']] = result
+    return results
+
+
+def write_faq_file(faq_path, results):
+    """Merges successful batch results into the FAQ lookup file read by the serving path."""
+    entries = FAQLookup.read(faq_path)
+    added = 0
+    for result in results:
+        if result.get('answer') in (None, NO_ANSWER):
+            continue
+        entries.setdefault(result['grade'], {})[normalize_question(result['question'])] = {
+            'question': result['question'],
+            'answer': result['answer'],
+            'model': result['model'],
+        }
+        added += 1
+    FAQLookup.write(faq_path, entries)
+    return added
+
+
+class BatchAnswerer:
+    """
+    Answers a list of questions offline.
+
+    Questions are processed in chunks of `batch_size` per grade: each chunk is
+    embedded in one call and retrieved with one matrix product, then its LLM
+    calls run with at most `concurrency` in flight while the next chunk is
+    retrieved. Results are appended to the output file as they complete.
+    """
+    def __init__(self, builder, llm, context_builder, concurrency=8, batch_size=256, max_tokens=512):
+        self.builder = builder
+        self.llm = llm
+        self.context_builder = context_builder
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+
+    def retrieve_batch(self, grade, questions):
+        """Embeds and retrieves a chunk of questions for one grade."""
+        from llama_index.core import QueryBundle
+
+        query_engine = self.builder.get_query_engine(grade)
+        bundles = [QueryBundle(question) for question in questions]
+        retriever = query_engine.retriever
+        with tracing.span('batch_retrieval', grade=grade, queries=len(bundles)):
+            if hasattr(retriever, 'retrieve_batch'):
+                return bundles, retriever.retrieve_batch(bundles)
+            # Legacy JSON stores: one query at a time
+            return bundles, [query_engine.retrieve(bundle) for bundle in bundles]
+
+    async def answer(self, item, bundle, source_nodes, semaphore):
+        start = time.perf_counter()
+        result = dict(item)
+        if not source_nodes:
+            result['answer'] = NO_ANSWER
+        else:
+            try:
+                # Packing the context embeds and tokenizes, so it runs off the event loop
+                context = await asyncio.to_thread(
+                    self.context_builder.build,
+                    source_nodes, bundle.embedding, item['model'], self.max_tokens, item['question'])
+                async with semaphore:
+                    result['answer'] = await self.llm.generate_response(
+                        item['model'], build_prompt(context, item['question']), self.max_tokens)
+            except Exception as e:
+                # Any failure only fails this question; a rerun asks it again
+                result['error'] = str(e)
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    async def run(self, questions, output_path):
+        """
+        Answers `questions`, skipping ids already answered in `output_path`.
+
+        Returns:
+            tuple: (answered now, skipped as already answered or repeated, failed).
+        """
+        done = read_results(output_path)
+        seen = set(done)
+        pending = []
+        for item in questions:
+            if item['id'] not in seen:  # also drops repeated questions within the input
+                seen.add(item['id'])
+                pending.append(item)
+        skipped = len(questions) - len(pending)
+        answered = failed = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        by_grade = {}
+        for item in pending:
+            by_grade.setdefault(item['grade'], []).append(item)
+
+        # A previous run may have been killed mid-line
+        needs_newline = os.path.exists(output_path) and os.path.getsize(output_path) > 0
+        if needs_newline:
+            with open(output_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+
+        with open(output_path, 'a', encoding='utf-8') as output:
+            if needs_newline:
+                output.write('\n')
+            in_flight = set()
+
+            async def drain(limit):
+                nonlocal answered, failed
+                while len(in_flight) > limit:
+                    finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        in_flight.discard(task)
+                        result = task.result()
+                        output.write(json.dumps(result, ensure_ascii=False) + '\n')
+                        output.flush()
+                        if 'error' in result:
+                            failed += 1
+                        else:
+                            answered += 1
+
+            for grade, items in by_grade.items():
+                for start in range(0, len(items), self.batch_size):
+                    chunk = items[start:start + self.batch_size]
+                    bundles, results = await asyncio.to_thread(
+                        self.retrieve_batch, grade, [item['question'] for item in chunk])
+                    for item, bundle, source_nodes in zip(chunk, bundles, results):
+                        in_flight.add(asyncio.ensure_future(self.answer(item, bundle, source_nodes, semaphore)))
+                    # Keep at most about one chunk of LLM calls queued behind the next retrieval
+                    await drain(self.batch_size)
+            await drain(0)
+        return answered, skipped, failed
+
+
+async def run_batch(args):
+    from retrieval import VectorDBBuilder
+    from context import ContextBuilder
+
+    builder = VectorDBBuilder(args.config)
+    config = builder.config
+    questions = read_questions(args.input, args.grade, args.model)
+    unknown = sorted({item['grade'] for item in questions} - set(builder.grades))
+    if unknown:
+        raise SystemExit(f"Unknown grades in {args.input}: {', '.join(unknown)}")
+
+    llm = AsyncLLMModel(
+        load_api_key(),
+        config.get('llm_client'),
+        {model: options['fallback'] for model, options in config.get('models', {}).items() if options.get('fallback')},
+    )
+    answerer = BatchAnswerer(builder, llm, ContextBuilder.from_config(config),
+                             args.concurrency, args.batch_size, args.max_tokens)
+    start = time.perf_counter()
+    try:
+        answered, skipped, failed = await answerer.run(questions, args.output)
+    finally:
+        await llm.close()
+    print(f"Answered {answered} questions in {time.perf_counter() - start:.1f}s "
+          f"({skipped} already answered, {failed} failed) -> {args.output}")
+
+    if args.faq_file:
+        added = write_faq_file(args.faq_file, read_results(args.output).values())
+        print(f"Wrote {added} precomputed answers to {args.faq_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions offline.")
+    parser.add_argument('input', help="JSONL with one {\"question\", \"grade\"?, \"model\"?, \"id\"?} per line.")
+    parser.add_argument('--output', required=True, help="JSONL results; rerunning resumes where it stopped.")
+    parser.add_argument('--grade', help="Grade for questions without one.")
+    parser.add_argument('--model', help="Model for questions without one.")
+    parser.add_argument('--concurrency', type=int, default=8, help="LLM calls in flight.")
+    parser.add_argument('--batch-size', type=int, default=256, help="Questions embedded and retrieved together.")
+    parser.add_argument('--max-tokens', type=int, default=512)
+    parser.add_argument('--faq-file', help="Also merge the answers into this FAQ lookup file (see `faq` in config.yaml).")
+    parser.add_argument('--config', default=CONFIG_FILE)
+    args = parser.parse_args()
+    asyncio.run(run_batch(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from search import normalize_rows
+import tracing
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases a question and strips punctuation and repeated whitespace."""
+    question = re.sub(r'[^\w\s]', ' ', question.lower())
+    return re.sub(r'\s+', ' ', question).strip()
+
+
+def _hash(*parts) -> str:
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class InMemoryCacheBackend:
+    """
+    Process-local LRU backend; entries expire after `ttl_seconds`.
+
+    Keys are also indexed by namespace, so a semantic lookup only visits the
+    entries of its own (grade, model, context) namespace.
+    """
+    def __init__(self, max_entries=10000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds is not None and now - entry['created_at'] > self.ttl_seconds
+
+    def _remove(self, key):
+        # Caller must hold self._lock
+        entry = self._entries.pop(key)
+        keys = self._namespaces.get(entry['namespace'])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[entry['namespace']]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._namespaces.setdefault(entry['namespace'], set()).add(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def namespace_entries(self, namespace):
+        now = time.time()
+        with self._lock:
+            entries = []
+            for key in list(self._namespaces.get(namespace, ())):
+                entry = self._entries[key]
+                if self._expired(entry, now):
+                    self._remove(key)
+                else:
+                    entries.append((key, entry))
+            return entries
+
+
+class SQLiteCacheBackend:
+    """
+    File-backed backend shared by every process on a host.
+
+    Embeddings are stored as float32 blobs; the least recently used rows are
+    deleted once the table grows past `max_entries`.
+    """
+    def __init__(self, path, max_entries=10000, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, namespace TEXT, response TEXT, embedding BLOB, '
+                'created_at REAL, last_used REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS responses_namespace ON responses (namespace)')
+
+    def _min_created_at(self):
+        return time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0.0
+
+    @staticmethod
+    def _to_entry(namespace, response, embedding, created_at):
+        return {
+            'namespace': namespace,
+            'response': response,
+            'embedding': np.frombuffer(embedding, dtype=np.float32) if embedding is not None else None,
+            'created_at': created_at,
+        }
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT namespace, response, embedding, created_at FROM responses WHERE key = ? AND created_at >= ?',
+                (key, self._min_created_at()),
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+        return self._to_entry(*row)
+
+    def set(self, key, entry):
+        embedding = entry['embedding']
+        blob = np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, entry['namespace'], entry['response'], blob, entry['created_at'], time.time()),
+            )
+            self._conn.execute('DELETE FROM responses WHERE created_at < ?', (self._min_created_at(),))
+            if self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM responses WHERE key NOT IN '
+                    '(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)',
+                    (self.max_entries,),
+                )
+
+    def namespace_entries(self, namespace):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, namespace, response, embedding, created_at FROM responses '
+                'WHERE namespace = ? AND created_at >= ?',
+                (namespace, self._min_created_at()),
+            ).fetchall()
+        return [(row[0], self._to_entry(*row[1:])) for row in rows]
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM answers.
+
+    The exact tier is keyed on a hash of (grade, model, normalized question,
+    retrieved context). The semantic tier reuses an answer from the same
+    (grade, model, context) namespace when the query embeddings are at least
+    `similarity_threshold` cosine-similar.
+    """
+    def __init__(self, backend, similarity_threshold=0.95):
+        self.backend = backend
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_config):
+        """Builds a cache from the `response_cache` section of config.yaml, or None if disabled."""
+        if not cache_config or not cache_config.get('enabled', False):
+            return None
+        max_entries = cache_config.get('max_entries', 10000)
+        ttl_seconds = cache_config.get('ttl_seconds')
+        if cache_config.get('backend', 'memory') == 'sqlite':
+            backend = SQLiteCacheBackend(cache_config['sqlite_path'], max_entries, ttl_seconds)
+        else:
+            backend = InMemoryCacheBackend(max_entries, ttl_seconds)
+        return cls(backend, cache_config.get('similarity_threshold', 0.95))
+
+    @staticmethod
+    def _namespace(grade, model, context):
+        return _hash(grade, model, context)
+
+    @staticmethod
+    def _key(grade, model, question, context):
+        return _hash(grade, model, normalize_question(question), context)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @tracing.traced('cache_lookup')
+    def lookup(self, grade, model, question, context, query_embedding=None):
+        """
+        Returns a cached answer for the question, or None on a miss.
+
+        Args:
+            grade (str): Selected grade.
+            model (str): LLM model id.
+            question (str): The user's question.
+            context (str): Retrieved context sent with the question.
+            query_embedding (list): Optional query embedding for the semantic tier.
+        """
+        entry = self.backend.get(self._key(grade, model, question, context))
+        if entry is not None:
+            self._count('exact_hits')
+            return entry['response']
+
+        if query_embedding is not None and self.similarity_threshold is not None:
+            candidates = [entry for _, entry in self.backend.namespace_entries(self._namespace(grade, model, context))
+                          if entry['embedding'] is not None]
+            if candidates:
+                query = normalize_rows(query_embedding)[0]
+                scores = normalize_rows([entry['embedding'] for entry in candidates]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self._count('semantic_hits')
+                    return candidates[best]['response']
+
+        self._count('misses')
+        return None
+
+    def store(self, grade, model, question, context, response, query_embedding=None):
+        """Caches an answer under both the exact and the semantic tier."""
+        self.backend.set(self._key(grade, model, question, context), {
+            'namespace': self._namespace(grade, model, context),
+            'response': response,
+            'embedding': list(query_embedding) if query_embedding is not None else None,
+            'created_at': time.time(),
+        })
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
+
+
+class FAQLookup:
+    """
+    Precomputed answers for known questions, written by `batch.py --faq-file`.
+
+    The file maps grade -> normalized question -> answer. It is re-read when
+    its modification time changes, so a new FAQ list goes live without a
+    restart.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, faq_config):
+        """Builds a lookup from the `faq` section of config.yaml, or None if disabled."""
+        if not faq_config or not faq_config.get('enabled', False):
+            return None
+        return cls(faq_config['path'])
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('grades', {})
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def write(path, entries):
+        """Atomically writes `entries` (grade -> normalized question -> entry) to `path`."""
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'grades': entries}, f, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != self._mtime:
+                self.entries = self.read(self.path) if mtime is not None else {}
+                self._mtime = mtime
+
+    def lookup(self, grade, question):
+        """Returns the precomputed answer entry for a question, or None."""
+        self._refresh()
+        entry = self.entries.get(grade, {}).get(normalize_question(question))
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'entries': sum(len(questions) for questions in self.entries.values()), 'hits': self.hits}
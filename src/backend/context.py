@@ -0,0 +1,148 @@
+import re
+import numpy as np
+from llama_index.core import Settings
+from search import normalize_rows
+from rag import PROMPT_TEMPLATE
+
+# Roughly one BPE token per short word piece or punctuation mark
+_TOKEN_PIECES = re.compile(r"\w{1,6}|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast local estimate of how many LLM tokens `text` takes.
+
+    Long words are counted as several 6-character pieces, which tracks the
+    LLaMA/Mixtral tokenizers closely enough for budgeting without loading one.
+    """
+    return len(_TOKEN_PIECES.findall(text))
+
+
+PROMPT_TOKENS = estimate_tokens(PROMPT_TEMPLATE)
+
+
+def mmr_order(query_embedding, embeddings, mmr_lambda=0.7, duplicate_threshold=0.95):
+    """
+    Orders candidates by maximal marginal relevance and drops near-duplicates.
+
+    Args:
+        query_embedding (list): Embedding of the question.
+        embeddings (list | np.ndarray): One embedding per candidate chunk.
+        mmr_lambda (float): 1.0 ranks by relevance only, lower values favour diversity.
+        duplicate_threshold (float): Candidates at least this cosine-similar to an
+            already selected chunk are dropped.
+    Returns:
+        list: Candidate positions, most useful first.
+    """
+    if len(embeddings) == 0:
+        return []
+    vectors = normalize_rows(embeddings)
+    relevance = vectors @ normalize_rows(query_embedding)[0]
+    similarity = vectors @ vectors.T
+
+    # The most relevant chunk goes first; each next pick trades relevance against
+    # its highest similarity to the chunks already picked
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    remaining = max_similarity < duplicate_threshold
+    remaining[selected[0]] = False
+    while remaining.any():
+        scores = np.where(remaining, mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+        remaining &= max_similarity < duplicate_threshold
+        remaining[best] = False
+    return selected
+
+
+class ContextBuilder:
+    """
+    Packs retrieved chunks into the prompt context for one model.
+
+    Candidates are reordered with MMR over their embeddings, near-duplicate
+    (overlapping) chunks are dropped, and chunks are added while they fit the
+    token budget: the model's context window minus the answer's `max_tokens`,
+    the prompt template and question, and `reserve_tokens`.
+    """
+    def __init__(self, models, max_chunks=3, mmr_lambda=0.7, duplicate_threshold=0.95,
+                 max_context_tokens=None, reserve_tokens=64, embed_model=None):
+        self.models = models or {}
+        self.max_chunks = max_chunks
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.max_context_tokens = max_context_tokens
+        self.reserve_tokens = reserve_tokens
+        self.embed_model = embed_model
+
+    @classmethod
+    def from_config(cls, config):
+        context_config = config.get('context', {})
+        return cls(
+            config.get('models', {}),
+            max_chunks=config['query_config']['top_k'],
+            mmr_lambda=context_config.get('mmr_lambda', 0.7),
+            duplicate_threshold=context_config.get('duplicate_threshold', 0.95),
+            max_context_tokens=context_config.get('max_context_tokens'),
+            reserve_tokens=context_config.get('reserve_tokens', 64),
+        )
+
+    def token_budget(self, model, max_tokens, prompt_tokens=0):
+        """Tokens left for context once the answer, the prompt and the reserve are accounted for."""
+        window = self.models.get(model, {}).get('tokens', 8192)
+        budget = window - max_tokens - prompt_tokens - self.reserve_tokens
+        if self.max_context_tokens is not None:
+            budget = min(budget, self.max_context_tokens)
+        return max(budget, 0)
+
+    def _embeddings(self, source_nodes):
+        # The NumPy retriever attaches the stored embeddings; embed the rest (legacy JSON stores)
+        missing = [n for n in source_nodes if n.node.embedding is None]
+        if missing:
+            embed_model = self.embed_model or Settings.embed_model
+            texts = [n.node.get_content() for n in missing]
+            for n, embedding in zip(missing, embed_model.get_text_embedding_batch(texts)):
+                n.node.embedding = embedding
+        return [n.node.embedding for n in source_nodes]
+
+    def select(self, source_nodes, query_embedding, token_budget):
+        """
+        Picks the chunks that go into the context.
+
+        Args:
+            source_nodes (list): Retrieved NodeWithScore candidates, best first.
+            query_embedding (list): Embedding of the question, or None to skip MMR.
+            token_budget (int): Maximum estimated tokens for the chunk texts.
+        Returns:
+            list: The selected NodeWithScore objects, in the order they are packed.
+        """
+        if query_embedding is None:
+            order = range(len(source_nodes))
+        else:
+            order = mmr_order(query_embedding, self._embeddings(source_nodes),
+                              self.mmr_lambda, self.duplicate_threshold)
+
+        selected = []
+        used_tokens = 0
+        for position in order:
+            node = source_nodes[position]
+            tokens = estimate_tokens(node.text)
+            # Skip chunks that overflow the budget; a shorter one further down may still fit
+            if used_tokens + tokens > token_budget:
+                continue
+            selected.append(node)
+            used_tokens += tokens
+            if self.max_chunks and len(selected) >= self.max_chunks:
+                break
+        return selected
+
+    def build(self, source_nodes, query_embedding, model, max_tokens, question=""):
+        """
+        Builds the context string for a question.
+
+        Returns:
+            str: The selected chunk texts separated by blank lines.
+        """
+        prompt_tokens = PROMPT_TOKENS + estimate_tokens(question)
+        budget = self.token_budget(model, max_tokens, prompt_tokens)
+        return "\n\n".join(node.text for node in self.select(source_nodes, query_embedding, budget))
@@ -0,0 +1,524 @@
+import os
+import json
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from search import ExactSearchIndex, node_ids_fingerprint
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.simple import SimpleVectorStore, SimpleVectorStoreData
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+EMBEDDINGS_FILE = 'embeddings.bin'
+EMBEDDINGS_INDEX_FILE = 'embeddings_index.json'
+JSON_VECTOR_STORE_FILE = 'default__vector_store.json'
+SUPPORTED_DTYPES = ('float32', 'float16')
+
+
+class EmbeddingStore:
+    """
+    Compact on-disk embedding store for one persisted vector DB.
+
+    Embeddings live in a contiguous, row-major, L2-normalized matrix file
+    (`embeddings.bin`) next to a small JSON index mapping rows to node ids
+    (`embeddings_index.json`). The matrix is memory-mapped read-only, so every
+    worker process on a host shares the same page-cache pages.
+    """
+    def __init__(self, matrix, node_ids, ref_doc_ids):
+        self.matrix = matrix
+        self.node_ids = node_ids
+        self.ref_doc_ids = ref_doc_ids
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """Fingerprint of the row -> node id mapping, recorded by the indexes built from this store."""
+        if self._fingerprint is None:
+            self._fingerprint = node_ids_fingerprint(self.node_ids)
+        return self._fingerprint
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @staticmethod
+    def exists(persist_dir):
+        return (os.path.exists(os.path.join(persist_dir, EMBEDDINGS_FILE))
+                and os.path.exists(os.path.join(persist_dir, EMBEDDINGS_INDEX_FILE)))
+
+    @classmethod
+    def write(cls, persist_dir, node_ids, embeddings, ref_doc_ids=None, dtype='float32'):
+        """
+        Writes embeddings to `persist_dir` in the binary format.
+
+        Args:
+            persist_dir (str): Directory of the persisted vector DB.
+            node_ids (list): Node id for each embedding row.
+            embeddings (list | np.ndarray): One embedding per node id.
+            ref_doc_ids (list): Optional source document id for each node.
+            dtype (str): 'float32' or 'float16' for the on-disk matrix.
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {SUPPORTED_DTYPES}.")
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if not node_ids and matrix.size == 0:
+            # A grade whose files were all removed
+            matrix = matrix.reshape(0, 0)
+        if matrix.ndim != 2 or matrix.shape[0] != len(node_ids):
+            raise ValueError("Embeddings must be a 2D matrix with one row per node id.")
+
+        # Pre-normalize so cosine similarity is a plain dot product at query time
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = (matrix / norms).astype(dtype)
+
+        header = {
+            'dtype': dtype,
+            'dim': int(matrix.shape[1]) if matrix.size else 0,
+            'count': len(node_ids),
+            'normalized': True,
+            'node_ids': list(node_ids),
+            'ref_doc_ids': list(ref_doc_ids) if ref_doc_ids is not None else [None] * len(node_ids),
+        }
+
+        # Write to temporary files first so readers never see a half-written store
+        matrix_path = os.path.join(persist_dir, EMBEDDINGS_FILE)
+        index_path = os.path.join(persist_dir, EMBEDDINGS_INDEX_FILE)
+        with open(matrix_path + '.tmp', 'wb') as f:
+            f.write(np.ascontiguousarray(matrix).tobytes())
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(header, f)
+        os.replace(matrix_path + '.tmp', matrix_path)
+        os.replace(index_path + '.tmp', index_path)
+
+    @classmethod
+    def load(cls, persist_dir):
+        """Memory-maps the binary store of `persist_dir` read-only."""
+        with open(os.path.join(persist_dir, EMBEDDINGS_INDEX_FILE), 'r') as f:
+            header = json.load(f)
+
+        matrix_path = os.path.join(persist_dir, EMBEDDINGS_FILE)
+        if header['count'] == 0:
+            matrix = np.zeros((0, header['dim']), dtype=header['dtype'])
+        else:
+            matrix = np.memmap(matrix_path, dtype=header['dtype'], mode='r',
+                               shape=(header['count'], header['dim']))
+        return cls(matrix, header['node_ids'], header['ref_doc_ids'])
+
+    def to_simple_vector_store(self):
+        """
+        Copies the store into an in-memory SimpleVectorStore.
+
+        Builds persist only the binary store, so an incremental build starts
+        its index from this instead of `default__vector_store.json`.
+        """
+        matrix = np.asarray(self.matrix, dtype=np.float32)
+        return SimpleVectorStore(data=SimpleVectorStoreData(
+            embedding_dict={node_id: row.tolist() for node_id, row in zip(self.node_ids, matrix)},
+            text_id_to_ref_doc_id={node_id: ref_doc_id for node_id, ref_doc_id in zip(self.node_ids, self.ref_doc_ids)
+                                   if ref_doc_id is not None},
+        ))
+
+
+def convert_json_vector_store(persist_dir, dtype='float32', remove_json=False):
+    """
+    One-shot conversion of a persisted `default__vector_store.json` into the
+    binary embedding store.
+
+    Args:
+        persist_dir (str): Directory of the persisted vector DB.
+        dtype (str): 'float32' or 'float16' for the on-disk matrix.
+        remove_json (bool): Delete the JSON vector store after converting;
+            builds and incremental updates only need the binary store.
+    """
+    json_path = os.path.join(persist_dir, JSON_VECTOR_STORE_FILE)
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+
+    embedding_dict = data['embedding_dict']
+    text_id_to_ref_doc_id = data.get('text_id_to_ref_doc_id', {})
+    node_ids = list(embedding_dict.keys())
+    EmbeddingStore.write(
+        persist_dir,
+        node_ids,
+        [embedding_dict[node_id] for node_id in node_ids],
+        [text_id_to_ref_doc_id.get(node_id) for node_id in node_ids],
+        dtype=dtype,
+    )
+    print(f"Converted {len(node_ids)} embeddings in {persist_dir} to {dtype}.")
+
+    if remove_json:
+        os.remove(json_path)
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """Read-only LlamaIndex vector store backed by a memory-mapped EmbeddingStore."""
+    stores_text: bool = False
+
+    _store: EmbeddingStore = PrivateAttr()
+
+    def __init__(self, store, **kwargs):
+        super().__init__(**kwargs)
+        self._store = store
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir):
+        return cls(EmbeddingStore.load(persist_dir))
+
+    @property
+    def client(self):
+        return self._store
+
+    def add(self, nodes, **add_kwargs):
+        raise NotImplementedError("MmapVectorStore is read-only; rebuild the vector DB instead.")
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        raise NotImplementedError("MmapVectorStore is read-only; rebuild the vector DB instead.")
+
+    def query(self, query: VectorStoreQuery, **kwargs) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by MmapVectorStore.")
+        if query.query_embedding is None or len(self._store) == 0:
+            return VectorStoreQueryResult(nodes=None, similarities=[], ids=[])
+
+        rows, scores = ExactSearchIndex(self._store.matrix).search(
+            query.query_embedding, query.similarity_top_k)[0]
+        return VectorStoreQueryResult(
+            nodes=None,
+            similarities=[float(score) for score in scores],
+            ids=[self._store.node_ids[row] for row in rows],
+        )
+
+
+class EmbeddingService:
+    """
+    Shared, micro-batching embedding service.
+
+    Query texts submitted from any thread (i.e. any Streamlit session) are
+    queued and embedded by one worker thread in batches of up to
+    `max_batch_size`, waiting at most `max_wait_ms` for a batch to fill. An LRU
+    cache maps recently seen texts to their vectors so repeated questions skip
+    the model entirely.
+
+    all-MiniLM-L6-v2 has no query instruction, so query and text embeddings are
+    the same. Each batch goes to the model's `_get_text_embeddings` in one
+    call; `get_text_embedding_batch` would split it again by the model's own
+    `embed_batch_size`.
+    """
+    def __init__(self, embed_model, max_batch_size=32, max_wait_ms=5, cache_size=10000):
+        self.embed_model = embed_model
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self.batches = 0
+        self.batched_texts = 0
+        self.cache_hits = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._worker.start()
+
+    def _cached(self, text):
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self.cache_hits += 1
+            return vector
+
+    def _remember(self, text, vector):
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def submit(self, text):
+        """Queues a query text and returns a Future resolving to its embedding."""
+        future = Future()
+        vector = self._cached(text)
+        if vector is not None:
+            future.set_result(vector)
+        else:
+            self._queue.put((text, future))
+        return future
+
+    def embed_query(self, text):
+        return self.submit(text).result()
+
+    def embed_queries(self, texts):
+        # Submitting everything before waiting lets the worker batch them together
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def embed_texts(self, texts):
+        """Embeds document texts directly (ingestion); these are not cached."""
+        with self._model_lock:
+            return self.embed_model._get_text_embeddings(texts)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                with self._model_lock:
+                    vectors = dict(zip(texts, self.embed_model._get_text_embeddings(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.batched_texts += len(texts)
+            for text in texts:
+                self._remember(text, vectors[text])
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'mean_batch_size': self.batched_texts / self.batches if self.batches else 0.0,
+            'cache_hits': self.cache_hits,
+            'cache_entries': len(self._cache),
+            'queued': self._queue.qsize(),
+        }
+
+
+class ServiceEmbedding(BaseEmbedding):
+    """LlamaIndex embedding model that routes every call through an EmbeddingService."""
+    _service: EmbeddingService = PrivateAttr()
+
+    def __init__(self, service, **kwargs):
+        super().__init__(model_name=service.embed_model.model_name, **kwargs)
+        self._service = service
+
+    @classmethod
+    def class_name(cls):
+        return 'ServiceEmbedding'
+
+    @property
+    def service(self):
+        return self._service
+
+    def get_query_embedding_batch(self, queries):
+        return self._service.embed_queries(queries)
+
+    def _get_query_embedding(self, query):
+        return self._service.embed_query(query)
+
+    async def _aget_query_embedding(self, query):
+        return await asyncio.wrap_future(self._service.submit(query))
+
+    def _get_text_embedding(self, text):
+        return self._service.embed_texts([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._service.embed_texts(texts)
+
+
+class EmbeddingServer:
+    """
+    Serves an EmbeddingService to other processes on a Unix socket.
+
+    The shared-store loader runs one, so worker processes embed queries
+    through its model (see RemoteEmbedding) instead of each loading their own.
+    Each connection is handled by its own thread; the service batches queries
+    from every worker together. Requests and replies are JSON headers plus a
+    raw float32 matrix, never pickles.
+    """
+    def __init__(self, service, address):
+        self.service = service
+        self.address = address
+        if os.path.exists(address):
+            os.remove(address)  # left behind by a loader that was killed
+        self._listener = Listener(address, family='AF_UNIX')
+        self._closed = False
+        self._thread = threading.Thread(target=self._accept, name='embedding-server', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        try:
+            # Wake the accept loop so it sees the flag
+            Client(self.address, family='AF_UNIX').close()
+        except OSError:
+            pass
+        self._thread.join(timeout=5)
+        self._listener.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), name='embedding-server-connection',
+                             daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = json.loads(connection.recv_bytes())
+                except (EOFError, OSError):
+                    return
+                try:
+                    texts = request['texts']
+                    if request.get('kind') == 'query':
+                        vectors = self.service.embed_queries(texts)
+                    else:
+                        vectors = self.service.embed_texts(texts)
+                    matrix = np.asarray(vectors, dtype=np.float32)
+                except Exception as e:
+                    connection.send_bytes(json.dumps({'error': str(e)}).encode())
+                    continue
+                connection.send_bytes(json.dumps({'count': len(texts)}).encode())
+                connection.send_bytes(matrix.tobytes())
+
+
+class RemoteEmbedding(BaseEmbedding):
+    """
+    LlamaIndex embedding model that embeds through another process's EmbeddingServer.
+
+    Each thread keeps its own connection. The first call waits up to
+    `connect_timeout_seconds` for the server, e.g. while the loader starts.
+    """
+    _address: str = PrivateAttr()
+    _connect_timeout_seconds: float = PrivateAttr()
+    _local: threading.local = PrivateAttr()
+
+    def __init__(self, address, model_name, connect_timeout_seconds=30, **kwargs):
+        super().__init__(model_name=model_name, **kwargs)
+        self._address = address
+        self._connect_timeout_seconds = connect_timeout_seconds
+        self._local = threading.local()
+
+    @classmethod
+    def class_name(cls):
+        return 'RemoteEmbedding'
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            return connection
+        deadline = time.monotonic() + self._connect_timeout_seconds
+        while True:
+            try:
+                connection = Client(self._address, family='AF_UNIX')
+                break
+            except OSError as e:
+                if time.monotonic() > deadline:
+                    raise ConnectionError(f"No embedding server at {self._address}: {e}") from e
+                time.sleep(0.1)
+        self._local.connection = connection
+        return connection
+
+    def _embed(self, kind, texts):
+        if not texts:
+            return []
+        connection = self._connection()
+        try:
+            connection.send_bytes(json.dumps({'kind': kind, 'texts': list(texts)}).encode())
+            header = json.loads(connection.recv_bytes())
+            if 'error' in header:
+                raise RuntimeError(f"Embedding server failed: {header['error']}")
+            matrix = np.frombuffer(connection.recv_bytes(), dtype=np.float32).reshape(len(texts), -1)
+        except (EOFError, OSError):
+            # The server went away (e.g. the loader restarted); reconnect on the next call
+            self._local.connection = None
+            connection.close()
+            raise
+        return matrix.tolist()
+
+    def get_query_embedding_batch(self, queries):
+        return self._embed('query', queries)
+
+    def _get_query_embedding(self, query):
+        return self._embed('query', [query])[0]
+
+    async def _aget_query_embedding(self, query):
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text):
+        return self._embed('text', [text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._embed('text', texts)
+
+
+_embed_models = {}
+_embed_models_lock = threading.Lock()
+
+
+def load_embed_model(model_name, service_config=None, embed_batch_size=None):
+    """
+    Returns the process-wide embedding model for `model_name`.
+
+    The HuggingFace model is loaded once per process and wrapped in an
+    EmbeddingService configured from the `embedding_service` config section.
+    `embed_batch_size` (ingestion's batch size) raises the model's encode
+    batch size above `max_batch_size` so ingestion batches run in one pass.
+    """
+    with _embed_models_lock:
+        if model_name not in _embed_models:
+            from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+            service_config = service_config or {}
+            max_batch_size = service_config.get('max_batch_size', 32)
+            service = EmbeddingService(
+                HuggingFaceEmbedding(model_name=model_name,
+                                     embed_batch_size=max(max_batch_size, embed_batch_size or 0)),
+                max_batch_size=max_batch_size,
+                max_wait_ms=service_config.get('max_wait_ms', 5),
+                cache_size=service_config.get('cache_size', 10000),
+            )
+            _embed_models[model_name] = ServiceEmbedding(service, embed_batch_size=max_batch_size)
+        return _embed_models[model_name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert persisted JSON vector stores to the binary embedding store.")
+    parser.add_argument('persist_dirs', nargs='+', help="Persisted vector DB directories (e.g. Grade4_vector_db).")
+    parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, default='float32')
+    parser.add_argument('--remove-json', action='store_true', help="Delete default__vector_store.json after converting.")
+    args = parser.parse_args()
+
+    for persist_dir in args.persist_dirs:
+        convert_json_vector_store(persist_dir, dtype=args.dtype, remove_json=args.remove_json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from llama_index.core import Settings, SimpleDirectoryReader
+from llama_index.core.schema import MetadataMode
+from utils import TextCleaner, DocumentProcessor
+import tracing
+
+_STOP = object()
+
+
+def load_and_clean_file(path):
+    """
+    Parses one source file and cleans its pages (runs in a worker process).
+
+    Args:
+        path (str): Path of the file to ingest.
+    Returns:
+        tuple: (cleaned Document objects, one per page; parse and clean seconds).
+    """
+    # Timed here and recorded by the parent, since worker processes have their own tracer
+    start = time.perf_counter()
+    documents = SimpleDirectoryReader(input_files=[path], filename_as_id=True).load_data()
+    parsed_at = time.perf_counter()
+    documents = DocumentProcessor(TextCleaner()).process_documents(documents)
+    return documents, {'ingest_parse': parsed_at - start, 'ingest_clean': time.perf_counter() - parsed_at}
+
+
+class IngestionPipeline:
+    """
+    Staged ingestion: parse + clean -> chunk -> batched embedding -> index.
+
+    Files are parsed and cleaned in a process pool. At most `max_pending_files`
+    parsed files wait between the stages, so memory stays flat however large
+    the grade is. Chunks are embedded in batches of `embed_batch_size` and
+    inserted into the index already embedded.
+    """
+    def __init__(self, workers=None, embed_batch_size=64, max_pending_files=8):
+        self.workers = workers or os.cpu_count() or 1
+        self.embed_batch_size = embed_batch_size
+        self.max_pending_files = max_pending_files
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, ingestion_config):
+        ingestion_config = ingestion_config or {}
+        return cls(
+            workers=ingestion_config.get('workers'),
+            embed_batch_size=ingestion_config.get('embed_batch_size', 64),
+            max_pending_files=ingestion_config.get('max_pending_files', 8),
+        )
+
+    @property
+    def executor(self):
+        # One pool shared by every grade built concurrently
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawned, not forked: the parent runs threads (loader stages, servers) that a fork would copy mid-lock
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    @staticmethod
+    def _loaded(path, future):
+        documents, timings = future.result()
+        for stage, seconds in timings.items():
+            tracing.record(stage, seconds, file=os.path.basename(path), pages=len(documents))
+        return path, documents
+
+    @staticmethod
+    def _put(out_queue, item, stop):
+        # Blocks while the queue is full, but gives up once the consumer has stopped
+        while not stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _load_stage(self, paths, out_queue, stop):
+        # Keep a bounded window of files in flight and hand them on in order
+        pending = deque()
+        try:
+            for path in paths:
+                if stop.is_set():
+                    return
+                pending.append((path, self.executor.submit(load_and_clean_file, path)))
+                if len(pending) >= self.max_pending_files:
+                    if not self._put(out_queue, self._loaded(*pending.popleft()), stop):
+                        return
+            while pending:
+                if not self._put(out_queue, self._loaded(*pending.popleft()), stop):
+                    return
+        except Exception as e:
+            self._put(out_queue, e, stop)
+        finally:
+            # Files the consumer will never take are not parsed
+            for _, future in pending:
+                future.cancel()
+            self._put(out_queue, _STOP, stop)
+
+    def _embed(self, nodes):
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        with tracing.span('ingest_embed', chunks=len(texts)):
+            # One model call per batch; get_text_embedding_batch would re-split it by the model's embed_batch_size
+            embeddings = Settings.embed_model._get_text_embeddings(texts)
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+
+    def _flush(self, index, documents, nodes):
+        # Embed a full batch, then insert the nodes and record their page hashes
+        self._embed(nodes)
+        with tracing.span('ingest_index', chunks=len(nodes)):
+            index.insert_nodes(nodes)
+            for document in documents:
+                index.docstore.set_document_hash(document.doc_id, document.hash)
+
+    def run(self, index, paths):
+        """
+        Ingests `paths` into `index`, skipping pages whose `doc_hash` is unchanged.
+
+        Args:
+            index (VectorStoreIndex): Index to update in place.
+            paths (list): Source files to (re)ingest.
+        Returns:
+            tuple: (doc ids per file path, pages embedded, pages reused).
+        """
+        doc_ids_by_path = {path: [] for path in paths}
+        pages_embedded = 0
+        pages_reused = 0
+        pending_documents = []
+        pending_nodes = []
+
+        loaded = queue.Queue(maxsize=self.max_pending_files)
+        stop = threading.Event()
+        loader = threading.Thread(target=self._load_stage, args=(paths, loaded, stop),
+                                  name='ingestion-loader', daemon=True)
+        loader.start()
+
+        try:
+            while True:
+                item = loaded.get()
+                if item is _STOP:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                path, documents = item
+                chunk_seconds = 0.0
+                for document in documents:
+                    doc_ids_by_path[path].append(document.doc_id)
+                    existing_hash = index.docstore.get_document_hash(document.doc_id)
+                    if existing_hash == document.hash:
+                        pages_reused += 1
+                        continue
+                    if existing_hash is not None:
+                        index.delete_ref_doc(document.doc_id, delete_from_docstore=True)
+
+                    pages_embedded += 1
+                    pending_documents.append(document)
+                    chunk_start = time.perf_counter()
+                    pending_nodes.extend(Settings.node_parser.get_nodes_from_documents([document]))
+                    chunk_seconds += time.perf_counter() - chunk_start
+                    if len(pending_nodes) >= self.embed_batch_size:
+                        self._flush(index, pending_documents, pending_nodes)
+                        pending_documents, pending_nodes = [], []
+                tracing.record('ingest_chunk', chunk_seconds, file=os.path.basename(path))
+        finally:
+            # If this loop failed, stop the loader: unblock its put and cancel the files it has queued
+            stop.set()
+            while True:
+                try:
+                    loaded.get_nowait()
+                except queue.Empty:
+                    break
+            loader.join()
+
+        if pending_documents:
+            self._flush(index, pending_documents, pending_nodes)
+        return doc_ids_by_path, pages_embedded, pages_reused
@@ -0,0 +1,146 @@
+import os
+import re
+import numpy as np
+from search import stored_source_matches
+
+BM25_INDEX_FILE = 'bm25_index.npz'
+
+_WORDS = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in is it its of on or she that the their "
+    "them they this to was we were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens without stopwords (works for English and Arabic text)."""
+    return [word for word in _WORDS.findall(text.lower()) if word not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several rankings of the same rows with reciprocal rank fusion.
+
+    Args:
+        rankings (list): Arrays of row ids, each best first.
+        k (int): Damping constant; larger values flatten the rank weights.
+    Returns:
+        tuple: (rows, fused scores) as arrays, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank + 1)
+    rows = sorted(fused, key=fused.get, reverse=True)
+    return np.array(rows, dtype=np.int64), np.array([fused[row] for row in rows], dtype=np.float32)
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of one grade.
+
+    Rows are the rows of the grade's embedding store, so lexical and vector
+    results refer to the same nodes. Postings are stored in CSR form: the
+    documents containing term t are `postings[offsets[t]:offsets[t + 1]]`,
+    with matching term frequencies, and the vocabulary is one newline-joined
+    UTF-8 blob, so the whole index is a handful of flat arrays.
+    """
+    def __init__(self, vocabulary, offsets, postings, frequencies, doc_lengths, k1=1.2, b=0.75):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        # Everything that does not depend on the query is computed once here
+        num_docs = len(doc_lengths)
+        doc_freqs = np.diff(offsets)
+        self.idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        average_length = doc_lengths.mean() if num_docs else 0.0
+        self.length_norm = (k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, texts, k1=1.2, b=0.75):
+        """Indexes one text per row."""
+        vocabulary = {}
+        term_rows, term_ids, counts = [], [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            term_counts = {}
+            for token in tokens:
+                term_counts[token] = term_counts.get(token, 0) + 1
+            for token, count in term_counts.items():
+                term_rows.append(row)
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                counts.append(count)
+
+        # Group the (term, row) pairs by term; rows stay ascending within a term
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)))])
+        postings = np.array(term_rows, dtype=np.int32)[order]
+        frequencies = np.minimum(np.array(counts, dtype=np.int64)[order], np.iinfo(np.uint16).max).astype(np.uint16)
+        return cls(vocabulary, offsets.astype(np.int64), postings, frequencies, doc_lengths, k1, b)
+
+    def save(self, persist_dir, source=None):
+        """Saves the index; `source` is the `node_ids_fingerprint` of the embedding store its rows follow."""
+        path = os.path.join(persist_dir, BM25_INDEX_FILE)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, vocabulary=np.frombuffer('\n'.join(terms).encode('utf-8'), dtype=np.uint8),
+                     offsets=self.offsets, postings=self.postings, frequencies=self.frequencies,
+                     doc_lengths=self.doc_lengths, params=np.array([self.k1, self.b]), source=np.array(source or ''))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, persist_dir, count=None, source=None):
+        """Loads a persisted BM25 index, or returns None if it is missing or stale (row count is not `count`, or other `source`)."""
+        path = os.path.join(persist_dir, BM25_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if count is not None and len(data['doc_lengths']) != count:
+                return None
+            if not stored_source_matches(data, source):
+                return None
+            blob = data['vocabulary'].tobytes().decode('utf-8')
+            terms = blob.split('\n') if blob else []
+            k1, b = data['params']
+            return cls({term: i for i, term in enumerate(terms)}, data['offsets'], data['postings'],
+                       data['frequencies'], data['doc_lengths'], float(k1), float(b))
+
+    def scores(self, query: str):
+        """BM25 score of every row for a query (zero for rows sharing no term)."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            rows = self.postings[start:end]
+            tf = self.frequencies[start:end].astype(np.float32)
+            scores[rows] += self.idf[term] * tf * (self.k1 + 1) / (tf + self.length_norm[rows])
+        return scores
+
+    def search(self, query: str, top_k: int):
+        """
+        Finds the best matching rows for a query.
+
+        Returns:
+            tuple: (rows, scores) arrays, best first, only rows with a positive score.
+        """
+        if top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return matched, scores[matched]
@@ -1,22 +1,45 @@
 import os
+import sys
+import time
+import argparse
 import subprocess
-from retrieval import VectorDBBuilder
 
 def main():
-    # Backend initialization tasks (e.g., building vector DBs)
+    parser = argparse.ArgumentParser(description="Build the vector DBs and launch the chatbot.")
+    parser.add_argument('--mode', choices=['all', 'api', 'ui', 'build'], default='all',
+                        help="all: RAG service + Streamlit, api: RAG service only, ui: Streamlit only, "
+                             "build: build the vector DBs and exit.")
+    args = parser.parse_args()
     config_file = '../config/config.yaml'
-    builder = VectorDBBuilder(config_file)
-    builder.build_all_vector_dbs()
-    print("Vector DBs have been built successfully.")
+
+    # Building imports LlamaIndex and loads the embedding model, so only this mode pays for it here;
+    # the RAG service builds and warms up the DBs itself (startup.build_on_start) with its own model
+    if args.mode == 'build':
+        start = time.perf_counter()
+        from retrieval import VectorDBBuilder
+        builder = VectorDBBuilder(config_file)
+        builder.build_all_vector_dbs()
+        print(f"Vector DBs have been built successfully in {time.perf_counter() - start:.2f}s.")
+        return
+
+    # Launch the async RAG service
+    backend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'server.py'))
+    if args.mode == 'api':
+        subprocess.run([sys.executable, backend_path], check=True)
+        return
+    server = subprocess.Popen([sys.executable, backend_path]) if args.mode == 'all' else None
 
     # Define the path to the Streamlit app
     frontend_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../frontend/app.py'))
-    
-    # Launch the Streamlit app
+
+    # Launch the Streamlit app (a thin client, so it starts while the service warms up)
     try:
         subprocess.run(["streamlit", "run", frontend_path], check=True)
     except subprocess.CalledProcessError as e:
         print(f"Failed to launch Streamlit app: {e}")
+    finally:
+        if server is not None:
+            server.terminate()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,206 @@
+import re
+import time
+import threading
+from collections import OrderedDict, deque
+from context import estimate_tokens
+from lexical import tokenize
+
+# Words that point back at an earlier turn ("what about its habitat?")
+_REFERENCES = frozenset("it its they them their theirs this these those he him his she her".split())
+# Question phrasing that says nothing about the topic
+_PHRASING = frozenset("tell me about explain describe please more else does do did can could how".split())
+_FOLLOW_UP = re.compile(r"^\s*(what about|how about|and|also|what else|tell me more)\b", re.IGNORECASE)
+
+
+def clip_tokens(text: str, max_tokens: int) -> str:
+    """Cuts `text` after roughly `max_tokens` tokens, on a word boundary."""
+    words = []
+    used = 0
+    for word in text.split():
+        used += estimate_tokens(word)
+        if used > max_tokens:
+            return " ".join(words) + " ..."
+        words.append(word)
+    return " ".join(words)
+
+
+class ConversationMemory:
+    """
+    Bounded memory of one chat session.
+
+    The last `max_turns` turns are kept verbatim in a ring buffer. A turn that
+    falls out of it is folded into a rolling summary of one short line per
+    turn; when the summary outgrows `summary_tokens`, the oldest lines lose
+    their answers first and are then dropped. Everything derived from the
+    turns (topic terms, history text) is computed once per turn, so the cost
+    of a request does not grow with the length of the session.
+    """
+    def __init__(self, max_turns=6, summary_tokens=200, history_tokens=400, rewrite_turns=2,
+                 max_rewrite_terms=8, answer_tokens=60, rewrite_cache_size=32):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = deque()
+        self.summary_tokens = summary_tokens
+        self.history_tokens = history_tokens
+        self.rewrite_turns = rewrite_turns
+        self.max_rewrite_terms = max_rewrite_terms
+        self.answer_tokens = answer_tokens
+        self.rewrite_cache_size = rewrite_cache_size
+        self.rewrite_hits = 0
+        self._summary_used = 0
+        self._topic_terms = []
+        self._history = None
+        self._rewrites = OrderedDict()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add_turn(self, question, answer, retrieval_query=None):
+        """
+        Records a finished turn.
+
+        Args:
+            question (str): The question as the student typed it.
+            answer (str): The assistant's answer.
+            retrieval_query (str): The rewritten question used for retrieval, if any;
+                its terms carry the topic on to the next follow-up.
+        """
+        if len(self.turns) == self.turns.maxlen:
+            self._fold(self.turns[0])
+        self.turns.append({'question': question, 'answer': answer, 'query': retrieval_query or question})
+
+        # Invalidate everything derived from the previous turns
+        self._topic_terms = list(dict.fromkeys(
+            term for turn in list(self.turns)[-self.rewrite_turns:] for term in tokenize(turn['query'])
+            if term not in _PHRASING))
+        self._history = None
+        self._rewrites.clear()
+
+    def _fold(self, turn):
+        line = [f"Student asked: {clip_tokens(turn['question'], self.answer_tokens)}",
+                clip_tokens(turn['answer'], self.answer_tokens // 2)]
+        self.summary.append(line)
+        self._summary_used += estimate_tokens(" ".join(line))
+
+        # Compact: drop the answers of the oldest lines, then the oldest lines themselves
+        for old in self.summary:
+            if self._summary_used <= self.summary_tokens:
+                break
+            if len(old) > 1:
+                self._summary_used -= estimate_tokens(old.pop())
+        while self._summary_used > self.summary_tokens and self.summary:
+            self._summary_used -= estimate_tokens(" ".join(self.summary.popleft()))
+
+    @staticmethod
+    def is_follow_up(question):
+        # Pronouns, "what about ..." openers, or nothing but stopwords ("why?")
+        words = re.findall(r"\w+", question.lower())
+        return bool(_FOLLOW_UP.match(question)) or any(word in _REFERENCES for word in words) \
+            or not tokenize(question)
+
+    def rewrite(self, question):
+        """
+        Turns a follow-up question into a standalone retrieval query.
+
+        Follow-ups (pronouns, "what about ...", bare "why?") get the
+        topic terms of the last `rewrite_turns` questions appended, so
+        "what about its habitat?" after a question about whales retrieves
+        whale chunks. Other questions are returned unchanged. Results are
+        cached until the next turn.
+        """
+        rewritten = self._rewrites.get(question)
+        if rewritten is not None:
+            self.rewrite_hits += 1
+            self._rewrites.move_to_end(question)
+            return rewritten
+
+        rewritten = question
+        if self._topic_terms and self.is_follow_up(question):
+            present = set(tokenize(question))
+            terms = [term for term in self._topic_terms if term not in present][-self.max_rewrite_terms:]
+            if terms:
+                rewritten = f"{question} ({' '.join(terms)})"
+
+        self._rewrites[question] = rewritten
+        while len(self._rewrites) > self.rewrite_cache_size:
+            self._rewrites.popitem(last=False)
+        return rewritten
+
+    def history_text(self):
+        """The summary and the most recent turns that fit in `history_tokens`, oldest first."""
+        if self._history is not None:
+            return self._history
+
+        lines = []
+        used = 0
+        for turn in reversed(self.turns):
+            text = (f"Student: {clip_tokens(turn['question'], self.answer_tokens)}\n"
+                    f"StudentGPT: {clip_tokens(turn['answer'], self.answer_tokens)}")
+            tokens = estimate_tokens(text)
+            if used + tokens > self.history_tokens:
+                break
+            lines.append(text)
+            used += tokens
+        if self.summary:
+            summary = "Earlier: " + " | ".join(" ".join(line) for line in self.summary)
+            if used + estimate_tokens(summary) <= self.history_tokens:
+                lines.append(summary)
+        self._history = "\n".join(reversed(lines))
+        return self._history
+
+
+class SessionStore:
+    """
+    Conversation memories by session id.
+
+    Bounded by `max_sessions` (least recently active sessions are dropped
+    first) and by `ttl_seconds` of inactivity.
+    """
+    def __init__(self, max_sessions=10000, ttl_seconds=3600, **memory_options):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.memory_options = memory_options
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, memory_config):
+        """Builds a store from the `memory` section of config.yaml, or None if disabled."""
+        if not memory_config or not memory_config.get('enabled', False):
+            return None
+        return cls(
+            max_sessions=memory_config.get('max_sessions', 10000),
+            ttl_seconds=memory_config.get('ttl_seconds', 3600),
+            max_turns=memory_config.get('max_turns', 6),
+            summary_tokens=memory_config.get('summary_tokens', 200),
+            history_tokens=memory_config.get('history_tokens', 400),
+            rewrite_turns=memory_config.get('rewrite_turns', 2),
+        )
+
+    def get(self, session_id):
+        """Returns the memory of a session, starting a new one if needed."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and (self.ttl_seconds is None or now - entry[0] <= self.ttl_seconds):
+                self._sessions.move_to_end(session_id)
+            else:
+                entry = (now, ConversationMemory(**self.memory_options))
+            self._sessions[session_id] = (now, entry[1])
+
+            # Sessions are ordered by last activity, so expired ones are at the front
+            while self._sessions:
+                oldest_id, (last_active, _) = next(iter(self._sessions.items()))
+                expired = self.ttl_seconds is not None and now - last_active > self.ttl_seconds
+                if not expired and len(self._sessions) <= self.max_sessions:
+                    break
+                del self._sessions[oldest_id]
+            return entry[1]
+
+    def stats(self):
+        with self._lock:
+            memories = [memory for _, memory in self._sessions.values()]
+        return {
+            'sessions': len(memories),
+            'turns': sum(len(memory) for memory in memories),
+            'rewrite_cache_hits': sum(memory.rewrite_hits for memory in memories),
+        }
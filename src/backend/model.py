@@ -1,21 +1,479 @@
-from groq import Groq # type: ignore
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+import httpx
+from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError, APITimeoutError # type: ignore
+
+
+SECRETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.streamlit', 'secrets.toml')
+
+
+def load_api_key():
+    # Prefer the environment, fall back to the Streamlit secrets file
+    api_key = os.environ.get('GROQ_API_KEY')
+    if api_key:
+        return api_key
+    import toml
+    return toml.load(SECRETS_FILE)['groq_api_key']
+
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when the LLM stays rate limited or unreachable after every retry."""
+
+
+def _stream_stats(model, start, first_token_at, completion_tokens, chunk_count):
+    # Time-to-first-token and throughput of a finished stream
+    total_seconds = time.perf_counter() - start
+    tokens = completion_tokens if completion_tokens is not None else chunk_count
+    generation_seconds = total_seconds - (first_token_at - start) if first_token_at else 0.0
+    return {
+        "model": model,
+        "time_to_first_token": (first_token_at - start) if first_token_at else None,
+        "total_seconds": total_seconds,
+        "completion_tokens": tokens,
+        "tokens_per_second": tokens / generation_seconds if generation_seconds > 0 else None,
+    }
+
+
+def _completion_tokens(chunk):
+    # Groq reports usage on the final chunk
+    usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+    return usage.completion_tokens if usage is not None else None
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate_per_minute` requests with bursts of `capacity`."""
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, rate_per_minute / 6.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes one token and returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self.reserve())
+
+
+class ModelMetrics:
+    """Rolling latency percentiles and error counters for one model."""
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.first_token_latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, first_token_latency: float = None):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            if first_token_latency is not None:
+                self.first_token_latencies.append(first_token_latency)
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def _percentile(values, percentile):
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))]
+
+    def percentile(self, percentile: float, first_token: bool = False):
+        with self._lock:
+            return self._percentile(self.first_token_latencies if first_token else self.latencies, percentile)
+
+    def samples(self, first_token: bool = False):
+        return len(self.first_token_latencies if first_token else self.latencies)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "p50_seconds": self._percentile(self.latencies, 50),
+                "p95_seconds": self._percentile(self.latencies, 95),
+                "p95_time_to_first_token": self._percentile(self.first_token_latencies, 95),
+            }
+
+
+# Process-wide state shared by every LLMModel / AsyncLLMModel (i.e. every session)
+_shared_lock = threading.Lock()
+_http_clients = {}
+_rate_limiters = {}
+_model_metrics = {}
+
+
+def shared_http_client(max_connections: int = 100, is_async: bool = False):
+    """Returns the process-wide pooled httpx client (one sync and one async pool)."""
+    with _shared_lock:
+        key = (is_async, max_connections)
+        if key not in _http_clients:
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            _http_clients[key] = httpx.AsyncClient(limits=limits) if is_async else httpx.Client(limits=limits)
+        return _http_clients[key]
+
+
+async def close_shared_async_client(max_connections: int = 100):
+    # The async pool is bound to the event loop that used it, so it is closed with the server
+    with _shared_lock:
+        client = _http_clients.pop((True, max_connections), None)
+    if client is not None:
+        await client.aclose()
+
+
+def model_rate_limiter(model: str, rate_per_minute: float):
+    with _shared_lock:
+        if model not in _rate_limiters:
+            _rate_limiters[model] = TokenBucket(rate_per_minute)
+        return _rate_limiters[model]
+
+
+def model_metrics(model: str):
+    with _shared_lock:
+        if model not in _model_metrics:
+            _model_metrics[model] = ModelMetrics()
+        return _model_metrics[model]
+
+
+def llm_metrics():
+    """Returns latency and error metrics for every model used in this process."""
+    with _shared_lock:
+        metrics = dict(_model_metrics)
+    return {model: model_metric.snapshot() for model, model_metric in metrics.items()}
+
+
+class _ClientPolicy:
+    """Retry, rate limit and hedging settings from the `llm_client` config section."""
+    def __init__(self, client_config: dict = None, fallback_models: dict = None):
+        client_config = client_config or {}
+        self.base_url = client_config.get("base_url")
+        self.timeout = client_config.get("timeout_seconds", 30)
+        self.max_connections = client_config.get("max_connections", 100)
+        self.max_retries = client_config.get("max_retries", 3)
+        self.backoff_base = client_config.get("backoff_base_seconds", 0.5)
+        self.backoff_max = client_config.get("backoff_max_seconds", 8)
+        self.requests_per_minute = client_config.get("requests_per_minute")
+        self.hedge = client_config.get("hedge", False)
+        self.hedge_percentile = client_config.get("hedge_percentile", 95)
+        self.hedge_min_samples = client_config.get("hedge_min_samples", 20)
+        self.fallback_models = fallback_models or {}
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (APIConnectionError, APITimeoutError)):
+            return True
+        return isinstance(error, APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+    def delay(self, attempt, error):
+        # Honour retry-after on 429s, otherwise exponential backoff with jitter
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+            if retry_after is not None:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0.5, 1.0) * min(self.backoff_max, self.backoff_base * 2 ** attempt)
+
+    def rate_limiter(self, model):
+        return model_rate_limiter(model, self.requests_per_minute) if self.requests_per_minute else None
+
+    def hedge_threshold(self, model, first_token=False):
+        if not self.hedge or model not in self.fallback_models:
+            return None
+        metrics = model_metrics(model)
+        if metrics.samples(first_token) < self.hedge_min_samples:
+            return None
+        return metrics.percentile(self.hedge_percentile, first_token)
+
+    def failure(self, model, error):
+        metrics = model_metrics(model)
+        metrics.count("errors")
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            return LLMUnavailableError(
+                "The assistant is receiving too many questions right now. Please try again in a moment.")
+        if self.is_retryable(error):
+            return LLMUnavailableError(f"The language model is unavailable right now ({model}): {error}")
+        return RuntimeError(f"LLM API call failed: {error}")
+
 
 class LLMModel:
-    def __init__(self, api_key: str):
-        self.client = Groq(api_key=api_key)
+    """
+    Synchronous Groq client with pooled connections, per-model rate limiting,
+    retries with backoff and latency/error metrics.
+    """
+    def __init__(self, api_key: str, client_config: dict = None, fallback_models: dict = None):
+        self.policy = _ClientPolicy(client_config, fallback_models)
+        self.client = Groq(
+            api_key=api_key,
+            base_url=self.policy.base_url,
+            timeout=self.policy.timeout,
+            max_retries=0,  # retries are handled here so they are rate limited and counted
+            http_client=shared_http_client(self.policy.max_connections),
+        )
+        self.last_stream_stats = None
+
+    def _create(self, model, prompt, max_tokens, stream):
+        return self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            stream=stream,
+        )
+
+    def _with_retries(self, model, call):
+        metrics = model_metrics(model)
+        rate_limiter = self.policy.rate_limiter(model)
+        for attempt in range(self.policy.max_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            try:
+                return call()
+            except Exception as e:
+                if isinstance(e, APIStatusError) and e.status_code == 429:
+                    metrics.count("rate_limited")
+                if not self.policy.is_retryable(e) or attempt == self.policy.max_retries:
+                    raise self.policy.failure(model, e) from e
+                metrics.count("retries")
+                time.sleep(self.policy.delay(attempt, e))
 
     def generate_response(self, model: str, prompt: str, max_tokens: int):
+        start = time.perf_counter()
+        completion = self._with_retries(model, lambda: self._create(model, prompt, max_tokens, stream=False))
+        model_metrics(model).record(time.perf_counter() - start)
+
+        # Extract the content from the response
+        response_text = completion.choices[0].message.content
+        return response_text
+
+    def stream_response(self, model: str, prompt: str, max_tokens: int):
+        """
+        Streams the completion as text deltas while it is being generated.
+
+        Opening the stream is retried; once text has been yielded a failure is
+        raised instead. When the stream is exhausted, `last_stream_stats` holds
+        the time-to-first-token, total time, completion tokens and tokens/sec.
+
+        Yields:
+            str: The next piece of the response text.
+        """
+        start = time.perf_counter()
+        first_token_at = None
+        completion_tokens = None
+        chunk_count = 0
+        stream = self._with_retries(model, lambda: self._create(model, prompt, max_tokens, stream=True))
         try:
-            completion = self.client.chat.completions.create(
-                model=model,
+            for chunk in stream:
+                completion_tokens = _completion_tokens(chunk) or completion_tokens
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunk_count += 1
+                    yield delta
+        except Exception as e:
+            raise self.policy.failure(model, e) from e
+
+        self.last_stream_stats = _stream_stats(model, start, first_token_at, completion_tokens, chunk_count)
+        model_metrics(model).record(self.last_stream_stats["total_seconds"],
+                                    self.last_stream_stats["time_to_first_token"])
+
+
+class AsyncLLMModel:
+    """
+    Async Groq client for the serving backend.
+
+    One instance is shared by all requests; its HTTP connections are pooled
+    and kept alive between calls. Besides the retries and rate limiting of
+    `LLMModel`, a request that is slower than the model's recent p95 latency
+    is hedged: the same prompt is sent to the model's fallback and whichever
+    answers first wins.
+    """
+    def __init__(self, api_key: str, client_config: dict = None, fallback_models: dict = None):
+        self.policy = _ClientPolicy(client_config, fallback_models)
+        self.client = AsyncGroq(
+            api_key=api_key,
+            base_url=self.policy.base_url,
+            timeout=self.policy.timeout,
+            max_retries=0,
+            http_client=shared_http_client(self.policy.max_connections, is_async=True),
+        )
+
+    async def close(self):
+        await close_shared_async_client(self.policy.max_connections)
+
+    async def _with_retries(self, model, call):
+        metrics = model_metrics(model)
+        rate_limiter = self.policy.rate_limiter(model)
+        for attempt in range(self.policy.max_retries + 1):
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async()
+            try:
+                return await call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, APIStatusError) and e.status_code == 429:
+                    metrics.count("rate_limited")
+                if not self.policy.is_retryable(e) or attempt == self.policy.max_retries:
+                    raise self.policy.failure(model, e) from e
+                metrics.count("retries")
+                await asyncio.sleep(self.policy.delay(attempt, e))
+
+    async def _hedged(self, model, start_attempt, first_token=False, discard=None):
+        """
+        Runs `start_attempt(model)`, hedging with the fallback model when it is
+        slower than the model's p95 latency.
+
+        The losing attempt is cancelled; if it had already succeeded, its
+        result is passed to the async `discard` (e.g. to close an open stream).
+
+        Returns:
+            tuple: (model that answered, result of its attempt).
+        """
+        threshold = self.policy.hedge_threshold(model, first_token)
+        primary = asyncio.ensure_future(start_attempt(model))
+        if threshold is None:
+            return model, await primary
+
+        attempts = {primary: model}
+        pending = {primary}
+        winner = None
+        # Everything after the primary starts is inside the try, so a cancelled
+        # caller cancels the primary too, even before the hedge is sent
+        try:
+            done, pending = await asyncio.wait(pending, timeout=threshold)
+            if done:
+                winner = primary
+                return model, primary.result()
+
+            fallback_model = self.policy.fallback_models[model]
+            model_metrics(model).count("hedged")
+            backup = asyncio.ensure_future(start_attempt(fallback_model))
+            attempts[backup] = fallback_model
+            pending.add(backup)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        if task is backup:
+                            model_metrics(model).count("hedge_wins")
+                        return attempts[task], task.result()
+            # Both attempts failed; surface the primary model's error
+            raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let cancelled attempts clean up before their connections go back to the pool
+            await asyncio.gather(*pending, return_exceptions=True)
+            if discard is not None:
+                for task in attempts:
+                    if task is not winner and not task.cancelled() and task.exception() is None:
+                        await discard(task.result())
+
+    async def generate_response(self, model: str, prompt: str, max_tokens: int):
+        async def attempt(attempt_model):
+            start = time.perf_counter()
+            completion = await self._with_retries(attempt_model, lambda: self.client.chat.completions.create(
+                model=attempt_model,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=max_tokens,
                 stream=False,
+            ))
+            model_metrics(attempt_model).record(time.perf_counter() - start)
+            return completion.choices[0].message.content
+
+        _, response_text = await self._hedged(model, attempt)
+        return response_text
+
+    async def _open_stream(self, model, prompt, max_tokens):
+        # Opens a stream and waits for its first text delta, retrying failures before it
+        async def first_delta():
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=True,
             )
+            usage = {"completion_tokens": None}
+            chunks = stream.__aiter__()
+            try:
+                async for chunk in chunks:
+                    usage["completion_tokens"] = _completion_tokens(chunk) or usage["completion_tokens"]
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        return chunk.choices[0].delta.content, stream, chunks, usage
+            except BaseException:
+                # Also on cancellation by a winning hedge: release the pooled connection
+                await stream.close()
+                raise
+            return None, stream, chunks, usage
+
+        return await self._with_retries(model, first_delta)
+
+    async def stream_response(self, model: str, prompt: str, max_tokens: int, stats: dict = None):
+        """
+        Async version of `LLMModel.stream_response`, hedged on time-to-first-token.
+
+        Since the instance is shared by concurrent requests, stream stats are
+        written into the caller's `stats` dict instead of an attribute.
+        """
+        async def close_stream(opened):
+            await opened[1].close()
+
+        start = time.perf_counter()
+        used_model, (first, stream, chunks, usage) = await self._hedged(
+            model, lambda attempt_model: self._open_stream(attempt_model, prompt, max_tokens),
+            first_token=True, discard=close_stream)
+        first_token_at = time.perf_counter() if first is not None else None
+        chunk_count = 0
+        try:
+            if first is not None:
+                chunk_count += 1
+                yield first
 
-            # Extract the content from the response
-            response_text = completion.choices[0].message.content
-            return response_text
+            async for chunk in chunks:
+                usage["completion_tokens"] = _completion_tokens(chunk) or usage["completion_tokens"]
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunk_count += 1
+                    yield delta
         except Exception as e:
-            raise RuntimeError(f"LLM API call failed: {e}")
+            raise self.policy.failure(used_model, e) from e
+        finally:
+            await stream.close()
 
+        stream_stats = _stream_stats(used_model, start, first_token_at, usage["completion_tokens"], chunk_count)
+        model_metrics(used_model).record(stream_stats["total_seconds"], stream_stats["time_to_first_token"])
+        if stats is not None:
+            stats.update(stream_stats)
@@ -0,0 +1,19 @@
+NO_ANSWER = "Sorry, I can only answer questions based on the books for your grade."
+
+# Built once; the context, conversation history and question are the only per-request parts
+PROMPT_TEMPLATE = (
+    "StudentGPT, a chatbot that answers students' questions based on their grade and the relevant books. "
+    "Communicates in clear, easy language, answer is short and brief.\n"
+    "Context:\n{context}\n"
+    "Please respond to the following question. Use the context above if it is helpful. "
+    f"If not helpful please respond with \"{NO_ANSWER}\"\n"
+    "{history}"
+    "User Prompt:\n{question}"
+)
+
+
+def build_prompt(context: str, question: str, history: str = "") -> str:
+    """Combines the retrieved context and the conversation so far with the student's question."""
+    if history:
+        history = f"Conversation so far:\n{history}\n"
+    return PROMPT_TEMPLATE.format(context=context, question=question, history=history)
@@ -1,24 +1,377 @@
 import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import yaml
+import numpy as np
 from utils import TextCleaner, DocumentProcessor
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import Settings, SimpleDirectoryReader, VectorStoreIndex, StorageContext
-from llama_index.core.retrievers import VectorIndexRetriever
+from embedding import (JSON_VECTOR_STORE_FILE, EmbeddingStore, MmapVectorStore, RemoteEmbedding, convert_json_vector_store,
+                       load_embed_model)
+from search import IVFIndex, Int8SearchIndex, build_search_index, normalize_rows
+from lexical import BM25Index, reciprocal_rank_fusion
+from ingestion import IngestionPipeline
+from shared import EMBEDDING_SOCKET_FILE, SharedGrade
+import tracing
+from llama_index.core import Settings, VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core.retrievers import BaseRetriever, VectorIndexRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.postprocessor import SimilarityPostprocessor
 
 
+BUILD_MANIFEST_FILE = 'build_manifest.json'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def directory_versions(target_path):
+    """Returns the version numbers of the `<target>@<n>` directories next to `target_path`."""
+    parent, name = os.path.split(os.path.abspath(target_path))
+    versions = []
+    for entry in os.listdir(parent) if os.path.isdir(parent) else []:
+        suffix = entry[len(name) + 1:]
+        if entry.startswith(name + '@') and suffix.isdigit():
+            versions.append(int(suffix))
+    return sorted(versions)
+
+
+def swap_directory(new_path, target_path, keep_versions=2):
+    """
+    Publishes `new_path` as `target_path` without readers ever seeing a missing or partial DB.
+
+    The new directory becomes the versioned sibling `<target>@<n>`, and
+    `target_path` is a symlink to the current version that is replaced
+    atomically with `os.replace`. Readers that resolve the link once (see
+    `resolve_directory`) read one complete version; the newest
+    `keep_versions` versions are kept for readers that resolved the link just
+    before a swap. A `target_path` that is still a plain directory (persisted
+    before versioning) is moved aside on its first swap, leaving the path
+    missing for that one rename.
+    """
+    versions = directory_versions(target_path)
+    version = (versions[-1] if versions else 0) + 1
+    version_path = f'{target_path}@{version}'
+    os.rename(new_path, version_path)
+
+    old_path = target_path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.isdir(target_path) and not os.path.islink(target_path):
+        os.rename(target_path, old_path)
+    link_path = target_path + '.link'
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_path), link_path)
+    os.replace(link_path, target_path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+    for old_version in versions[:max(len(versions) + 1 - keep_versions, 0)]:
+        shutil.rmtree(f'{target_path}@{old_version}', ignore_errors=True)
+
+
+def resolve_directory(path):
+    """Resolves a DB path to the version it currently points at, so all of its files are read from one version."""
+    return os.path.realpath(path)
+
+
+def _current_rss_bytes():
+    """Returns the resident set size of this process in bytes, or 0 if unknown."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def persist_dir_fingerprint(persist_dir, mode='mtime'):
+    """
+    Computes a cheap fingerprint of a persisted vector DB directory.
+
+    Args:
+        persist_dir (str): Path to the persisted vector DB.
+        mode (str): 'mtime' uses file sizes and modification times,
+            'hash' hashes the file contents (slower but immune to touch/copy).
+    Returns:
+        tuple: A hashable value that changes whenever the stores change.
+    """
+    entries = []
+    for name in sorted(os.listdir(persist_dir)):
+        path = os.path.join(persist_dir, name)
+        if not os.path.isfile(path):
+            continue
+        if mode == 'hash':
+            digest = hashlib.md5()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            entries.append((name, digest.hexdigest()))
+        else:
+            stat = os.stat(path)
+            entries.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(entries)
+
+
+class QueryEngineRegistry:
+    """
+    Process-wide, thread-safe registry of loaded per-grade query engines.
+
+    Each grade is loaded lazily on first use and reused until the persisted
+    directory changes on disk. File sizes and modification times are checked
+    on every lookup; with `fingerprint_mode='hash'` the contents are hashed
+    only when those change. When `max_grades` is set, the least recently used
+    grade is evicted once the registry grows past it.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_grades=None, fingerprint_mode='mtime'):
+        self.max_grades = max_grades
+        self.fingerprint_mode = fingerprint_mode
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._grade_locks = {}
+
+    @classmethod
+    def shared(cls, max_grades=None, fingerprint_mode='mtime'):
+        """Returns the process-wide registry for these settings, so builders with other settings don't change it."""
+        with cls._shared_lock:
+            key = (max_grades, fingerprint_mode)
+            if key not in cls._shared:
+                cls._shared[key] = cls(max_grades, fingerprint_mode)
+            return cls._shared[key]
+
+    def _lookup(self, grade, stat_fingerprint, fingerprint=None):
+        # Caller must hold self._lock; returns the cached engine if it is still current
+        entry = self._entries.get(grade)
+        if entry is None:
+            return None
+        if entry['stat'] != stat_fingerprint:
+            if fingerprint is None or entry['fingerprint'] != fingerprint:
+                return None
+            entry['stat'] = stat_fingerprint  # touched or copied, but the same contents
+        self._entries.move_to_end(grade)
+        entry['hits'] += 1
+        return entry['engine']
+
+    def get(self, grade, persist_dir, loader):
+        """
+        Returns the cached engine for a grade, loading it with `loader` if needed.
+
+        Args:
+            grade (str): Grade name used as the cache key.
+            persist_dir (str): Directory whose contents back the engine.
+            loader (callable): Zero-argument callable building the engine.
+        Returns:
+            The query engine returned by `loader`.
+        """
+        stat_fingerprint = persist_dir_fingerprint(persist_dir)
+        with self._lock:
+            engine = self._lookup(grade, stat_fingerprint)
+            if engine is not None:
+                return engine
+            grade_lock = self._grade_locks.setdefault(grade, threading.Lock())
+
+        # Hash (in 'hash' mode) and load outside the registry lock so other grades stay servable
+        with grade_lock:
+            fingerprint = stat_fingerprint
+            if self.fingerprint_mode == 'hash':
+                fingerprint = persist_dir_fingerprint(persist_dir, 'hash')
+            with self._lock:
+                engine = self._lookup(grade, stat_fingerprint, fingerprint)
+                if engine is not None:
+                    return engine
+                entry = self._entries.get(grade)
+
+            rss_before = _current_rss_bytes()
+            start = time.perf_counter()
+            engine = loader()
+            load_seconds = time.perf_counter() - start
+            memory_bytes = max(_current_rss_bytes() - rss_before, 0)
+            tracing.record('vector_db_load', load_seconds, grade=grade, memory_bytes=memory_bytes)
+
+            with self._lock:
+                reloads = entry['reloads'] + 1 if entry is not None else 0
+                self._entries[grade] = {
+                    'engine': engine,
+                    'stat': stat_fingerprint,
+                    'fingerprint': fingerprint,
+                    'load_seconds': load_seconds,
+                    'memory_bytes': memory_bytes,
+                    'loaded_at': time.time(),
+                    'hits': 0,
+                    'reloads': reloads,
+                }
+                self._entries.move_to_end(grade)
+                self._evict()
+            return engine
+
+    def _evict(self):
+        # Caller must hold self._lock
+        if not self.max_grades:
+            return
+        while len(self._entries) > self.max_grades:
+            grade, _ = self._entries.popitem(last=False)
+            print(f"Evicted query engine for {grade} from the registry.")
+
+    def invalidate(self, grade=None):
+        """Drops one grade (or every grade) so it is reloaded on next use."""
+        with self._lock:
+            if grade is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(grade, None)
+
+    def stats(self):
+        """Returns load time, memory and usage counters for each loaded grade."""
+        with self._lock:
+            return {
+                grade: {key: value for key, value in entry.items() if key not in ('engine', 'stat', 'fingerprint')}
+                for grade, entry in self._entries.items()
+            }
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    Retriever that scores a grade's pre-normalized embedding matrix with NumPy,
+    either exhaustively or through an approximate IVF or int8 index.
+
+    Top-k selection and the similarity cutoff both happen inside the search,
+    so no `SimilarityPostprocessor` is needed and nodes below the cutoff are
+    never fetched from the docstore.
+
+    With a `lexical_index`, the vector ranking is fused with a BM25 ranking by
+    reciprocal rank fusion, so chunks that share rare terms with the question
+    are found even when their embedding falls below the cutoff. Such
+    lexical-only hits need a BM25 score of at least `lexical_min_score`, so an
+    off-topic question that shares a common word with a chunk still finds
+    nothing. Node scores stay cosine similarities; the fused score is in the
+    node's `rrf_score` metadata (hidden from the LLM and the embedder).
+    """
+    def __init__(self, embedding_store, docstore, search_index, top_k, similarity_cutoff=None, embed_model=None,
+                 lexical_index=None, rrf_k=60, lexical_min_score=0.0):
+        super().__init__()
+        self.lexical_index = lexical_index
+        self.rrf_k = rrf_k
+        self.lexical_min_score = lexical_min_score
+        self.embedding_store = embedding_store
+        self.docstore = docstore
+        self.search_index = search_index
+        self.top_k = top_k
+        self.similarity_cutoff = similarity_cutoff
+        self.embed_model = embed_model or Settings.embed_model
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list:
+        return self.retrieve_batch([query_bundle])[0]
+
+    def retrieve_batch(self, queries: list) -> list:
+        """
+        Retrieves nodes for several queries with one matrix product.
+
+        Args:
+            queries (list): Query strings or QueryBundle objects. Bundles that
+                already carry an embedding are not re-embedded.
+        Returns:
+            list: One list of NodeWithScore per query, best first.
+        """
+        bundles = [QueryBundle(q) if isinstance(q, str) else q for q in queries]
+        if not bundles:
+            return []
+        missing = [bundle for bundle in bundles if bundle.embedding is None]
+        if missing:
+            texts = [bundle.query_str for bundle in missing]
+            with tracing.span('query_embedding', queries=len(texts)):
+                if hasattr(self.embed_model, 'get_query_embedding_batch'):
+                    embeddings = self.embed_model.get_query_embedding_batch(texts)
+                else:
+                    embeddings = self.embed_model.get_text_embedding_batch(texts)
+            for bundle, embedding in zip(missing, embeddings):
+                bundle.embedding = embedding
+
+        with tracing.span('vector_search', queries=len(bundles)):
+            results = self.search_index.search(
+                [bundle.embedding for bundle in bundles], self.top_k, self.similarity_cutoff)
+        if self.lexical_index is not None:
+            with tracing.span('lexical_search', queries=len(bundles)):
+                results = [self._fuse(bundle, rows, scores) for bundle, (rows, scores) in zip(bundles, results)]
+        with tracing.span('postprocessing', queries=len(bundles)):
+            return [self._to_nodes(*result) for result in results]
+
+    def _fuse(self, bundle, vector_rows, vector_scores):
+        # Vector hits already passed the similarity cutoff; lexical ones must clear the BM25 floor
+        lexical_rows, lexical_scores = self.lexical_index.search(bundle.query_str, self.top_k)
+        lexical_rows = lexical_rows[lexical_scores >= self.lexical_min_score]
+        rows, rrf_scores = reciprocal_rank_fusion([vector_rows, lexical_rows], self.rrf_k)
+        rows, rrf_scores = rows[:self.top_k], rrf_scores[:self.top_k]
+
+        # Keep cosine scores on the nodes; score the lexical-only hits against their stored embeddings
+        cosine = dict(zip(vector_rows.tolist(), vector_scores.tolist()))
+        missing = [row for row in rows.tolist() if row not in cosine]
+        if missing:
+            query = normalize_rows(bundle.embedding)[0]
+            cosine.update(zip(missing, (self.embedding_store.matrix[missing] @ query).tolist()))
+        return rows, np.array([cosine[row] for row in rows.tolist()], dtype=np.float32), rrf_scores
+
+    def _to_nodes(self, rows, scores, rrf_scores=None):
+        node_ids = [self.embedding_store.node_ids[row] for row in rows]
+        nodes = self.docstore.get_nodes(node_ids)
+        # Attach the stored embeddings so the context builder can dedupe without re-embedding
+        for node, row in zip(nodes, rows):
+            node.embedding = self.embedding_store.matrix[row].tolist()
+        if rrf_scores is not None:
+            # Copies, so concurrent queries don't write into the shared docstore's nodes
+            nodes = [node.model_copy(update={
+                'metadata': {**node.metadata, 'rrf_score': float(rrf_score)},
+                'excluded_llm_metadata_keys': node.excluded_llm_metadata_keys + ['rrf_score'],
+                'excluded_embed_metadata_keys': node.excluded_embed_metadata_keys + ['rrf_score'],
+            }) for node, rrf_score in zip(nodes, rrf_scores)]
+        return [NodeWithScore(node=node, score=float(score)) for node, score in zip(nodes, scores)]
+
+
 class VectorDBBuilder:
-    def __init__(self, config_file):
+    def __init__(self, config_file, embed_model=None):
         self.config = self.load_config(config_file)
+        tracing.configure(self.config.get('tracing'))
         self.root_dir = self.config['root_dir']
         self.databases_dir = self.config['databases_dir']
         self.grades = self.config['grades']
         self.embedding_model = self.config['embedding_model']
         self.query_config = self.config['query_config']
+        self.engine_cache_config = self.config.get('engine_cache', {})
+        self.embedding_store_config = self.config.get('embedding_store', {})
+        self.embedding_service_config = self.config.get('embedding_service', {})
+        self.ingestion_config = self.config.get('ingestion', {})
+        self.hybrid_config = self.query_config.get('hybrid', {})
+        self.shared_store_config = self.config.get('shared_store', {})
+
+        # Shared by every builder in the process with the same registry settings (Streamlit sessions, main.py, ...)
+        self.engine_registry = QueryEngineRegistry.shared(
+            self.engine_cache_config.get('max_loaded_grades'),
+            self.engine_cache_config.get('fingerprint', 'mtime'),
+        )
 
-        # Define the embedding model
-        Settings.embed_model = HuggingFaceEmbedding(model_name=self.embedding_model['name'])
+        # Define the embedding model (shared by every builder and session in the process)
+        if embed_model is not None:
+            Settings.embed_model = embed_model
+        elif self.uses_shared_store and self.shared_store_config.get('serve_embeddings', False):
+            # Workers embed queries through the loader's model instead of loading their own
+            Settings.embed_model = RemoteEmbedding(
+                os.path.join(self.shared_store_config.get('path', '/dev/shm/llm-chatbot'), EMBEDDING_SOCKET_FILE),
+                self.embedding_model['name'],
+                embed_batch_size=self.embedding_service_config.get('max_batch_size', 32),
+            )
+        else:
+            Settings.embed_model = load_embed_model(self.embedding_model['name'], self.embedding_service_config,
+                                                    self.ingestion_config.get('embed_batch_size', 64))
         Settings.llm = None  # we won't use LlamaIndex to set up LLM
         Settings.chunk_size = self.embedding_model['chunk_size']
         Settings.chunk_overlap = self.embedding_model['chunk_overlap']
@@ -26,46 +379,259 @@ class VectorDBBuilder:
         # Initialize the text cleaner and document processor
         self.text_cleaner = TextCleaner()
         self.document_processor = DocumentProcessor(self.text_cleaner)
+        self.ingestion_pipeline = IngestionPipeline.from_config(self.ingestion_config)
 
+    @tracing.traced('config_load')
     def load_config(self, config_file):
         with open(config_file, 'r') as f:
             config = yaml.safe_load(f)
         return config
 
-    def build_vector_db(self, grade):
+    def load_manifest(self, vector_db_path):
+        # The manifest records the content hash and document ids of every source file
+        manifest_path = os.path.join(vector_db_path, BUILD_MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+
+    def build_vector_db(self, grade, rebuild=False):
+        """
+        Builds or incrementally updates the vector DB of a grade.
+
+        Only files whose content hash changed since the last build are parsed
+        and cleaned again; within them, pages whose `doc_hash` is unchanged keep
+        their embeddings. Nodes of removed files are deleted. The updated DB is
+        written to a temporary directory and swapped in at the end.
+
+        Args:
+            grade (str): Grade to build.
+            rebuild (bool): Rebuild a DB persisted without a build manifest.
+        """
+        with tracing.span('build_vector_db', grade=grade):
+            self._build_vector_db(grade, rebuild)
+
+    def _build_vector_db(self, grade, rebuild=False):
         # Define the directory for the current grade
         grade_dir = os.path.join(self.root_dir, grade)
-
-        # Check if VectorDB for this grade already exists
         vector_db_path = os.path.join(self.databases_dir, f'{grade}_vector_db')
-        if os.path.exists(os.path.join(vector_db_path, "docstore.json")):
-            print(f"VectorDB for {grade} already exists. Skipping...")
+        db_exists = os.path.exists(os.path.join(vector_db_path, "docstore.json"))
+        manifest = self.load_manifest(vector_db_path) if db_exists else None
+
+        # DBs persisted before build manifests existed can't be updated incrementally
+        if db_exists and manifest is None and not rebuild:
+            # Convert DBs persisted before the binary embedding store existed
+            if not EmbeddingStore.exists(vector_db_path):
+                convert_json_vector_store(vector_db_path, dtype=self.embedding_store_config.get('dtype', 'float32'))
+            self.write_search_index(vector_db_path)
+            self.write_lexical_index(vector_db_path)
+            print(f"VectorDB for {grade} already exists without a build manifest. Skipping...")
+            return
+        if not os.path.isdir(grade_dir):
+            if db_exists:
+                print(f"No source directory {grade_dir}; keeping the existing VectorDB for {grade}.")
+                return
+            raise FileNotFoundError(f"No source directory found for {grade}: {grade_dir}")
+
+        # Hash every source file and compare with the previous build
+        previous_files = manifest['files'] if manifest else {}
+        with tracing.span('ingest_hash_files', grade=grade):
+            current_hashes = {
+                name: file_sha256(os.path.join(grade_dir, name))
+                for name in sorted(os.listdir(grade_dir))
+                if not name.startswith('.') and os.path.isfile(os.path.join(grade_dir, name))
+            }
+        changed = [name for name, digest in current_hashes.items()
+                   if previous_files.get(name, {}).get('sha256') != digest]
+        removed = [name for name in previous_files if name not in current_hashes]
+        reused = len(current_hashes) - len(changed)
+
+        if db_exists and manifest is not None and not changed and not removed:
+            if not EmbeddingStore.exists(vector_db_path):
+                convert_json_vector_store(vector_db_path, dtype=self.embedding_store_config.get('dtype', 'float32'))
+            self.write_search_index(vector_db_path)
+            self.write_lexical_index(vector_db_path)
+            print(f"VectorDB for {grade} is up to date ({reused} files reused). Skipping...")
             return
 
-        # Get the list of files in the directory
-        documents = SimpleDirectoryReader(grade_dir).load_data()
+        # Start from the existing index so unchanged files keep their embeddings
+        if db_exists and manifest is not None:
+            if EmbeddingStore.exists(vector_db_path):
+                vector_store = EmbeddingStore.load(vector_db_path).to_simple_vector_store()
+                storage_context = StorageContext.from_defaults(persist_dir=vector_db_path, vector_store=vector_store)
+            else:
+                storage_context = StorageContext.from_defaults(persist_dir=vector_db_path)
+            index = load_index_from_storage(storage_context)
+        else:
+            index = VectorStoreIndex(nodes=[])
+
+        # Drop every document of removed files
+        for name in removed:
+            for doc_id in previous_files[name]['doc_ids']:
+                index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+        # Parse, clean and embed new or changed files in the ingestion pipeline;
+        # unchanged pages are skipped via doc_hash
+        files = dict(previous_files)
+        for name in removed:
+            del files[name]
+        pages_embedded = 0
+        pages_reused = 0
+        if changed:
+            doc_ids_by_path, pages_embedded, pages_reused = self.ingestion_pipeline.run(
+                index, [os.path.join(grade_dir, name) for name in changed])
+            for name in changed:
+                doc_ids = doc_ids_by_path[os.path.join(grade_dir, name)]
+                # Pages that disappeared from a changed file
+                stale_ids = set(previous_files.get(name, {}).get('doc_ids', [])) - set(doc_ids)
+                for doc_id in stale_ids:
+                    index.delete_ref_doc(doc_id, delete_from_docstore=True)
+                files[name] = {'sha256': current_hashes[name], 'doc_ids': doc_ids}
+
+        # Persist to a temporary directory and swap it in atomically
+        tmp_path = vector_db_path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        with tracing.span('ingest_persist', grade=grade):
+            index.storage_context.persist(tmp_path)
+            self.write_embedding_store(index, tmp_path)
+            # The binary store replaces the JSON vector store, so vectors are only kept once
+            os.remove(os.path.join(tmp_path, JSON_VECTOR_STORE_FILE))
+        with tracing.span('ingest_search_indexes', grade=grade):
+            self.write_search_index(tmp_path, force=True)
+            self.write_lexical_index(tmp_path, docstore=index.docstore, force=True)
+        with open(os.path.join(tmp_path, BUILD_MANIFEST_FILE), 'w') as f:
+            json.dump({'files': files}, f, indent=2)
+        swap_directory(tmp_path, vector_db_path)
 
-        # Clean and process the documents
-        cleaned_documents = self.document_processor.process_documents(documents)
+        print(f"Index saved to {vector_db_path}: {reused} files reused, {len(changed)} files re-read, "
+              f"{len(removed)} files removed; {pages_embedded} pages embedded, {pages_reused} pages reused.")
 
-        # Create the index with the cleaned documents
-        index = VectorStoreIndex.from_documents(cleaned_documents)
+    def write_embedding_store(self, index, vector_db_path):
+        # Save the embeddings as a memory-mappable binary matrix next to the docstore
+        vector_store_data = index.vector_store.data
+        node_ids = list(vector_store_data.embedding_dict.keys())
+        EmbeddingStore.write(
+            vector_db_path,
+            node_ids,
+            [vector_store_data.embedding_dict[node_id] for node_id in node_ids],
+            [vector_store_data.text_id_to_ref_doc_id.get(node_id) for node_id in node_ids],
+            dtype=self.embedding_store_config.get('dtype', 'float32'),
+        )
 
-        # Save the index to the persist directory
-        index.storage_context.persist(vector_db_path)
-        print(f"Index saved to {vector_db_path}")
+    def write_search_index(self, vector_db_path, force=False):
+        # Build the approximate (IVF) or quantized (int8) search index when the config asks for one
+        index_config = self.query_config.get('index', {})
+        index_type = index_config.get('type', 'exact')
+        if index_type not in ('ivf', 'int8'):
+            return
+        store = EmbeddingStore.load(vector_db_path)
+        if len(store) < index_config.get('min_size', 0):
+            return
+        if index_type == 'int8':
+            if not force and Int8SearchIndex.load(vector_db_path, store.matrix, source=store.fingerprint) is not None:
+                return
+            int8_index = Int8SearchIndex.build(store.matrix)
+            int8_index.save(vector_db_path, store.fingerprint)
+            print(f"int8 index ({int8_index.nbytes / 2 ** 20:.2f} MB) saved to {vector_db_path}")
+            return
+        if not force and IVFIndex.load(vector_db_path, store.matrix, source=store.fingerprint) is not None:
+            return
+        ivf_index = IVFIndex.build(store.matrix, index_config.get('nlist'))
+        ivf_index.save(vector_db_path, store.fingerprint)
+        print(f"IVF index with {ivf_index.nlist} lists saved to {vector_db_path}")
+
+    def write_lexical_index(self, vector_db_path, docstore=None, force=False):
+        # Index the cleaned chunk texts with BM25, row-aligned with the embedding store
+        if not self.hybrid_config.get('enabled', False):
+            return
+        store = EmbeddingStore.load(vector_db_path)
+        if not force and BM25Index.load(vector_db_path, len(store), store.fingerprint) is not None:
+            return
+        if docstore is None:
+            docstore = StorageContext.from_defaults(persist_dir=vector_db_path).docstore
+        texts = [node.get_content(metadata_mode=MetadataMode.NONE) for node in docstore.get_nodes(store.node_ids)]
+        bm25_index = BM25Index.build(texts, self.hybrid_config.get('k1', 1.2), self.hybrid_config.get('b', 0.75))
+        bm25_index.save(vector_db_path, store.fingerprint)
+        print(f"BM25 index with {len(bm25_index.vocabulary)} terms saved to {vector_db_path}")
 
- 
     def build_all_vector_dbs(self):
-        for grade in self.grades:
-            self.build_vector_db(grade)
+        # Build grades concurrently; they share the pipeline's process pool
+        grade_workers = self.ingestion_config.get('grade_workers', 1)
+        try:
+            with ThreadPoolExecutor(max_workers=grade_workers) as executor:
+                for _ in executor.map(self.build_vector_db, self.grades):
+                    pass
+        finally:
+            self.ingestion_pipeline.shutdown()
+
+    def load_lexical_index(self, persist_dir, store):
+        if not self.hybrid_config.get('enabled', False):
+            return None
+        lexical_index = BM25Index.load(persist_dir, len(store), store.fingerprint)
+        if lexical_index is None:
+            print(f"No up-to-date BM25 index in {persist_dir}; using vector search only.")
+        return lexical_index
+
+    @property
+    def uses_shared_store(self):
+        return self.shared_store_config.get('enabled', False)
+
+    def grade_source_dir(self, grade):
+        """Where a grade is loaded from: its persisted DB, or its directory in the shared store."""
+        if self.uses_shared_store:
+            return os.path.join(self.shared_store_config.get('path', '/dev/shm/llm-chatbot'), grade)
+        return os.path.join(self.databases_dir, f"{grade}_vector_db")
+
+    def attach_shared_vectordb(self, grade):
+        # Zero-copy: the matrix and node texts are mmap'd from the loader's generation directory
+        shared_grade = SharedGrade.attach(self.grade_source_dir(grade))
+        store = shared_grade.embedding_store
+        retriever = NumpyRetriever(
+            embedding_store=store,
+            docstore=shared_grade.node_store,
+            search_index=build_search_index(store.matrix, self.query_config.get('index'), shared_grade.path,
+                                            store.fingerprint),
+            top_k=self.query_config.get('candidate_k') or self.query_config['top_k'],
+            similarity_cutoff=self.query_config['similarity_cutoff'],
+            lexical_index=self.load_lexical_index(shared_grade.path, store),
+            rrf_k=self.hybrid_config.get('rrf_k', 60),
+            lexical_min_score=self.hybrid_config.get('min_score', 1.0),
+        )
+        print(f"Attached to generation {shared_grade.generation} of grade {grade}.")
+        return RetrieverQueryEngine(retriever=retriever)
 
     def load_vectordb(self, grade):
-        # Define the persist directory
-        persist_dir = os.path.join(self.databases_dir, f"{grade}_vector_db")
+        if self.uses_shared_store:
+            return self.attach_shared_vectordb(grade)
+
+        # Define the persist directory, pinned to its current version for the whole load
+        persist_dir = resolve_directory(os.path.join(self.databases_dir, f"{grade}_vector_db"))
 
         # Check if the directory exists
         if os.path.exists(persist_dir):
+            # Set number of docs to retreive (extra candidates are deduped and packed by the context builder)
+            top_k = self.query_config.get('candidate_k') or self.query_config['top_k']
+            similarity_cutoff = self.query_config['similarity_cutoff']
+
+            # Fast path: memory-map the binary embedding store and search it with NumPy
+            # (exact scan, or IVF/int8 for large grades when query_config.index asks for it)
+            if EmbeddingStore.exists(persist_dir):
+                vector_store = MmapVectorStore.from_persist_dir(persist_dir)
+                storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+                retriever = NumpyRetriever(
+                    embedding_store=vector_store.client,
+                    docstore=storage_context.docstore,
+                    search_index=build_search_index(vector_store.client.matrix, self.query_config.get('index'), persist_dir,
+                                                    vector_store.client.fingerprint),
+                    top_k=top_k,
+                    similarity_cutoff=similarity_cutoff,
+                    lexical_index=self.load_lexical_index(persist_dir, vector_store.client),
+                    rrf_k=self.hybrid_config.get('rrf_k', 60),
+                    lexical_min_score=self.hybrid_config.get('min_score', 1.0),
+                )
+                print(f"Index for grade {grade} loaded successfully.")
+                return RetrieverQueryEngine(retriever=retriever)
+
             # Load the storage context from the persisted directory
             storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
 
@@ -77,9 +643,7 @@ class VectorDBBuilder:
             # Initialize the VectorStoreIndex with the storage context and index structure
             index = VectorStoreIndex(index_struct=index_struct, storage_context=storage_context)
             print(f"Index for grade {grade} loaded successfully.")
-            
-            # Set number of docs to retreive
-            top_k = self.query_config['top_k']
+
             # Configure retriever
             retriever = VectorIndexRetriever(
                 index=index,
@@ -88,12 +652,27 @@ class VectorDBBuilder:
             # Assemble query engine
             query_engine = RetrieverQueryEngine(
                 retriever=retriever,
-                node_postprocessors=[SimilarityPostprocessor(similarity_cutoff=self.query_config['similarity_cutoff'])],
+                node_postprocessors=[SimilarityPostprocessor(similarity_cutoff=similarity_cutoff)],
             )            
             return query_engine
         else:
             raise FileNotFoundError(f"No saved index found in {persist_dir}.")
+
+    def get_query_engine(self, grade):
+        """
+        Returns the shared query engine for a grade, loading it only when the
+        persisted vector DB is new or has changed on disk (or, with the shared
+        store, when the loader has published a new generation).
+        """
+        persist_dir = self.grade_source_dir(grade)
+        if not os.path.exists(persist_dir):
+            raise FileNotFoundError(f"No saved index found in {persist_dir}.")
+        return self.engine_registry.get(grade, persist_dir, lambda: self.load_vectordb(grade))
+
+    def engine_stats(self):
+        return self.engine_registry.stats()
+
     def load_all_vector_dbs(self):
         for grade in self.grades:
-            self.load_vectordb(grade)
+            self.get_query_engine(grade)
 
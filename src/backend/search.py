@@ -0,0 +1,466 @@
+import os
+import time
+import json
+import hashlib
+import argparse
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """
+    L2-normalizes a vector or a batch of vectors as float32.
+
+    Args:
+        vectors (list | np.ndarray): A single embedding or a 2D batch of embeddings.
+    Returns:
+        np.ndarray: A 2D float32 array with unit-length rows.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def node_ids_fingerprint(node_ids):
+    """
+    Hashes the row -> node id mapping of an embedding store.
+
+    Index files built from a store record it, so an index built from another
+    version of the store is detected on load even when the row count matches.
+    """
+    return hashlib.sha1('\n'.join(node_ids).encode('utf-8')).hexdigest()
+
+
+def stored_source_matches(data, source):
+    # Index files written before fingerprints existed count as stale when a fingerprint is given
+    if source is None:
+        return True
+    return 'source' in data.files and str(data['source']) == source
+
+
+def top_k_rows(scores, top_k, similarity_cutoff=None):
+    """
+    Selects the best `top_k` columns of each row of a score matrix.
+
+    Args:
+        scores (np.ndarray): (num_queries, num_candidates) similarity scores.
+        top_k (int): Number of results to keep per query.
+        similarity_cutoff (float): Optional minimum score for a result.
+    Returns:
+        list: One (rows, scores) pair of arrays per query, best first.
+    """
+    num_candidates = scores.shape[1]
+    top_k = min(top_k, num_candidates)
+    if top_k <= 0:
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return [empty for _ in range(scores.shape[0])]
+
+    # argpartition is O(n); only the k survivors are sorted
+    if top_k < num_candidates:
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.tile(np.arange(num_candidates), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+    results = []
+    for rows, row_scores in zip(candidates, candidate_scores):
+        if similarity_cutoff is not None:
+            keep = row_scores >= similarity_cutoff
+            rows, row_scores = rows[keep], row_scores[keep]
+        results.append((rows, row_scores))
+    return results
+
+
+class ExactSearchIndex:
+    """
+    Brute-force cosine search over a pre-normalized embedding matrix.
+
+    A batch of queries is scored with a single matrix product, so the cost per
+    query is one BLAS call rather than a Python loop over every node.
+    """
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, query_embeddings, top_k, similarity_cutoff=None):
+        """
+        Finds the nearest rows for each query embedding.
+
+        Args:
+            query_embeddings (list | np.ndarray): One query or a batch of queries.
+            top_k (int): Number of results to keep per query.
+            similarity_cutoff (float): Optional minimum cosine similarity.
+        Returns:
+            list: One (rows, scores) pair of arrays per query, best first.
+        """
+        queries = normalize_rows(query_embeddings)
+        if len(self) == 0:
+            return top_k_rows(np.zeros((queries.shape[0], 0), dtype=np.float32), top_k)
+        scores = queries @ self.matrix.T
+        return top_k_rows(scores, top_k, similarity_cutoff)
+
+
+IVF_INDEX_FILE = 'ivf_index.npz'
+
+
+def _assign_to_centroids(data, centroids, block_size=65536):
+    # Assign in blocks so the score matrix stays small for big corpora
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), block_size):
+        block = np.asarray(data[start:start + block_size], dtype=np.float32)
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(data, nlist, iterations=10, seed=0):
+    """
+    Clusters unit-length vectors by cosine similarity.
+
+    Args:
+        data (np.ndarray): (n, dim) pre-normalized vectors.
+        nlist (int): Number of clusters.
+        iterations (int): Number of Lloyd iterations.
+        seed (int): Seed for the initial centroid sample.
+    Returns:
+        tuple: (centroids, assignments) as NumPy arrays.
+    """
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(data))
+    centroids = np.asarray(data[np.sort(rng.choice(len(data), nlist, replace=False))], dtype=np.float32)
+    for _ in range(iterations):
+        assignments = _assign_to_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, np.asarray(data, dtype=np.float32))
+        counts = np.bincount(assignments, minlength=nlist)
+
+        # Re-seed empty clusters with random points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = np.asarray(data[rng.choice(len(data), len(empty), replace=False)], dtype=np.float32)
+        centroids = normalize_rows(sums)
+    return centroids, _assign_to_centroids(data, centroids)
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index.
+
+    Rows are clustered with spherical k-means at build time; a query only scores
+    the rows of its `nprobe` closest clusters. Higher `nprobe` trades speed for
+    recall, and `nprobe == nlist` is equivalent to exact search.
+    """
+    def __init__(self, matrix, centroids, list_offsets, list_rows, nprobe=8):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix, nlist=None, nprobe=8, iterations=10, seed=0):
+        """Clusters `matrix` into `nlist` inverted lists (default: sqrt of the row count)."""
+        nlist = nlist or max(1, int(np.sqrt(len(matrix))))
+        centroids, assignments = spherical_kmeans(matrix, nlist, iterations, seed)
+
+        # Store the inverted lists in CSR form: rows of list i are list_rows[offsets[i]:offsets[i + 1]]
+        list_rows = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=len(centroids))
+        list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(matrix, centroids, list_offsets, list_rows, nprobe)
+
+    def save(self, persist_dir, source=None):
+        """Saves the index; `source` is the `node_ids_fingerprint` of the store it was built from."""
+        path = os.path.join(persist_dir, IVF_INDEX_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, centroids=self.centroids, list_offsets=self.list_offsets,
+                     list_rows=self.list_rows, count=np.array([len(self)]), source=np.array(source or ''))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, persist_dir, matrix, nprobe=8, source=None):
+        """Loads a persisted IVF index, or returns None if it is missing or stale (other row count or `source`)."""
+        path = os.path.join(persist_dir, IVF_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data['count'][0]) != len(matrix) or not stored_source_matches(data, source):
+                return None
+            return cls(matrix, data['centroids'], data['list_offsets'], data['list_rows'], nprobe)
+
+    def search(self, query_embeddings, top_k, similarity_cutoff=None, nprobe=None):
+        """
+        Finds approximate nearest rows for each query embedding.
+
+        Args:
+            query_embeddings (list | np.ndarray): One query or a batch of queries.
+            top_k (int): Number of results to keep per query.
+            similarity_cutoff (float): Optional minimum cosine similarity.
+            nprobe (int): Clusters to scan per query (defaults to self.nprobe).
+        Returns:
+            list: One (rows, scores) pair of arrays per query, best first.
+        """
+        queries = normalize_rows(query_embeddings)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists])
+            rows.sort()  # sequential access into the memory-mapped matrix
+            scores = np.asarray(self.matrix[rows] @ query, dtype=np.float32)
+            top_rows, top_scores = top_k_rows(scores[None, :], top_k, similarity_cutoff)[0]
+            results.append((rows[top_rows], top_scores))
+        return results
+
+
+INT8_INDEX_FILE = 'int8_index.npz'
+
+
+def quantize_int8(matrix, block_size=65536):
+    """
+    Scalar-quantizes a matrix to int8 with one affine range per dimension.
+
+    A value is recovered as `codes * scale + offset`, which is accurate to
+    half a step (1/510 of the dimension's range).
+
+    Returns:
+        tuple: (codes, scale, offset) as NumPy arrays.
+    """
+    low = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+    high = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        low = np.minimum(low, block.min(axis=0))
+        high = np.maximum(high, block.max(axis=0))
+    scale = (high - low) / 255
+    scale[scale == 0] = 1.0
+    offset = low + 128 * scale
+
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    for start in range(0, len(matrix), block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        codes[start:start + block_size] = np.clip(np.rint((block - offset) / scale), -128, 127)
+    return codes, scale, offset
+
+
+class Int8SearchIndex:
+    """
+    Search over int8 codes with full-precision re-scoring.
+
+    Every row is scored against its 1-byte-per-dimension code, a quarter of
+    the float32 matrix. Only the best `top_k * rescore_factor` candidates are
+    then re-scored against the memory-mapped full-precision matrix, so the
+    float rows of a grade are mostly never paged in.
+    """
+    def __init__(self, matrix, codes, scale, offset, rescore_factor=4, block_size=512):
+        self.matrix = matrix
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.rescore_factor = rescore_factor
+        self.block_size = block_size
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes + self.offset.nbytes
+
+    @classmethod
+    def build(cls, matrix, rescore_factor=4):
+        return cls(matrix, *quantize_int8(matrix), rescore_factor=rescore_factor)
+
+    def save(self, persist_dir, source=None):
+        """Saves the codes; `source` is the `node_ids_fingerprint` of the store they were built from."""
+        path = os.path.join(persist_dir, INT8_INDEX_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, codes=self.codes, scale=self.scale, offset=self.offset, source=np.array(source or ''))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, persist_dir, matrix, rescore_factor=4, source=None):
+        """Loads persisted int8 codes, or returns None if they are missing or stale (other shape or `source`)."""
+        path = os.path.join(persist_dir, INT8_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if data['codes'].shape != matrix.shape or not stored_source_matches(data, source):
+                return None
+            return cls(matrix, data['codes'], data['scale'], data['offset'], rescore_factor)
+
+    def approximate_scores(self, queries):
+        """Dot products of normalized queries with the dequantized rows."""
+        # q . (codes * scale + offset) == codes . (q * scale) + q . offset
+        scaled = (queries * self.scale).T
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        # Widen the codes through one small cache-resident buffer; the conversion, not the
+        # product, dominates, and a fresh float copy per block would cost as much as exact search
+        buffer = np.empty((self.block_size, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self), self.block_size):
+            block = self.codes[start:start + self.block_size]
+            np.copyto(buffer[:len(block)], block, casting='unsafe')
+            scores[:, start:start + len(block)] = (buffer[:len(block)] @ scaled).T
+        scores += (queries @ self.offset)[:, None]
+        return scores
+
+    def search(self, query_embeddings, top_k, similarity_cutoff=None):
+        """
+        Finds the nearest rows for each query embedding.
+
+        Args:
+            query_embeddings (list | np.ndarray): One query or a batch of queries.
+            top_k (int): Number of results to keep per query.
+            similarity_cutoff (float): Optional minimum cosine similarity,
+                applied to the re-scored (exact) similarities.
+        Returns:
+            list: One (rows, scores) pair of arrays per query, best first.
+        """
+        queries = normalize_rows(query_embeddings)
+        if len(self) == 0:
+            return top_k_rows(np.zeros((queries.shape[0], 0), dtype=np.float32), top_k)
+        shortlists = top_k_rows(self.approximate_scores(queries), top_k * self.rescore_factor)
+
+        results = []
+        for query, (rows, _) in zip(queries, shortlists):
+            rows = np.sort(rows)  # sequential access into the memory-mapped matrix
+            scores = np.asarray(self.matrix[rows] @ query, dtype=np.float32)
+            top_rows, top_scores = top_k_rows(scores[None, :], top_k, similarity_cutoff)[0]
+            results.append((rows[top_rows], top_scores))
+        return results
+
+
+def build_search_index(matrix, index_config, persist_dir=None, source=None):
+    """
+    Picks the search index for a grade from `query_config.index`.
+
+    Grades smaller than `min_size` (or with no usable IVF/int8 index on disk) fall
+    back to exact search. With `persist_dir` the index is loaded from disk,
+    otherwise it is built in memory; `source` is the fingerprint of the
+    embedding store the index on disk must have been built from.
+    """
+    index_config = index_config or {}
+    index_type = index_config.get('type', 'exact')
+    if index_type not in ('ivf', 'int8') or len(matrix) < index_config.get('min_size', 0):
+        return ExactSearchIndex(matrix)
+
+    if index_type == 'int8':
+        rescore_factor = index_config.get('rescore_factor', 4)
+        if persist_dir is not None:
+            index = Int8SearchIndex.load(persist_dir, matrix, rescore_factor, source)
+            if index is None:
+                print(f"No up-to-date int8 index in {persist_dir}; using exact search.")
+                return ExactSearchIndex(matrix)
+            return index
+        return Int8SearchIndex.build(matrix, rescore_factor)
+
+    nprobe = index_config.get('nprobe', 8)
+    if persist_dir is not None:
+        index = IVFIndex.load(persist_dir, matrix, nprobe, source)
+        if index is None:
+            print(f"No up-to-date IVF index in {persist_dir}; using exact search.")
+            return ExactSearchIndex(matrix)
+        return index
+    return IVFIndex.build(matrix, index_config.get('nlist'), nprobe)
+
+
+def recall_report(matrix, nlist=None, nprobe_values=(1, 2, 4, 8, 16), top_k=3,
+                  num_queries=200, noise=0.05, seed=0, rescore_factors=(1, 2, 4)):
+    """
+    Measures recall@k, latency and memory of IVF and int8 search against exact search.
+
+    Queries are stored embeddings perturbed with Gaussian noise, so they land
+    near real chunks without matching any of them exactly. Memory is what a
+    search keeps resident: the whole float matrix for exact and IVF search,
+    only the codes for int8 search (plus the few re-scored rows).
+
+    Returns:
+        list: One dict per setting with recall@k, mean latency in ms and memory in MB.
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(matrix), min(num_queries, len(matrix)), replace=False)
+    queries = normalize_rows(np.asarray(matrix[np.sort(sample)], dtype=np.float32)
+                             + rng.normal(0, noise, (len(sample), matrix.shape[1])).astype(np.float32))
+    matrix_mb = np.asarray(matrix, dtype=np.float32).nbytes / 2 ** 20
+
+    def timed(search):
+        start = time.perf_counter()
+        results = [search(query)[0] for query in queries]
+        return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+    def recall(found_results):
+        # A result counts if it is as similar as the k-th true neighbour, so exact duplicate
+        # chunks (common with overlapping chunking) tie instead of counting as misses
+        hits = 0
+        for query, found, (_, expected_scores) in zip(queries, found_results, truth):
+            if len(expected_scores):
+                found_scores = np.asarray(matrix[np.sort(found[0])], dtype=np.float32) @ query
+                hits += min(int(np.sum(found_scores >= expected_scores[-1] - 1e-5)), len(expected_scores))
+        return hits / max(sum(len(expected[1]) for expected in truth), 1)
+
+    exact = ExactSearchIndex(matrix)
+    truth, exact_ms = timed(lambda query: exact.search(query, top_k))
+    report = [{'index': 'exact', 'setting': None, f'recall@{top_k}': 1.0, 'latency_ms': exact_ms,
+               'memory_mb': matrix_mb}]
+
+    ivf = IVFIndex.build(matrix, nlist)
+    ivf_mb = matrix_mb + (ivf.centroids.nbytes + ivf.list_offsets.nbytes + ivf.list_rows.nbytes) / 2 ** 20
+    for nprobe in nprobe_values:
+        if nprobe > ivf.nlist:
+            continue
+        approx, ivf_ms = timed(lambda query: ivf.search(query, top_k, nprobe=nprobe))
+        report.append({'index': f'ivf(nlist={ivf.nlist})', 'setting': f'nprobe={nprobe}',
+                       f'recall@{top_k}': recall(approx), 'latency_ms': ivf_ms, 'memory_mb': ivf_mb})
+
+    int8 = Int8SearchIndex.build(matrix)
+    for rescore_factor in rescore_factors:
+        int8.rescore_factor = rescore_factor
+        approx, int8_ms = timed(lambda query: int8.search(query, top_k))
+        report.append({'index': 'int8', 'setting': f'rescore={rescore_factor}',
+                       f'recall@{top_k}': recall(approx), 'latency_ms': int8_ms,
+                       'memory_mb': int8.nbytes / 2 ** 20})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Recall@k, latency and memory of the IVF and int8 indexes against exact search.")
+    parser.add_argument('persist_dir', help="Persisted vector DB directory with a binary embedding store.")
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rescore-factor', type=int, nargs='+', default=[1, 2, 4],
+                        help="int8 candidates re-scored in full precision, per result.")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--num-queries', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    from embedding import EmbeddingStore
+    store = EmbeddingStore.load(args.persist_dir)
+    report = recall_report(store.matrix, args.nlist, args.nprobe, args.top_k, args.num_queries,
+                           rescore_factors=args.rescore_factor)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{len(store)} chunks, dim {store.dim}")
+    for row in report:
+        print(f"{row['index']:<20} {str(row['setting'] or ''):<11} "
+              f"recall@{args.top_k}={row[f'recall@{args.top_k}']:.3f}  {row['latency_ms']:.3f} ms/query  "
+              f"{row['memory_mb']:.2f} MB")
+
+
+if __name__ == '__main__':
+    main()
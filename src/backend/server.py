@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import yaml
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from model import AsyncLLMModel, llm_metrics, load_api_key
+from rag import NO_ANSWER, build_prompt
+import tracing
+
+CONFIG_FILE = os.environ.get('CHATBOT_CONFIG', '../config/config.yaml')
+
+
+class QueryRequest(BaseModel):
+    grade: str
+    question: str
+
+
+class ChatRequest(BaseModel):
+    grade: str
+    model: str
+    question: str
+    max_tokens: int = 512
+    stream: bool = True
+    session_id: Optional[str] = None
+
+
+class ClientLimiter:
+    """Caps the number of in-flight requests per client id."""
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self._in_flight = {}
+
+    def check(self, client_id):
+        if self._in_flight.get(client_id, 0) >= self.max_concurrent:
+            raise HTTPException(status_code=429, detail="Too many concurrent requests for this client.")
+
+    def acquire(self, client_id):
+        self.check(client_id)
+        self._in_flight[client_id] = self._in_flight.get(client_id, 0) + 1
+
+    def release(self, client_id):
+        self._in_flight[client_id] -= 1
+        if self._in_flight[client_id] <= 0:
+            del self._in_flight[client_id]
+
+
+class RAGService:
+    """
+    Request-independent state of the serving backend.
+
+    Retrieval (embedding + vector search + cache lookups) is blocking and runs
+    in a thread pool; LLM calls go through one pooled async Groq client.
+
+    Construction is cheap so the port opens at once. The heavy work (importing
+    LlamaIndex, loading the embedding model, building and warming up every
+    grade's engine) happens in `start`, and `/healthz` reports ready only
+    once it has finished.
+    """
+    def __init__(self, config_file):
+        self.config_file = config_file
+        with open(config_file, 'r') as f:
+            self.config = yaml.safe_load(f)
+        self.startup_config = self.config.get('startup', {})
+        self.serving_config = self.config.get('serving', {})
+        self.executor = ThreadPoolExecutor(max_workers=self.serving_config.get('retrieval_threads', 8))
+        self.llm = AsyncLLMModel(
+            load_api_key(),
+            self.config.get('llm_client'),
+            {model: options['fallback'] for model, options in self.config.get('models', {}).items()
+             if options.get('fallback')},
+        )
+        self.limiter = ClientLimiter(self.serving_config.get('max_concurrent_requests_per_client', 4))
+        self.builder = None
+        self.context_builder = None
+        self.response_cache = None
+        self.faq = None
+        self.sessions = None
+        self.status = 'starting'
+        self.phase = None
+        self.startup_error = None
+        self.startup_timings = {}
+
+    @contextmanager
+    def _phase(self, name):
+        self.phase = name
+        start = time.perf_counter()
+        yield
+        self.startup_timings[name] = time.perf_counter() - start
+        tracing.record(f'startup_{name}', self.startup_timings[name])
+
+    def _start(self, started_at):
+        with self._phase('imports'):
+            from retrieval import VectorDBBuilder
+            from cache import FAQLookup, ResponseCache
+            from context import ContextBuilder
+            from memory import SessionStore
+
+        # One builder, hence one embedding model, for the whole process
+        with self._phase('embedding_model'):
+            self.builder = VectorDBBuilder(self.config_file)
+            self.context_builder = ContextBuilder.from_config(self.config)
+            self.response_cache = ResponseCache.from_config(self.config.get('response_cache'))
+            self.faq = FAQLookup.from_config(self.config.get('faq'))
+            self.sessions = SessionStore.from_config(self.config.get('memory'))
+
+        if self.builder.uses_shared_store:
+            # The loader process (shared.py) builds and publishes the grades; workers only attach
+            from shared import wait_for_grades
+            with self._phase('wait_for_loader'):
+                wait_for_grades(self.builder.shared_store_config.get('path', '/dev/shm/llm-chatbot'),
+                                self.builder.grades, self.startup_config.get('loader_timeout_seconds', 300))
+        elif self.startup_config.get('build_on_start', True):
+            with self._phase('build_vector_dbs'):
+                self.builder.build_all_vector_dbs()
+
+        # Load every grade and run one query through each, so the first user
+        # request doesn't pay for page faults or lazy model initialization
+        if self.startup_config.get('warm_up', True):
+            with self._phase('warm_up'):
+                self.builder.load_all_vector_dbs()
+                for grade in self.builder.grades:
+                    self._retrieve(grade, self.startup_config.get('warm_up_query', 'warm up'))
+
+        self.startup_timings['total'] = time.perf_counter() - started_at
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_timings.items())
+        print(f"RAG service ready: {phases}")
+
+    async def start(self, started_at=None):
+        started_at = started_at or time.perf_counter()
+        try:
+            await self.run_blocking(self._start, started_at)
+            self.status = 'ready'
+            self.phase = None
+        except Exception as e:
+            self.status = 'failed'
+            self.startup_error = str(e)
+            print(f"RAG service failed to start during {self.phase}: {e}")
+
+    def require_ready(self):
+        if self.status != 'ready':
+            raise HTTPException(status_code=503, detail=f"Service is {self.status}.")
+
+    async def close(self):
+        await self.llm.close()
+        self.executor.shutdown(wait=False)
+
+    def _retrieve(self, grade, question):
+        from llama_index.core import QueryBundle, Settings
+
+        if grade not in self.builder.grades:
+            raise HTTPException(status_code=404, detail=f"Unknown grade: {grade}")
+        query_engine = self.builder.get_query_engine(grade)
+        with tracing.span('query_embedding', grade=grade):
+            query_bundle = QueryBundle(question, embedding=Settings.embed_model.get_query_embedding(question))
+        return query_bundle, query_engine.retrieve(query_bundle)
+
+    def _build_prompt(self, source_nodes, query_bundle, request, history=""):
+        with tracing.span('prompt_build', model=request.model):
+            context = self.context_builder.build(
+                source_nodes, query_bundle.embedding, request.model, request.max_tokens,
+                f"{history}\n{request.question}")
+            return context, build_prompt(context, request.question, history)
+
+    async def retrieve(self, grade, question, trace_id=None):
+        return await self.run_blocking(self._retrieve, grade, question, trace_id=trace_id)
+
+    async def run_blocking(self, function, *args, trace_id=None):
+        # Worker threads don't inherit the caller's context, so the trace id is passed along
+        def traced_call():
+            with tracing.trace(trace_id):
+                return function(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, traced_call)
+
+    async def chat_events(self, request: ChatRequest):
+        """
+        Answers a chat request as a sequence of events.
+
+        Yields dicts of type 'delta' (a piece of the answer), then one 'done'
+        event with the full response, or an 'error' event.
+
+        With a `session_id`, follow-up questions are rewritten with the topic of
+        the session's recent turns before retrieval, the conversation so far is
+        added to the prompt, and the finished turn is remembered.
+        """
+        trace_id = tracing.new_trace_id()
+        with tracing.span('request_total', trace_id=trace_id, grade=request.grade, model=request.model):
+            memory = None
+            query, history = request.question, ""
+            if self.sessions is not None and request.session_id:
+                with tracing.span('query_rewrite', trace_id=trace_id):
+                    memory = self.sessions.get(request.session_id)
+                    query = memory.rewrite(request.question)
+                    history = memory.history_text()
+
+            async for event in self._chat_events(request, query, history, trace_id):
+                if event["type"] == "done" and memory is not None:
+                    memory.add_turn(request.question, event["response"], query)
+                yield event
+
+    async def _chat_events(self, request, query, history, trace_id):
+        # Answers precomputed by batch.py skip retrieval and the LLM entirely
+        if self.faq is not None:
+            # May stat and reload the FAQ file, so off the event loop
+            entry = await self.run_blocking(self.faq.lookup, request.grade, query, trace_id=trace_id)
+            if entry is not None:
+                yield {"type": "done", "response": entry["answer"], "cached": True, "stats": None}
+                return
+
+        query_bundle, source_nodes = await self.retrieve(request.grade, query, trace_id)
+        if not source_nodes:
+            yield {"type": "done", "response": NO_ANSWER, "cached": False, "stats": None}
+            return
+
+        context, prompt = await self.run_blocking(
+            self._build_prompt, source_nodes, query_bundle, request, history, trace_id=trace_id)
+        # Answers that depend on a session's history are neither served from nor stored in the shared cache
+        use_cache = self.response_cache is not None and not history
+        if use_cache:
+            cached_text = await self.run_blocking(
+                self.response_cache.lookup, request.grade, request.model, query,
+                context, query_bundle.embedding, trace_id=trace_id)
+            if cached_text is not None:
+                yield {"type": "done", "response": cached_text, "cached": True, "stats": None}
+                return
+
+        stats = {}
+        response_text = ""
+        start = time.perf_counter()
+        try:
+            async for delta in self.llm.stream_response(request.model, prompt, request.max_tokens, stats):
+                response_text += delta
+                yield {"type": "delta", "content": delta}
+        except RuntimeError as e:
+            tracing.record('llm_total', time.perf_counter() - start, error=True,
+                           trace_id=trace_id, model=request.model)
+            yield {"type": "error", "message": str(e)}
+            return
+        tracing.record('llm_time_to_first_token', stats.get('time_to_first_token'),
+                       trace_id=trace_id, model=stats.get('model'))
+        tracing.record('llm_total', stats.get('total_seconds'), trace_id=trace_id, model=stats.get('model'),
+                       completion_tokens=stats.get('completion_tokens'))
+
+        if use_cache:
+            await self.run_blocking(
+                self.response_cache.store, request.grade, request.model, query,
+                context, response_text, query_bundle.embedding, trace_id=trace_id)
+        yield {"type": "done", "response": response_text, "cached": False, "stats": stats}
+
+
+def client_id(request: Request):
+    return request.headers.get('x-client-id') or (request.client.host if request.client else 'unknown')
+
+
+def create_app(config_file=CONFIG_FILE):
+    @asynccontextmanager
+    async def lifespan(app):
+        started_at = time.perf_counter()
+        app.state.service = RAGService(config_file)
+        startup = asyncio.create_task(app.state.service.start(started_at))
+        yield
+        startup.cancel()
+        await app.state.service.close()
+
+    app = FastAPI(title="RAG Chatbot", lifespan=lifespan)
+
+    @app.get('/healthz')
+    async def healthz(request: Request):
+        # Readiness: 503 until the embedding model is loaded and every grade is warmed up
+        service = request.app.state.service
+        body = {"status": service.status, "phase": service.phase, "startup_seconds": service.startup_timings}
+        if service.status == 'failed':
+            body["error"] = service.startup_error
+        return JSONResponse(body, status_code=200 if service.status == 'ready' else 503)
+
+    @app.get('/stats')
+    async def stats(request: Request):
+        service = request.app.state.service
+        return {
+            "llm": llm_metrics(),
+            "response_cache": service.response_cache.stats() if service.response_cache is not None else None,
+            "faq": service.faq.stats() if service.faq is not None else None,
+            "sessions": service.sessions.stats() if service.sessions is not None else None,
+            "engines": service.builder.engine_stats() if service.builder is not None else None,
+            "stages": tracing.tracer.snapshot(),
+        }
+
+    @app.get('/metrics', response_class=PlainTextResponse)
+    async def metrics(request: Request):
+        # Prometheus text format: per-stage latency histograms
+        if not request.app.state.service.config.get('tracing', {}).get('prometheus', True):
+            raise HTTPException(status_code=404, detail="Prometheus metrics are disabled.")
+        return tracing.tracer.prometheus_text()
+
+    @app.post('/query')
+    async def query(body: QueryRequest, request: Request):
+        service = request.app.state.service
+        service.require_ready()
+        client = client_id(request)
+        service.limiter.acquire(client)
+        try:
+            _, source_nodes = await service.retrieve(body.grade, body.question)
+        finally:
+            service.limiter.release(client)
+        return {"nodes": [{"node_id": n.node.node_id, "text": n.text, "score": n.score} for n in source_nodes]}
+
+    @app.post('/chat')
+    async def chat(body: ChatRequest, request: Request):
+        service = request.app.state.service
+        service.require_ready()
+        client = client_id(request)
+
+        if not body.stream:
+            service.limiter.acquire(client)
+            events = service.chat_events(body)
+            try:
+                async for event in events:
+                    if event["type"] == "error":
+                        raise HTTPException(status_code=502, detail=event["message"])
+                    if event["type"] == "done":
+                        return event
+            finally:
+                # Run the generator's cleanup now, not whenever it is garbage collected
+                await events.aclose()
+                service.limiter.release(client)
+
+        # Reject with a real 429 up front, but only take the slot once the body is iterated:
+        # a response dropped before streaming starts never runs the generator's `finally`
+        service.limiter.check(client)
+
+        async def event_stream():
+            # Server-sent events: one JSON payload per 'data:' line
+            try:
+                service.limiter.acquire(client)
+            except HTTPException as e:
+                yield f"data: {json.dumps({'type': 'error', 'message': e.detail})}\n\n"
+                return
+            try:
+                async for event in service.chat_events(body):
+                    yield f"data: {json.dumps(event)}\n\n"
+            except HTTPException as e:
+                yield f"data: {json.dumps({'type': 'error', 'message': e.detail})}\n\n"
+            except Exception as e:
+                # Always end the stream with a terminal event, whatever failed mid-stream
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            finally:
+                service.limiter.release(client)
+
+        return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+    return app
+
+
+app = create_app()
+
+
+def serve():
+    with open(CONFIG_FILE, 'r') as f:
+        serving_config = yaml.safe_load(f).get('serving', {})
+    uvicorn.run(app, host=serving_config.get('host', '0.0.0.0'), port=serving_config.get('port', 8000))
+
+
+if __name__ == '__main__':
+    serve()
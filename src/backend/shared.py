@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+from embedding import EMBEDDINGS_FILE, EMBEDDINGS_INDEX_FILE, EmbeddingStore
+from search import INT8_INDEX_FILE, IVF_INDEX_FILE
+from lexical import BM25_INDEX_FILE
+
+CONFIG_FILE = os.environ.get('CHATBOT_CONFIG', '../config/config.yaml')
+CURRENT_FILE = 'CURRENT'
+NODES_FILE = 'nodes.bin'
+NODES_INDEX_FILE = 'nodes_index.npy'
+PUBLISH_MANIFEST_FILE = 'published.json'
+# Unix socket the loader serves query embeddings on (shared_store.serve_embeddings)
+EMBEDDING_SOCKET_FILE = 'embedding.sock'
+# Persisted files a worker needs besides the node texts; missing optional indexes are skipped
+PUBLISHED_FILES = (EMBEDDINGS_FILE, EMBEDDINGS_INDEX_FILE, BM25_INDEX_FILE, IVF_INDEX_FILE, INT8_INDEX_FILE)
+
+
+def current_generation(grade_dir):
+    """Returns the generation a grade's CURRENT file points at, or None before the first publish."""
+    try:
+        with open(os.path.join(grade_dir, CURRENT_FILE), 'r') as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def generation_dir(grade_dir, generation):
+    return os.path.join(grade_dir, f'gen-{generation}')
+
+
+class SharedNodeStore:
+    """
+    Read-only docstore over node texts published by the loader.
+
+    Texts and metadata of every node are packed into one memory-mapped blob,
+    so all workers share its pages; a node is decoded only when it is
+    retrieved. Row i belongs to the i-th node id of the embedding store.
+    """
+    def __init__(self, node_ids, blob, index):
+        self.blob = blob
+        self.index = index
+        self._rows = {node_id: row for row, node_id in enumerate(node_ids)}
+
+    @staticmethod
+    def write(path, nodes):
+        """
+        Packs nodes into `nodes.bin` and `nodes_index.npy` in `path`.
+
+        The index holds the (text start, metadata start, end) byte offsets of each node.
+        """
+        from llama_index.core.schema import MetadataMode
+
+        index = np.zeros((len(nodes), 3), dtype=np.int64)
+        offset = 0
+        with open(os.path.join(path, NODES_FILE), 'wb') as f:
+            for row, node in enumerate(nodes):
+                text = node.get_content(metadata_mode=MetadataMode.NONE).encode('utf-8')
+                metadata = json.dumps(node.metadata, ensure_ascii=False, default=str).encode('utf-8')
+                f.write(text)
+                f.write(metadata)
+                index[row] = (offset, offset + len(text), offset + len(text) + len(metadata))
+                offset = index[row, 2]
+        np.save(os.path.join(path, NODES_INDEX_FILE), index)
+
+    @classmethod
+    def load(cls, path, node_ids):
+        index = np.load(os.path.join(path, NODES_INDEX_FILE), mmap_mode='r')
+        blob_path = os.path.join(path, NODES_FILE)
+        if os.path.getsize(blob_path) == 0:
+            blob = np.zeros(0, dtype=np.uint8)
+        else:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        return cls(node_ids, blob, index)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get_node(self, node_id):
+        from llama_index.core.schema import TextNode
+
+        start, middle, end = (int(value) for value in self.index[self._rows[node_id]])
+        return TextNode(
+            id_=node_id,
+            text=bytes(self.blob[start:middle]).decode('utf-8'),
+            metadata=json.loads(bytes(self.blob[middle:end])),
+        )
+
+    def get_nodes(self, node_ids):
+        return [self.get_node(node_id) for node_id in node_ids]
+
+
+class SharedGrade:
+    """One attached generation of a grade: the mmap'd embedding matrix and node texts."""
+    def __init__(self, generation, path, embedding_store, node_store):
+        self.generation = generation
+        self.path = path
+        self.embedding_store = embedding_store
+        self.node_store = node_store
+
+    @classmethod
+    def attach(cls, grade_dir, retries=3):
+        """
+        Attaches to the current generation of a grade, zero-copy.
+
+        Retries if the loader publishes and removes generations while the files
+        are being opened; once mapped, a generation stays readable even after
+        the loader deletes it.
+        """
+        for attempt in range(retries):
+            generation = current_generation(grade_dir)
+            if generation is None:
+                raise FileNotFoundError(f"Nothing has been published to {grade_dir} yet.")
+            path = generation_dir(grade_dir, generation)
+            try:
+                embedding_store = EmbeddingStore.load(path)
+                return cls(generation, path, embedding_store, SharedNodeStore.load(path, embedding_store.node_ids))
+            except FileNotFoundError:
+                if attempt == retries - 1:
+                    raise
+
+
+class GradePublisher:
+    """
+    Publishes persisted vector DBs into a shared directory for worker processes.
+
+    Each publish writes a complete `gen-<n>` directory (on tmpfs, e.g.
+    /dev/shm, this is shared memory) and then atomically bumps the grade's
+    CURRENT file, so workers either see the old generation or the whole new
+    one. Only the newest `keep_generations` generations are kept.
+    """
+    def __init__(self, root, keep_generations=2):
+        self.root = root
+        self.keep_generations = max(keep_generations, 1)
+
+    def grade_dir(self, grade):
+        return os.path.join(self.root, grade)
+
+    def published_fingerprint(self, grade):
+        generation = current_generation(self.grade_dir(grade))
+        if generation is None:
+            return None
+        try:
+            with open(os.path.join(generation_dir(self.grade_dir(grade), generation), PUBLISH_MANIFEST_FILE)) as f:
+                return json.load(f)['source_fingerprint']
+        except (FileNotFoundError, KeyError, json.JSONDecodeError):
+            return None
+
+    def publish(self, grade, persist_dir, source_fingerprint=None):
+        """
+        Publishes one grade's persisted vector DB as a new generation.
+
+        Returns:
+            int: The new generation number.
+        """
+        from llama_index.core.storage.docstore import SimpleDocumentStore
+
+        # Read every file from the version the DB symlink points at now, even if a rebuild swaps it meanwhile
+        persist_dir = os.path.realpath(persist_dir)
+        grade_dir = self.grade_dir(grade)
+        os.makedirs(grade_dir, exist_ok=True)
+        generation = (current_generation(grade_dir) or 0) + 1
+        path = generation_dir(grade_dir, generation)
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        try:
+            for name in PUBLISHED_FILES:
+                if os.path.exists(os.path.join(persist_dir, name)):
+                    shutil.copyfile(os.path.join(persist_dir, name), os.path.join(tmp_path, name))
+            store = EmbeddingStore.load(tmp_path)
+            docstore = SimpleDocumentStore.from_persist_path(os.path.join(persist_dir, 'docstore.json'))
+            # The copies must come from one build: the matrix rows and the docstore hold the same nodes
+            if set(docstore.docs) != set(store.node_ids):
+                raise ValueError(f"The embedding store and docstore in {persist_dir} hold different nodes.")
+            SharedNodeStore.write(tmp_path, docstore.get_nodes(store.node_ids))
+            with open(os.path.join(tmp_path, PUBLISH_MANIFEST_FILE), 'w') as f:
+                json.dump({'generation': generation, 'source': os.path.abspath(persist_dir),
+                           'source_fingerprint': source_fingerprint, 'published_at': time.time()}, f)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        shutil.rmtree(path, ignore_errors=True)  # left over from a publish that died before the bump
+        os.rename(tmp_path, path)
+
+        # Bump the generation counter atomically; workers pick it up on their next request
+        current_path = os.path.join(grade_dir, CURRENT_FILE)
+        with open(current_path + '.tmp', 'w') as f:
+            f.write(str(generation))
+        os.replace(current_path + '.tmp', current_path)
+        self._remove_old_generations(grade_dir, generation)
+        return generation
+
+    def _remove_old_generations(self, grade_dir, generation):
+        for name in os.listdir(grade_dir):
+            if name.startswith('gen-') and not name.endswith('.tmp'):
+                if int(name[len('gen-'):]) <= generation - self.keep_generations:
+                    shutil.rmtree(os.path.join(grade_dir, name), ignore_errors=True)
+
+    def publish_if_changed(self, grade, persist_dir):
+        """Publishes a grade only if its persisted DB changed since the last publish; returns the new generation or None."""
+        from retrieval import persist_dir_fingerprint
+
+        if not EmbeddingStore.exists(persist_dir):
+            print(f"No binary embedding store in {persist_dir}; build it first (--build).")
+            return None
+        fingerprint = repr(persist_dir_fingerprint(persist_dir))
+        if fingerprint == self.published_fingerprint(grade):
+            return None
+        return self.publish(grade, persist_dir, fingerprint)
+
+
+def wait_for_grades(root, grades, timeout_seconds=300, poll_seconds=0.5):
+    """Blocks until the loader has published every grade (worker startup)."""
+    deadline = time.monotonic() + timeout_seconds
+    missing = list(grades)
+    while missing:
+        missing = [grade for grade in missing if current_generation(os.path.join(root, grade)) is None]
+        if not missing:
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The loader has not published {', '.join(missing)} to {root}.")
+        time.sleep(poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Loader: publish every grade's vector DB into shared memory for the worker processes.")
+    parser.add_argument('--config', default=CONFIG_FILE)
+    parser.add_argument('--build', action='store_true', help="Build or update the vector DBs before publishing.")
+    parser.add_argument('--watch', action='store_true', help="Keep running and republish grades that are rebuilt.")
+    args = parser.parse_args()
+
+    import yaml
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    shared_config = config.get('shared_store', {})
+    publisher = GradePublisher(shared_config.get('path', '/dev/shm/llm-chatbot'),
+                               shared_config.get('keep_generations', 2))
+
+    # The loader holds the only copy of the embedding model; workers embed queries through it
+    embed_model = None
+    serve_embeddings = args.watch and shared_config.get('serve_embeddings', False)
+    if serve_embeddings or args.build:
+        from embedding import EmbeddingServer, load_embed_model
+        embed_model = load_embed_model(config['embedding_model']['name'], config.get('embedding_service'),
+                                       config.get('ingestion', {}).get('embed_batch_size', 64))
+    if serve_embeddings:
+        os.makedirs(publisher.root, exist_ok=True)
+        server = EmbeddingServer(embed_model.service, os.path.join(publisher.root, EMBEDDING_SOCKET_FILE)).start()
+        print(f"Serving query embeddings on {server.address}")
+
+    if args.build:
+        from retrieval import VectorDBBuilder
+        VectorDBBuilder(args.config, embed_model=embed_model).build_all_vector_dbs()
+
+    while True:
+        for grade in config['grades']:
+            persist_dir = os.path.join(config['databases_dir'], f"{grade}_vector_db")
+            try:
+                generation = publisher.publish_if_changed(grade, persist_dir)
+            except (OSError, ValueError) as e:
+                # e.g. the DB was rewritten mid-copy and its files disagree; the next poll publishes it
+                print(f"Failed to publish {grade}: {e}")
+                continue
+            if generation is not None:
+                print(f"Published {grade} generation {generation} to {publisher.grade_dir(grade)}")
+        if not args.watch:
+            return
+        time.sleep(shared_config.get('poll_seconds', 5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the Prometheus histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+logger = logging.getLogger('rag.trace')
+_current_trace_id = contextvars.ContextVar('trace_id', default=None)
+
+
+class StageHistogram:
+    """Count, sum and bucketed durations of one stage."""
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.errors = 0
+        self.bucket_counts = [0] * len(BUCKETS)
+
+    def observe(self, seconds, error=False):
+        self.count += 1
+        self.total_seconds += seconds
+        self.errors += int(error)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+
+class Tracer:
+    """
+    Collects stage timings for the whole process.
+
+    Every finished span is added to its stage histogram and, if `log_spans`
+    is set, written to the `rag.trace` logger as one JSON object per line.
+    """
+    def __init__(self, enabled=True, log_spans=True):
+        self.enabled = enabled
+        self.log_spans = log_spans
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, error=False, trace_id=None, **attributes):
+        """Records a duration measured elsewhere (e.g. an LLM's time to first token)."""
+        if not self.enabled or seconds is None:
+            return
+        with self._lock:
+            self._stages.setdefault(stage, StageHistogram()).observe(seconds, error)
+        if self.log_spans:
+            event = {'span': stage, 'duration_ms': round(seconds * 1000, 3),
+                     'trace_id': trace_id or _current_trace_id.get(), **attributes}
+            if error:
+                event['error'] = True
+            logger.info(json.dumps(event, default=str))
+
+    def snapshot(self):
+        """Returns count, mean and error count per stage."""
+        with self._lock:
+            return {stage: {'count': h.count, 'errors': h.errors,
+                            'mean_seconds': h.total_seconds / h.count if h.count else None}
+                    for stage, h in self._stages.items()}
+
+    def prometheus_text(self):
+        """Renders the stage histograms in the Prometheus text exposition format."""
+        lines = [
+            '# HELP rag_stage_duration_seconds Duration of RAG pipeline stages.',
+            '# TYPE rag_stage_duration_seconds histogram',
+        ]
+        errors = ['# HELP rag_stage_errors_total Stage runs that raised an exception.',
+                  '# TYPE rag_stage_errors_total counter']
+        with self._lock:
+            for stage, h in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h.bucket_counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {h.total_seconds}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {h.count}')
+                errors.append(f'rag_stage_errors_total{{stage="{stage}"}} {h.errors}')
+        return '\n'.join(lines + errors) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+tracer = Tracer()
+
+
+def configure(tracing_config):
+    """Applies the `tracing` section of config.yaml to the process-wide tracer."""
+    tracing_config = tracing_config or {}
+    tracer.enabled = tracing_config.get('enabled', True)
+    tracer.log_spans = tracing_config.get('log_spans', True)
+    if tracer.log_spans and not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def trace(trace_id=None):
+    """Tags every span opened in this context (and thread) with one trace id."""
+    token = _current_trace_id.set(trace_id or new_trace_id())
+    try:
+        yield _current_trace_id.get()
+    finally:
+        _current_trace_id.reset(token)
+
+
+@contextmanager
+def span(stage, **attributes):
+    """
+    Times a block of code as one pipeline stage.
+
+    Usage:
+        with tracing.span('vector_search', grade=grade):
+            ...
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        tracer.record(stage, time.perf_counter() - start, error=error, **attributes)
+
+
+def traced(stage):
+    """Decorator form of `span` for functions that are a stage on their own."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(stage, seconds, **attributes):
+    tracer.record(stage, seconds, **attributes)
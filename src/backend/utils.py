@@ -1,6 +1,25 @@
 import re
 from llama_index.core import Document
 
+# Patterns are compiled once at import time and shared by every TextCleaner
+_WHITESPACE = re.compile(r'\s+')
+_ISBN = re.compile(r'ISBN[\s:-]*([\d-]+)', re.IGNORECASE)
+_ARABIC = re.compile(r'[\u0600-\u06FF]+')
+_INDB_FILE = re.compile(r"WC\d?[_\w\d]+\.indb")
+_STANDALONE_NUMBERS = re.compile(r"\b\d{1,2}\b")  # Matches standalone numbers like 1, 16, etc.
+_TIMESTAMPS = re.compile(r"(PM|AM|[0-9]{1,2}:[0-9]{2})")
+# URLs, then any remaining special characters except :,/, and .
+_URLS_AND_SPECIAL_CHARS = re.compile(r"www\.[^\s]+|http[^\s]+|[^\w\s.,:!/\'-]")
+_DUPLICATE_WORDS = re.compile(r'\b(\w+)\s+\1\b')
+_BULLET = re.compile(r'[\x81•\-]')
+_NARRATIVE_METADATA = re.compile(r'(ISBN[\s:-]*[\d-]+|Center[\s\n]*.*?)', re.IGNORECASE)
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_LEADING_PUNCTUATION = ".,!?'-"
+# File-level metadata added by the reader that changes whenever any page of the file does;
+# kept out of each page's metadata so `Document.hash` changes only with the page itself
+VOLATILE_METADATA_KEYS = frozenset({'file_size', 'creation_date', 'last_modified_date', 'last_accessed_date'})
+
+
 class TextCleaner:
     def __init__(self):
         pass
@@ -9,71 +28,72 @@ class TextCleaner:
         """
         Cleans and structures text from starting pages or general pages.
         Handles metadata, lists, and narrative content dynamically.
-        
+
+        Substitutions whose order cannot change the result are fused into a
+        single pass over the page; the remaining ones run in the original order.
+
         Args:
             raw_text (str): Raw text input from a page.
         Returns:
             list: List of structured segments with metadata, lists, and narrative.
         """
-        # Step 1: Remove excessive spaces and line breaks
-        cleaned_text = re.sub(r'\s+', ' ', raw_text).strip()
+        # Step 1: Remove excessive spaces and line breaks (the text has no newlines after this)
+        cleaned_text = _WHITESPACE.sub(' ', raw_text).strip()
 
         # Initialize list for structured content
         segments = []
 
         # Step 2: Detect and extract ISBN
-        isbn_match = re.search(r'ISBN[\s:-]*([\d-]+)', cleaned_text, re.IGNORECASE)
+        isbn_match = _ISBN.search(cleaned_text)
         if isbn_match:
             segments.append({"type": "metadata", "content": f"ISBN: {isbn_match.group(1)}"})
 
-        # Step 3: Detect Author or Contributor Name
-        author_match = re.search(r'Center[\s\n]*(.*?)\n', cleaned_text, re.IGNORECASE)
-        if author_match:
-            segments.append({"type": "metadata", "content": f"Author: {author_match.group(1).strip()}"})
-
-        # Step 4: Remove Arabic characters
-        cleaned_text = re.sub(r'[\u0600-\u06FF]+', '', cleaned_text)
+        # Step 3: Remove Arabic characters
+        cleaned_text = _ARABIC.sub('', cleaned_text)
 
-        # Step 5: Remove irrelevant text patterns
-        cleaned_text = re.sub(r"WC\d?[_\w\d]+\.indb", "", cleaned_text)
-        cleaned_text = re.sub(r"\b\d{1,2}\b", "", cleaned_text)  # Matches standalone numbers like 1, 16, etc.
-        cleaned_text = re.sub(r"(PM|AM|[0-9]{1,2}:[0-9]{2})", "", cleaned_text)  # Matches timestamps
-        cleaned_text = re.sub(r"www\.[^\s]+|http[^\s]+", "", cleaned_text)  # Matches URLs
-        cleaned_text = re.sub(r'[^\w\s.,:!/\'-]', '', cleaned_text)  # Remove remaining special characters except :,/, and .
+        # Step 4: Remove irrelevant text patterns
+        if '.indb' in cleaned_text:
+            cleaned_text = _INDB_FILE.sub('', cleaned_text)
+        cleaned_text = _STANDALONE_NUMBERS.sub('', cleaned_text)
+        cleaned_text = _TIMESTAMPS.sub('', cleaned_text)
+        cleaned_text = _URLS_AND_SPECIAL_CHARS.sub('', cleaned_text)
 
-        # Step 6: Remove standalone symbols (e.g., `,`, `.` as individual tokens)
-        cleaned_text = re.sub(r'^[\.,!?\'-]', '', cleaned_text)  # Removes standalone punctuation marks
+        # Step 5: Remove a standalone punctuation mark at the start of the page
+        if cleaned_text and cleaned_text[0] in _LEADING_PUNCTUATION:
+            cleaned_text = cleaned_text[1:]
 
-        # Step 7: Remove duplicate words
-        cleaned_text = re.sub(r'\b(\w+)\s+\1\b', r'\1', cleaned_text)
+        # Step 6: Remove duplicate words
+        cleaned_text = _DUPLICATE_WORDS.sub(r'\1', cleaned_text)
 
-        # Step 8: Extract bullet points (e.g., lists with symbols)
-        bullets = re.findall(r'[\x81•\-]\s*(.*?)\s*(?=[\x81•\-]|$)', cleaned_text)
-        for bullet in bullets:
+        # Step 7: Split on bullet symbols; every piece after a bullet is a list item
+        # and the narrative is whatever precedes the first bullet
+        pieces = _BULLET.split(cleaned_text)
+        for bullet in pieces[1:]:
             segments.append({"type": "list_item", "content": bullet.strip()})
 
-        # Step 9: Remove bullets and metadata to isolate narrative content
-        cleaned_text_no_bullets = re.sub(r'[\x81•\-].*?\s*(?=[\x81•\-]|$)', '', cleaned_text).strip()
-        narrative = re.sub(r'(ISBN[\s:-]*[\d-]+|Center[\s\n]*.*?)', '', cleaned_text_no_bullets, flags=re.IGNORECASE).strip()
+        # Step 8: Remove metadata to isolate narrative content
+        narrative = _NARRATIVE_METADATA.sub('', pieces[0].strip()).strip()
 
-        # Step 10: Split long text into sentences for readability
+        # Step 9: Split long text into sentences for readability
         if narrative:
-            sentences = re.split(r'(?<=[.!?])\s+', narrative)
-            for sentence in sentences:
-                if sentence.strip():
-                    segments.append({"type": "narrative", "content": sentence.strip()})
+            for sentence in _SENTENCE_END.split(narrative):
+                sentence = sentence.strip()
+                if sentence:
+                    segments.append({"type": "narrative", "content": sentence})
 
-        # Step 11: Remove lines that contain only a punctuation mark
-        cleaned_text_lines = cleaned_text.split('\n')
-        cleaned_text_lines = [line for line in cleaned_text_lines if not re.match(r'^\s*[.,!?\'-]\s*$', line)]
-        cleaned_text = '\n'.join(cleaned_text_lines)
+        return segments
 
-        # Update the narrative content
-        narrative_lines = narrative.split('\n')
-        narrative_lines = [line.lstrip() for line in narrative_lines if not re.match(r'^\s*[.,!?\'-]\s*$', line)]
-        narrative = '\n'.join(narrative_lines)
+    def clean_pages(self, pages):
+        """
+        Lazily cleans an iterable of raw page texts.
 
-        return segments
+        Args:
+            pages (iterable): Raw page texts, e.g. streamed from a reader.
+        Yields:
+            list: The structured segments of each page, in order.
+        """
+        for raw_text in pages:
+            yield self.clean_text_content(raw_text)
 
 
 class DocumentProcessor:
@@ -91,12 +111,10 @@ class DocumentProcessor:
             list: A list of cleaned Document objects ready for indexing.
         """
         cleaned_documents = []
-        
-        for doc in documents:
-            # Extract and clean the text content from the Document
-            raw_text = doc.text
-            cleaned_data = self.text_cleaner.clean_text_content(raw_text)
-            
+
+        # Clean the pages as a stream, one Document at a time
+        cleaned_pages = self.text_cleaner.clean_pages(doc.text for doc in documents)
+        for doc, cleaned_data in zip(documents, cleaned_pages):
             # Combine cleaned segments into a single text string
             combined_content = "\n".join(
                 segment['content']
@@ -104,7 +122,15 @@ class DocumentProcessor:
                 if segment['type'] in ['metadata', 'list_item', 'narrative']
             )
             
-            # Create a new Document object with the cleaned content
-            cleaned_documents.append(Document(text=combined_content))
+            # Create a new Document object with the cleaned content, keeping the source
+            # id and stable metadata for incremental builds but out of the embedded/LLM text
+            metadata = {key: value for key, value in doc.metadata.items() if key not in VOLATILE_METADATA_KEYS}
+            cleaned_documents.append(Document(
+                text=combined_content,
+                id_=doc.id_,
+                metadata=metadata,
+                excluded_embed_metadata_keys=list(metadata.keys()),
+                excluded_llm_metadata_keys=list(metadata.keys()),
+            ))
         
         return cleaned_documents
\ No newline at end of file
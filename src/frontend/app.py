@@ -1,8 +1,14 @@
+import json
+import uuid
+import logging
+from collections import deque
 import streamlit as st
-from retrieval import VectorDBBuilder
-from model import LLMModel
+from client import RAGClient
 import yaml
 
+# Stream timings seen by this UI, one JSON object per line like the backend's rag.trace spans
+logger = logging.getLogger('rag.frontend')
+
 def load_config(config_file):
     with open(config_file, 'r') as f:
         config = yaml.safe_load(f)
@@ -12,66 +18,57 @@ def submit_function():
     if user_prompt:
         # Store user message in session state
         st.session_state.messages.append({"role": "user", "content": user_prompt})
-        # Query the vector DB for context
-        response = query_engine.query(user_prompt)
 
-        if response.source_nodes == []:
-            response_text = "Sorry, I can only answer questions based on the books for your grade."
-            # Store assistant message in session state
+        # Stream the answer from the RAG backend, rendering tokens as they arrive
+        try:
+            placeholder = st.empty()
+            response_text = ""
+            for event in st.session_state.rag_client.stream_chat(
+                grade=selected_grade,
+                model=st.session_state.selected_model,
+                question=user_prompt,
+                max_tokens=512,
+                session_id=st.session_state.session_id,
+            ):
+                if event["type"] == "delta":
+                    response_text += event["content"]
+                    placeholder.markdown(f"**🤖 Assistant:** {response_text}▌")
+                elif event["type"] == "done":
+                    response_text = event["response"]
+                    stats = event.get("stats")
+                    if stats and stats.get("time_to_first_token") is not None:
+                        logger.info(json.dumps({"span": "frontend_stream", "session_id": st.session_state.session_id,
+                                                **stats}))
+                elif event["type"] == "error":
+                    raise RuntimeError(event["message"])
+            placeholder.markdown(f"**🤖 Assistant:** {response_text}")
+
+            # Store the full assistant message in session state
             st.session_state.messages.append({"role": "assistant", "content": response_text})
-            # Display assistant response
-            st.markdown(f"**🤖 Assistant:** {response_text}")
-        else:
-            # reformat response
-            context = "Context:\n"
-            for i in range(config['query_config']['top_k']):
-                try:
-                    context = context + response.source_nodes[i].text + "\n\n"
-                except:
-                    continue
-            print(context)
-            # Combine context with user prompt
-            full_prompt = f"StudentGPT, a chatbot that answers students' questions based on their grade and the \
-                            relevant books.communicates in clear, easy language, answer is short and brief. \
-                            Context:\n \
-                            {context}\n \
-                            Please respond to the following question. Use the context above if it is helpful. \
-                            if not helpful please respond with \"Sorry, I can only answer questions based on the books for your grade.\" \
-                            \nUser Prompt:\n{user_prompt}"
-
-            # Generate response from the LLM
-            try:
-                response_text = st.session_state.model.generate_response(
-                    model=st.session_state.selected_model,
-                    prompt=full_prompt,
-                    max_tokens=512,
-                )
-
-                # Store assistant message in session state
-                st.session_state.messages.append({"role": "assistant", "content": response_text})
-
-                # Display assistant response
-                st.markdown(f"**🤖 Assistant:** {response_text}")
-            except Exception as e:
-                st.error(f"Error generating response: {e}")
+        except Exception as e:
+            st.error(f"Error generating response: {e}")
 
 config_file = '../config/config.yaml'
 config = load_config(config_file)
+if config.get('tracing', {}).get('log_spans', True) and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
 
 # Streamlit UI setup
 st.set_page_config(page_icon="💬", layout="wide", page_title="RAG Chatbot")
 
-# Cache initialization functions
-@st.cache_resource
-def load_vectordb_builder():
-    return VectorDBBuilder(config_file='../config/config.yaml')
-
-# Initialize components
-builder = load_vectordb_builder()
-
-# Session state for the model
-if "model" not in st.session_state:
-    st.session_state.model = LLMModel(api_key=st.secrets["groq_api_key"])
+# Session state for the backend client (retrieval and LLM calls run in the RAG service);
+# the session id also keys this conversation's memory in the service
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+if "rag_client" not in st.session_state:
+    st.session_state.rag_client = RAGClient(
+        config.get('serving', {}).get('backend_url', 'http://localhost:8000'),
+        client_id=st.session_state.session_id,
+    )
 
 # Sidebar
 st.sidebar.title("Settings")
@@ -79,24 +76,7 @@ grades = config['grades']
 selected_grade = st.sidebar.selectbox("Choose a grade:", grades)
 
 # Available LLM models
-models = {
-    "llama3-70b-8192": {
-        "name": "LLaMA3-70b-Instruct",
-        "tokens": 8192,
-        "developer": "Meta",
-    },
-    "llama3-8b-8192": {
-        "name": "LLaMA3-8b-Instruct",
-        "tokens": 8192,
-        "developer": "Meta",
-    },
-    "mixtral-8x7b-32768": {
-        "name": "Mixtral-8x7b-Instruct-v0.1",
-        "tokens": 32768,
-        "developer": "Mistral",
-    },
-    "gemma-7b-it": {"name": "Gemma-7b-it", "tokens": 8192, "developer": "Google"},
-}
+models = config['models']
 
 # Model selection and max tokens slider
 model_option = st.sidebar.selectbox(
@@ -106,16 +86,17 @@ model_option = st.sidebar.selectbox(
 )
 
 # Initialize session state for messages and selected model
+# (only the latest messages are kept, so every rerun renders a bounded page)
+max_rendered_messages = config.get('memory', {}).get('max_rendered_messages', 50)
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = deque(maxlen=max_rendered_messages)
 
 # if "selected_model" not in st.session_state:
     st.session_state.selected_model = model_option
 
-# Load the vector DB
-query_engine = builder.load_vectordb(selected_grade)
-
 # Display chat messages
+if len(st.session_state.messages) == max_rendered_messages:
+    st.caption("Older messages are hidden.")
 for message in st.session_state.messages:
     role = "🤖 Assistant" if message["role"] == "assistant" else "👨‍💻 User"
     st.markdown(f"**{role}:** {message['content']}")
@@ -0,0 +1,36 @@
+import json
+import requests
+
+
+class RAGClient:
+    """Thin HTTP client for the RAG serving backend (src/backend/server.py)."""
+    def __init__(self, base_url: str, client_id: str = None, timeout: float = 120):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {'X-Client-Id': client_id} if client_id else {}
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def query(self, grade: str, question: str) -> list:
+        response = self.session.post(f"{self.base_url}/query", json={"grade": grade, "question": question},
+                                     headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["nodes"]
+
+    def stream_chat(self, grade: str, model: str, question: str, max_tokens: int = 512, session_id: str = None):
+        """
+        Streams a chat answer from the backend.
+
+        Passing a `session_id` lets the backend resolve follow-up questions
+        against the session's earlier turns.
+
+        Yields:
+            dict: Events of type 'delta', 'done' or 'error' (see RAGService.chat_events).
+        """
+        payload = {"grade": grade, "model": model, "question": question, "max_tokens": max_tokens, "stream": True,
+                   "session_id": session_id}
+        with self.session.post(f"{self.base_url}/chat", json=payload, headers=self.headers,
+                               stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    yield json.loads(line[len("data: "):])
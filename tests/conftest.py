@@ -0,0 +1,61 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# Backend modules import each other by bare name (see run.sh)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'backend')))
+
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from embedding import EmbeddingStore
+from lexical import BM25Index
+from retrieval import NumpyRetriever
+from search import ExactSearchIndex
+
+TEXTS = [
+    "Amman is the biggest city in Jordan.",
+    "The Nabateans lived in Petra a long time ago.",
+    "Plants need water and sunlight to grow.",
+    "Whales are the biggest animals in the sea.",
+]
+EMBEDDINGS = np.eye(4, dtype=np.float32)
+
+
+class RecordingEmbedding(MockEmbedding):
+    """MockEmbedding that records the size of every batch the model is asked to embed."""
+    def __init__(self, **kwargs):
+        super().__init__(embed_dim=4, **kwargs)
+        object.__setattr__(self, 'calls', [])
+
+    def _get_text_embeddings(self, texts):
+        self.calls.append(len(texts))
+        return super()._get_text_embeddings(texts)
+
+
+@pytest.fixture
+def recording_embedding():
+    return RecordingEmbedding()
+
+
+@pytest.fixture
+def make_retriever(tmp_path):
+    """Builds a NumpyRetriever over TEXTS, one orthogonal embedding per text, stored in `tmp_path`."""
+    def make(top_k=2, similarity_cutoff=None, lexical=False, lexical_min_score=0.0):
+        node_ids = [f'node-{i}' for i in range(len(TEXTS))]
+        docstore = SimpleDocumentStore()
+        docstore.add_documents([TextNode(id_=node_id, text=text) for node_id, text in zip(node_ids, TEXTS)])
+        EmbeddingStore.write(str(tmp_path), node_ids, EMBEDDINGS)
+        store = EmbeddingStore.load(str(tmp_path))
+        return NumpyRetriever(
+            embedding_store=store,
+            docstore=docstore,
+            search_index=ExactSearchIndex(store.matrix),
+            top_k=top_k,
+            similarity_cutoff=similarity_cutoff,
+            embed_model=MockEmbedding(embed_dim=4),
+            lexical_index=BM25Index.build(TEXTS) if lexical else None,
+            lexical_min_score=lexical_min_score,
+        )
+    return make
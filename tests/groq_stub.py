@@ -0,0 +1,112 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GroqStub:
+    """
+    Local stand-in for Groq's chat completions endpoint.
+
+    Every request pops the next scripted failure from `failures` (if any) and
+    otherwise answers with `reply`, as JSON or as a server-sent event stream.
+    `delays` maps a model id to the seconds it waits before answering;
+    `first_chunk_delays` to the seconds a stream stalls after its headers.
+
+    Usage:
+        with GroqStub(reply="Hello there") as stub:
+            LLMModel("test-key", {"base_url": stub.base_url})
+    """
+    def __init__(self, reply="Hello there", failures=None, delays=None, chunk_delay=0.0, first_chunk_delays=None):
+        self.reply = reply
+        self.failures = list(failures or [])
+        self.delays = delays or {}
+        self.first_chunk_delays = first_chunk_delays or {}
+        self.chunk_delay = chunk_delay
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_failure(self, body):
+        with self._lock:
+            self.requests.append(body)
+            return self.failures.pop(0) if self.failures else None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                failure = stub._next_failure(body)
+                if failure is not None:
+                    status, headers = failure if isinstance(failure, tuple) else (failure, {})
+                    self._send_json(status, {"error": {"message": f"stub error {status}"}}, headers)
+                    return
+
+                time.sleep(stub.delays.get(body['model'], 0.0))
+                if body.get('stream'):
+                    self._stream(body['model'])
+                else:
+                    self._send_json(200, {
+                        "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                        "model": body['model'],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": stub.reply}}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": len(stub.reply.split()),
+                                  "total_tokens": 10 + len(stub.reply.split())},
+                    })
+
+            def _stream(self, model):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                self.wfile.flush()
+                time.sleep(stub.first_chunk_delays.get(model, 0.0))
+                words = stub.reply.split(' ')
+                for i, word in enumerate(words):
+                    content = word if i == 0 else ' ' + word
+                    self._event({"choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]},
+                                model)
+                    time.sleep(stub.chunk_delay)
+                self._event({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                             "x_groq": {"id": "stub", "usage": {"prompt_tokens": 10,
+                                                                 "completion_tokens": len(words),
+                                                                 "total_tokens": 10 + len(words)}}}, model)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _event(self, chunk, model):
+                chunk.update({"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                              "created": int(time.time()), "model": model})
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+
+        return Handler
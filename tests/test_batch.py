@@ -0,0 +1,106 @@
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+from batch import BatchAnswerer, read_questions, read_results, write_faq_file
+from cache import FAQLookup
+from context import ContextBuilder
+from model import AsyncLLMModel
+from rag import NO_ANSWER
+from groq_stub import GroqStub
+
+MODEL = "llama3-8b-8192"
+
+
+def write_jsonl(path, items):
+    path.write_text(''.join(json.dumps(item) + '\n' for item in items), encoding='utf-8')
+
+
+def test_read_questions_fills_defaults_and_stable_ids(tmp_path):
+    path = tmp_path / 'questions.jsonl'
+    write_jsonl(path, [{"question": "Who lived in Petra?"}, {"id": 7, "question": "Why?", "grade": "Grade5"}])
+    first = read_questions(str(path), "Grade4", MODEL)
+    assert [(q['id'], q['grade'], q['model']) for q in first][1] == ('7', 'Grade5', MODEL)
+    assert first[0]['grade'] == 'Grade4'
+    # Ids without one are derived from the question, so reruns line up
+    assert read_questions(str(path), "Grade4", MODEL)[0]['id'] == first[0]['id']
+
+
+def test_read_results_skips_failures_and_cut_off_lines(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    path.write_text(json.dumps({"id": "a", "answer": "yes"}) + '\n'
+                    + json.dumps({"id": "b", "error": "LLM API call failed"}) + '\n'
+                    + '{"id": "c", "ans', encoding='utf-8')
+    assert list(read_results(str(path))) == ['a']
+
+
+def test_faq_file_round_trip_and_reload(tmp_path):
+    path = str(tmp_path / 'faq.json')
+    faq = FAQLookup(path)
+    assert faq.lookup("Grade4", "Who lived in Petra?") is None
+
+    results = [
+        {"grade": "Grade4", "model": MODEL, "question": "Who lived in Petra?", "answer": "The Nabateans."},
+        {"grade": "Grade4", "model": MODEL, "question": "What is a quasar?", "answer": NO_ANSWER},
+    ]
+    assert write_faq_file(path, results) == 1
+    os.utime(path, ns=(1, 1))  # mtime resolution can hide a rewrite within the same tick
+    assert faq.lookup("Grade4", "who lived in petra ?")["answer"] == "The Nabateans."
+    assert faq.lookup("Grade4", "What is a quasar?") is None
+    assert faq.stats() == {'entries': 1, 'hits': 1}
+
+
+def test_batch_run_answers_and_resumes(tmp_path, make_retriever):
+    retriever = make_retriever()
+    builder = SimpleNamespace(get_query_engine=lambda grade: SimpleNamespace(retriever=retriever))
+    questions = [{"id": str(i), "grade": "Grade4", "model": MODEL, "question": f"Question {i}?"}
+                 for i in range(5)]
+    output = str(tmp_path / 'results.jsonl')
+
+    async def run(stub, items):
+        llm = AsyncLLMModel("test-key", {"base_url": stub.base_url, "timeout_seconds": 5, "max_retries": 0})
+        answerer = BatchAnswerer(builder, llm, ContextBuilder({}), concurrency=2, batch_size=2)
+        try:
+            return await answerer.run(items, output)
+        finally:
+            await llm.close()
+
+    with GroqStub(reply="An answer.") as stub:
+        assert asyncio.run(run(stub, questions[:3] + questions[:1])) == (3, 1, 0)
+        assert len(stub.requests) == 3
+        assert asyncio.run(run(stub, questions)) == (2, 3, 0)
+        assert len(stub.requests) == 5
+
+    results = read_results(output)
+    assert sorted(results) == [str(i) for i in range(5)]
+    assert results['4']['answer'] == "An answer."
+
+
+def test_batch_run_records_unexpected_errors_and_keeps_going(tmp_path, make_retriever):
+    retriever = make_retriever()
+    builder = SimpleNamespace(get_query_engine=lambda grade: SimpleNamespace(retriever=retriever))
+    questions = [{"id": str(i), "grade": "Grade4", "model": MODEL, "question": f"Question {i}?"}
+                 for i in range(3)]
+    output = str(tmp_path / 'results.jsonl')
+
+    class FailingContextBuilder(ContextBuilder):
+        def build(self, source_nodes, query_embedding, model, max_tokens, question):
+            if question == "Question 1?":
+                raise KeyError("no tokenizer")
+            return super().build(source_nodes, query_embedding, model, max_tokens, question)
+
+    async def run(stub):
+        llm = AsyncLLMModel("test-key", {"base_url": stub.base_url, "timeout_seconds": 5, "max_retries": 0})
+        answerer = BatchAnswerer(builder, llm, FailingContextBuilder({}), concurrency=2, batch_size=2)
+        try:
+            return await answerer.run(questions, output)
+        finally:
+            await llm.close()
+
+    with GroqStub(reply="An answer.") as stub:
+        assert asyncio.run(run(stub)) == (2, 0, 1)
+
+    with open(output, encoding='utf-8') as f:
+        results = {result['id']: result for result in map(json.loads, f)}
+    assert results['1']['error'] == "'no tokenizer'"
+    assert results['0']['answer'] == results['2']['answer'] == "An answer."
@@ -0,0 +1,103 @@
+import os
+import pytest
+from cache import FAQLookup, InMemoryCacheBackend, ResponseCache, SQLiteCacheBackend, normalize_question
+
+CONTEXT = "Whales are the biggest animals in the sea."
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_backend(request, tmp_path):
+    def make(max_entries=10000, ttl_seconds=None):
+        if request.param == 'sqlite':
+            return SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'), max_entries, ttl_seconds)
+        return InMemoryCacheBackend(max_entries, ttl_seconds)
+    return make
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('cache.time.time', lambda: now[0])
+    return now
+
+
+def test_normalize_question():
+    assert normalize_question("  What's the BIGGEST   animal?! ") == "what s the biggest animal"
+
+
+def test_exact_and_semantic_tiers(make_backend):
+    cache = ResponseCache(make_backend(), similarity_threshold=0.95)
+    cache.store("Grade4", "llama3-8b-8192", "What is the biggest animal?", CONTEXT, "The blue whale.", [1.0, 0.0])
+
+    # Exact: the normalized question matches
+    assert cache.lookup("Grade4", "llama3-8b-8192", "what is the biggest animal", CONTEXT) == "The blue whale."
+    # Semantic: another wording with a near-identical query embedding in the same namespace
+    assert cache.lookup("Grade4", "llama3-8b-8192", "Which animal is largest?", CONTEXT, [0.99, 0.05]) \
+        == "The blue whale."
+    assert cache.lookup("Grade4", "llama3-8b-8192", "Where do whales live?", CONTEXT, [0.6, 0.8]) is None
+    assert cache.stats() == {'exact_hits': 1, 'semantic_hits': 1, 'misses': 1, 'hit_rate': 2 / 3}
+
+
+@pytest.mark.parametrize('grade, model, context', [
+    ("Grade5", "llama3-8b-8192", CONTEXT),
+    ("Grade4", "llama3-70b-8192", CONTEXT),
+    ("Grade4", "llama3-8b-8192", "Plants need water."),
+])
+def test_answers_are_keyed_on_grade_model_and_context(make_backend, grade, model, context):
+    cache = ResponseCache(make_backend())
+    cache.store("Grade4", "llama3-8b-8192", "What is the biggest animal?", CONTEXT, "The blue whale.", [1.0, 0.0])
+    assert cache.lookup(grade, model, "What is the biggest animal?", context, [1.0, 0.0]) is None
+
+
+def test_entries_expire_after_the_ttl(make_backend, clock):
+    cache = ResponseCache(make_backend(ttl_seconds=60))
+    cache.store("Grade4", "m", "Question?", CONTEXT, "Answer.", [1.0, 0.0])
+    clock[0] += 30
+    assert cache.lookup("Grade4", "m", "Question?", CONTEXT) == "Answer."
+    clock[0] += 60
+    assert cache.lookup("Grade4", "m", "Question?", CONTEXT) is None
+    assert cache.lookup("Grade4", "m", "Other wording?", CONTEXT, [1.0, 0.0]) is None
+
+
+def test_least_recently_used_entries_are_evicted(make_backend, clock):
+    cache = ResponseCache(make_backend(max_entries=2))
+    for question in ("First?", "Second?"):
+        cache.store("Grade4", "m", question, CONTEXT, question.upper())
+        clock[0] += 1
+    assert cache.lookup("Grade4", "m", "First?", CONTEXT) == "FIRST?"  # now the most recent
+    clock[0] += 1
+    cache.store("Grade4", "m", "Third?", CONTEXT, "THIRD?")
+    assert cache.lookup("Grade4", "m", "Second?", CONTEXT) is None
+    assert cache.lookup("Grade4", "m", "First?", CONTEXT) == "FIRST?"
+    assert cache.lookup("Grade4", "m", "Third?", CONTEXT) == "THIRD?"
+
+
+def test_memory_backend_namespace_index_follows_evictions():
+    backend = InMemoryCacheBackend(max_entries=2)
+    for key, namespace in (('a', 'x'), ('b', 'y'), ('c', 'x')):
+        backend.set(key, {'namespace': namespace, 'response': key, 'embedding': None, 'created_at': 0.0})
+    assert [key for key, _ in backend.namespace_entries('x')] == ['c']
+    assert backend.namespace_entries('missing') == []
+
+
+def test_sqlite_backend_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    ResponseCache(SQLiteCacheBackend(path)).store("Grade4", "m", "Question?", CONTEXT, "Answer.", [0.5, 0.5])
+    # Another process opening the same file sees the answer, embedding included
+    other = ResponseCache(SQLiteCacheBackend(path))
+    assert other.lookup("Grade4", "m", "Reworded question?", CONTEXT, [0.5, 0.5]) == "Answer."
+
+
+def test_faq_file_is_written_atomically_and_reloaded_when_it_changes(tmp_path):
+    path = str(tmp_path / 'faq.json')
+    faq = FAQLookup(path)
+    assert faq.lookup("Grade4", "Who lived in Petra?") is None
+
+    FAQLookup.write(path, {"Grade4": {"who lived in petra": {"answer": "The Nabateans."}}})
+    assert os.listdir(tmp_path) == ['faq.json']
+    assert faq.lookup("Grade4", "Who lived in Petra?")["answer"] == "The Nabateans."
+
+    FAQLookup.write(path, {"Grade4": {"who lived in petra": {"answer": "The Nabataeans."}}})
+    os.utime(path, ns=(1, 1))  # make sure the modification time differs from the first write
+    assert faq.lookup("Grade4", "who lived in PETRA")["answer"] == "The Nabataeans."
+    assert faq.stats() == {'entries': 1, 'hits': 2}
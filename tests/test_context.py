@@ -0,0 +1,52 @@
+import numpy as np
+from llama_index.core.schema import NodeWithScore, TextNode
+from context import ContextBuilder, estimate_tokens, mmr_order
+from rag import NO_ANSWER, build_prompt
+
+
+def make_node(text, embedding, score=0.5):
+    return NodeWithScore(node=TextNode(text=text, embedding=list(embedding)), score=score)
+
+
+def test_estimate_tokens_splits_long_words_and_punctuation():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("The cat sat.") == 4
+    assert estimate_tokens("photosynthesis") == 3
+
+
+def test_mmr_order_drops_near_duplicates_and_prefers_diversity():
+    query = [1.0, 0.0, 0.0]
+    embeddings = [
+        [0.9, 0.1, 0.0],    # best match
+        [0.9, 0.11, 0.0],   # overlapping chunk, near-duplicate of the first
+        [0.7, 0.0, 0.7],    # relevant and different
+        [0.8, 0.6, 0.0],    # relevant, but closer to the first
+    ]
+    order = mmr_order(query, embeddings, mmr_lambda=0.5, duplicate_threshold=0.99)
+    assert order[0] == 0
+    assert 1 not in order
+    assert order[1] == 2
+
+
+def test_select_packs_chunks_within_token_budget():
+    rng = np.random.default_rng(0)
+    nodes = [make_node(text, rng.normal(size=8)) for text in
+             ["word " * 50, "word " * 200, "word " * 30, "word " * 10]]
+    builder = ContextBuilder({}, max_chunks=None)
+    selected = builder.select(nodes, None, token_budget=100)
+    assert [n.text for n in selected] == [nodes[0].text, nodes[2].text, nodes[3].text]
+    assert sum(estimate_tokens(n.text) for n in selected) <= 100
+
+
+def test_token_budget_follows_model_window():
+    builder = ContextBuilder({"small": {"tokens": 1000}, "large": {"tokens": 32768}}, reserve_tokens=0)
+    assert builder.token_budget("small", 512, prompt_tokens=100) == 388
+    assert builder.token_budget("large", 512) == 32256
+    assert ContextBuilder({"large": {"tokens": 32768}}, max_context_tokens=1500).token_budget("large", 512) == 1500
+
+
+def test_build_prompt_includes_context_and_question():
+    prompt = build_prompt("Plants make food from light.", "How do plants eat?")
+    assert "Context:\nPlants make food from light.\n" in prompt
+    assert prompt.endswith("User Prompt:\nHow do plants eat?")
+    assert NO_ANSWER in prompt
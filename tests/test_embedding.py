@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from llama_index.core import VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from embedding import JSON_VECTOR_STORE_FILE, EmbeddingService, EmbeddingStore, ServiceEmbedding, convert_json_vector_store
+
+
+def test_service_sends_whole_micro_batches_to_the_model(recording_embedding):
+    model = recording_embedding
+    service = EmbeddingService(model, max_batch_size=32, max_wait_ms=500)
+    vectors = service.embed_queries([f"question {i}" for i in range(32)])
+    assert len(vectors) == 32
+    # One model call for the whole micro-batch, not the default chunks of 10
+    assert model.calls == [32]
+
+    embedding = ServiceEmbedding(service, embed_batch_size=32)
+    embedding.get_text_embedding_batch([f"chunk {i}" for i in range(40)])
+    assert model.calls[1:] == [32, 8]
+
+
+def test_store_write_load_round_trip(tmp_path):
+    embeddings = [[3.0, 4.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0], [1.0, 1.0, 1.0, 1.0]]
+    EmbeddingStore.write(str(tmp_path), ['a', 'b', 'c'], embeddings, ['doc-1', None, 'doc-2'])
+    assert EmbeddingStore.exists(str(tmp_path))
+
+    store = EmbeddingStore.load(str(tmp_path))
+    assert (len(store), store.dim) == (3, 4)
+    assert store.node_ids == ['a', 'b', 'c'] and store.ref_doc_ids == ['doc-1', None, 'doc-2']
+    # Rows are L2-normalized; an all-zero row stays zero
+    np.testing.assert_allclose(store.matrix, [[0.6, 0.8, 0, 0], [0, 0, 0, 0], [0.5, 0.5, 0.5, 0.5]], atol=1e-6)
+
+    EmbeddingStore.write(str(tmp_path), ['a', 'b', 'c'], embeddings, dtype='float16')
+    assert EmbeddingStore.load(str(tmp_path)).matrix.dtype == np.float16
+    with pytest.raises(ValueError):
+        EmbeddingStore.write(str(tmp_path), ['a'], embeddings)
+
+    EmbeddingStore.write(str(tmp_path), [], [], dtype='float32')
+    assert len(EmbeddingStore.load(str(tmp_path))) == 0
+
+
+def test_convert_json_vector_store_then_load_it_back_as_a_vector_store(tmp_path):
+    index = VectorStoreIndex([TextNode(id_='a', text="whales"), TextNode(id_='b', text="plants")],
+                             embed_model=MockEmbedding(embed_dim=4))
+    index.storage_context.persist(str(tmp_path))
+    original = index.vector_store.data.embedding_dict
+
+    convert_json_vector_store(str(tmp_path), remove_json=True)
+    assert not (tmp_path / JSON_VECTOR_STORE_FILE).exists()
+    store = EmbeddingStore.load(str(tmp_path))
+    assert sorted(store.node_ids) == ['a', 'b']
+
+    vector_store = store.to_simple_vector_store()
+    for node_id in ('a', 'b'):
+        vector = np.asarray(original[node_id])
+        np.testing.assert_allclose(vector_store.get(node_id), vector / np.linalg.norm(vector), atol=1e-6)
+    assert vector_store.data.text_id_to_ref_doc_id == index.vector_store.data.text_id_to_ref_doc_id
@@ -0,0 +1,92 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.schema import Document
+import ingestion
+from ingestion import IngestionPipeline
+from utils import DocumentProcessor, TextCleaner
+
+
+@pytest.fixture
+def embed_model(monkeypatch, recording_embedding):
+    monkeypatch.setattr(Settings, '_embed_model', recording_embedding)
+    return recording_embedding
+
+
+def loader_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'ingestion-loader']
+
+
+def thread_pipeline(monkeypatch, pages_by_path, **options):
+    # Parse in threads instead of spawned processes, from an in-memory "file system"
+    def load_and_clean_file(path):
+        if isinstance(pages_by_path[path], Exception):
+            raise pages_by_path[path]
+        # Like the reader: every page carries the file's size and modification date
+        pages = pages_by_path[path]
+        file_metadata = {'file_path': path, 'file_size': sum(len(text) for text in pages),
+                         'last_modified_date': str(hash(tuple(pages)))}
+        documents = [Document(text=text, doc_id=f'{path}_part_{i}', metadata=dict(file_metadata, page_label=str(i + 1)))
+                     for i, text in enumerate(pages)]
+        return DocumentProcessor(TextCleaner()).process_documents(documents), {}
+    monkeypatch.setattr(ingestion, 'load_and_clean_file', load_and_clean_file)
+    pipeline = IngestionPipeline(**options)
+    pipeline._executor = ThreadPoolExecutor(max_workers=2)
+    return pipeline
+
+
+def test_unchanged_pages_are_reused_and_batches_reach_the_model_whole(monkeypatch, embed_model):
+    pages = {'book.pdf': [f"Page {i} talks about topic number {i}." for i in range(15)]}
+    pipeline = thread_pipeline(monkeypatch, pages, embed_batch_size=12)
+    index = VectorStoreIndex(nodes=[], embed_model=embed_model)
+
+    doc_ids, embedded, reused = pipeline.run(index, ['book.pdf'])
+    assert (embedded, reused) == (15, 0)
+    assert doc_ids['book.pdf'] == [f'book.pdf_part_{i}' for i in range(15)]
+    # Batches of embed_batch_size, not the embedding model's default chunks of 10
+    assert embed_model.calls == [12, 3]
+
+    # Editing one page changes the file's size and date, but only that page is embedded again
+    pages['book.pdf'][2] = "Page 2 was rewritten with a much longer text than before."
+    _, embedded, reused = pipeline.run(index, ['book.pdf'])
+    assert (embedded, reused) == (1, 14)
+    assert len(index.docstore.docs) == 15
+
+
+def test_worker_error_is_raised_and_the_loader_stops(monkeypatch, embed_model):
+    pages = {'good.pdf': ["Fine page."], 'broken.pdf': ValueError("not a PDF")}
+    pipeline = thread_pipeline(monkeypatch, pages)
+    with pytest.raises(ValueError, match="not a PDF"):
+        pipeline.run(VectorStoreIndex(nodes=[], embed_model=embed_model), ['good.pdf', 'broken.pdf'])
+    assert not loader_threads()
+
+
+def test_failing_consumer_unblocks_the_bounded_loader(monkeypatch, embed_model):
+    paths = [f'file{i}.pdf' for i in range(50)]
+    pipeline = thread_pipeline(monkeypatch, {path: [f"Text of {path}."] for path in paths},
+                               embed_batch_size=1, max_pending_files=2)
+
+    def failing_flush(*args):
+        raise RuntimeError("index write failed")
+    monkeypatch.setattr(pipeline, '_flush', failing_flush)
+    with pytest.raises(RuntimeError, match="index write failed"):
+        pipeline.run(VectorStoreIndex(nodes=[], embed_model=embed_model), paths)
+    assert not loader_threads()
+
+
+def test_stop_event_ends_a_loader_blocked_on_a_full_queue(monkeypatch):
+    paths = [f'file{i}.pdf' for i in range(50)]
+    pipeline = thread_pipeline(monkeypatch, {path: ["Text."] for path in paths}, max_pending_files=2)
+    out_queue = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    loader = threading.Thread(target=pipeline._load_stage, args=(paths, out_queue, stop), daemon=True)
+    loader.start()
+
+    out_queue.get()  # take one file, then stop consuming
+    stop.set()
+    loader.join(timeout=5)
+    assert not loader.is_alive()
+    # Only the bounded window of files was ever handed out
+    assert out_queue.qsize() <= 1
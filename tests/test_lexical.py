@@ -0,0 +1,41 @@
+import numpy as np
+from lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "Photosynthesis is how plants make food from sunlight.",
+    "The water cycle moves water between the sea and the sky.",
+    "Plants need water and sunlight to grow.",
+    "Amman is the biggest city in Jordan.",
+]
+
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    assert tokenize("The Water Cycle is fun!") == ["water", "cycle", "fun"]
+
+
+def test_search_ranks_rare_terms_first():
+    index = BM25Index.build(TEXTS)
+    rows, scores = index.search("What is photosynthesis in plants?", top_k=3)
+    assert list(rows[:2]) == [0, 2]
+    assert np.all(np.diff(scores) <= 0)
+    assert len(index.search("volcano", top_k=3)[0]) == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = BM25Index.build(TEXTS)
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path), count=len(TEXTS))
+    np.testing.assert_allclose(loaded.scores("water sunlight"), index.scores("water sunlight"))
+    assert BM25Index.load(str(tmp_path), count=len(TEXTS) + 1) is None
+
+    # Rebuilt from other nodes with the same row count
+    index.save(str(tmp_path), source='fingerprint-a')
+    assert BM25Index.load(str(tmp_path), len(TEXTS), source='fingerprint-a') is not None
+    assert BM25Index.load(str(tmp_path), len(TEXTS), source='fingerprint-b') is None
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    rows, scores = reciprocal_rank_fusion([[3, 1, 2], [1, 4]], k=60)
+    assert rows[0] == 1
+    assert set(rows) == {1, 2, 3, 4}
+    assert scores[0] == 1 / 62 + 1 / 61
@@ -0,0 +1,50 @@
+from context import estimate_tokens
+from memory import ConversationMemory, SessionStore
+
+
+def test_follow_up_rewrite_carries_the_topic_and_is_cached():
+    memory = ConversationMemory()
+    assert memory.rewrite("What about its habitat?") == "What about its habitat?"
+
+    memory.add_turn("Tell me about blue whales", "Blue whales are the biggest animals.")
+    rewritten = memory.rewrite("What about its habitat?")
+    assert rewritten == "What about its habitat? (blue whales)"
+    assert memory.rewrite("What about its habitat?") == rewritten
+    assert memory.rewrite_hits == 1
+    # Standalone questions are left alone
+    assert memory.rewrite("How do plants grow?") == "How do plants grow?"
+
+    # The rewritten query carries the topic through a chain of follow-ups
+    memory.add_turn("What about its habitat?", "They live in every ocean.", rewritten)
+    assert "whales" in memory.rewrite("And what do they eat?")
+
+
+def test_ring_buffer_and_summary_stay_within_budget():
+    memory = ConversationMemory(max_turns=3, summary_tokens=40, history_tokens=120)
+    for i in range(50):
+        memory.add_turn(f"Question number {i} about the water cycle?", "An answer. " * 30)
+
+    assert len(memory.turns) == 3
+    assert memory.turns[-1]['question'] == "Question number 49 about the water cycle?"
+    assert sum(estimate_tokens(" ".join(line)) for line in memory.summary) <= 40
+    # The newest folded turn is in the summary, the oldest ones are gone
+    assert memory.summary[-1][0] == "Student asked: Question number 46 about the water cycle?"
+    assert estimate_tokens(memory.history_text()) <= 120
+    assert "Question number 49" in memory.history_text()
+
+
+def test_session_store_evicts_idle_and_least_recent_sessions(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr('memory.time.monotonic', lambda: clock[0])
+    store = SessionStore(max_sessions=2, ttl_seconds=60)
+    store.get('a').add_turn("Tell me about whales", "Whales live in the sea.")
+    store.get('b')
+    assert len(store.get('a')) == 1
+
+    store.get('c')  # 'b' was the least recently active
+    assert store.stats()['sessions'] == 2
+    assert len(store.get('a')) == 1
+
+    clock[0] = 120.0
+    assert len(store.get('a')) == 0
+    assert store.stats()['sessions'] == 1
@@ -0,0 +1,177 @@
+import time
+import asyncio
+import pytest
+import model
+from model import LLMModel, AsyncLLMModel, LLMUnavailableError, TokenBucket, model_metrics
+from groq_stub import GroqStub
+
+FAST_RETRIES = {"max_retries": 3, "backoff_base_seconds": 0.01, "backoff_max_seconds": 0.05}
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    # Metrics and rate limiters are process-wide; start every test from scratch
+    model._model_metrics.clear()
+    model._rate_limiters.clear()
+    yield
+
+
+def client_config(stub, **overrides):
+    return {"base_url": stub.base_url, "timeout_seconds": 5, **FAST_RETRIES, **overrides}
+
+
+def test_generate_response_retries_429_and_5xx():
+    with GroqStub(reply="Plants need light.", failures=[(429, {"retry-after": "0"}), 503]) as stub:
+        llm = LLMModel("test-key", client_config(stub))
+        assert llm.generate_response("llama3-8b-8192", "Why?", 64) == "Plants need light."
+
+    metrics = model_metrics("llama3-8b-8192").snapshot()
+    assert len(stub.requests) == 3
+    assert metrics["retries"] == 2
+    assert metrics["rate_limited"] == 1
+    assert metrics["requests"] == 1
+    assert metrics["p50_seconds"] is not None
+
+
+def test_exhausted_retries_raise_friendly_error():
+    with GroqStub(failures=[429] * 4) as stub:
+        llm = LLMModel("test-key", client_config(stub))
+        with pytest.raises(LLMUnavailableError, match="too many questions"):
+            llm.generate_response("llama3-8b-8192", "Why?", 64)
+
+    assert len(stub.requests) == 4
+    assert model_metrics("llama3-8b-8192").snapshot()["errors"] == 1
+
+
+def test_client_errors_are_not_retried():
+    with GroqStub(failures=[400]) as stub:
+        llm = LLMModel("test-key", client_config(stub))
+        with pytest.raises(RuntimeError, match="LLM API call failed"):
+            llm.generate_response("llama3-8b-8192", "Why?", 64)
+    assert len(stub.requests) == 1
+
+
+def test_stream_response_yields_deltas_and_stats():
+    with GroqStub(reply="The sun is a star.", failures=[500]) as stub:
+        llm = LLMModel("test-key", client_config(stub))
+        deltas = list(llm.stream_response("gemma-7b-it", "What is the sun?", 64))
+
+    assert "".join(deltas) == "The sun is a star."
+    assert llm.last_stream_stats["completion_tokens"] == 5
+    assert llm.last_stream_stats["time_to_first_token"] is not None
+    assert model_metrics("gemma-7b-it").snapshot()["retries"] == 1
+
+
+def test_token_bucket_spaces_out_requests_beyond_capacity():
+    bucket = TokenBucket(rate_per_minute=600, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_async_stream_response_fills_stats():
+    async def run(stub):
+        llm = AsyncLLMModel("test-key", client_config(stub))
+        stats = {}
+        try:
+            deltas = [delta async for delta in llm.stream_response("llama3-8b-8192", "Hi", 64, stats)]
+        finally:
+            await llm.close()
+        return deltas, stats
+
+    with GroqStub(reply="Hello class", failures=[502]) as stub:
+        deltas, stats = asyncio.run(run(stub))
+    assert deltas == ["Hello", " class"]
+    assert stats["completion_tokens"] == 2
+    assert stats["model"] == "llama3-8b-8192"
+
+
+def test_slow_request_is_hedged_to_fallback_model():
+    primary, fallback = "llama3-70b-8192", "llama3-8b-8192"
+    for _ in range(5):
+        model_metrics(primary).record(0.05)
+
+    async def run(stub):
+        llm = AsyncLLMModel("test-key", client_config(stub, hedge=True, hedge_min_samples=5),
+                            {primary: fallback})
+        try:
+            start = time.perf_counter()
+            response = await llm.generate_response(primary, "Hi", 64)
+            return response, time.perf_counter() - start
+        finally:
+            await llm.close()
+
+    with GroqStub(reply="From a model", delays={primary: 2.0}) as stub:
+        response, elapsed = asyncio.run(run(stub))
+
+    assert response == "From a model"
+    assert elapsed < 1.0
+    assert [request["model"] for request in stub.requests] == [primary, fallback]
+    assert model_metrics(primary).snapshot()["hedge_wins"] == 1
+
+
+def test_losing_hedged_stream_is_closed(monkeypatch):
+    from groq import AsyncStream
+
+    primary, fallback = "llama3-70b-8192", "llama3-8b-8192"
+    for _ in range(5):
+        model_metrics(primary).record(0.05, 0.05)
+    closed = []
+    original_close = AsyncStream.close
+
+    async def recording_close(self):
+        closed.append(self.response.request.content)
+        await original_close(self)
+    monkeypatch.setattr(AsyncStream, "close", recording_close)
+
+    async def run(stub):
+        llm = AsyncLLMModel("test-key", client_config(stub, hedge=True, hedge_min_samples=5),
+                            {primary: fallback})
+        try:
+            generator = llm.stream_response(primary, "Hi", 64)
+            first = await generator.__anext__()
+            # The primary's stream was open, waiting for its first chunk, when the fallback won
+            assert any(primary.encode() in body for body in closed)
+            await generator.aclose()
+            return first
+        finally:
+            await llm.close()
+
+    with GroqStub(reply="From a model", first_chunk_delays={primary: 2.0}) as stub:
+        first = asyncio.run(run(stub))
+
+    assert first == "From"
+    assert [request["model"] for request in stub.requests] == [primary, fallback]
+    assert len(closed) == 2
+
+
+def test_cancelled_caller_cancels_the_primary_before_hedging():
+    primary, fallback = "llama3-70b-8192", "llama3-8b-8192"
+    for _ in range(5):
+        model_metrics(primary).record(0.5)
+
+    async def run():
+        llm = AsyncLLMModel("test-key", {"hedge": True, "hedge_min_samples": 5}, {primary: fallback})
+        started, cancelled = asyncio.Event(), []
+
+        async def slow_attempt(model):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+
+        try:
+            caller = asyncio.create_task(llm._hedged(primary, slow_attempt))
+            await started.wait()
+            # Cancel while the caller is still waiting out the hedge threshold
+            caller.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await caller
+            await asyncio.sleep(0)
+            return list(cancelled)
+        finally:
+            await llm.close()
+
+    assert asyncio.run(run()) == [primary]
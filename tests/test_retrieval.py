@@ -0,0 +1,146 @@
+import os
+import numpy as np
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import MetadataMode, QueryBundle
+from embedding import EmbeddingStore
+import retrieval
+from retrieval import QueryEngineRegistry, resolve_directory, swap_directory
+
+
+def test_retrieve_returns_nearest_nodes_with_embeddings(make_retriever):
+    retriever = make_retriever()
+    nodes = retriever.retrieve(QueryBundle("city", embedding=[0.9, 0.1, 0.0, 0.0]))
+    assert [n.node.node_id for n in nodes] == ['node-0', 'node-1']
+    assert nodes[0].score > nodes[1].score
+    assert nodes[0].node.embedding == [1.0, 0.0, 0.0, 0.0]
+
+
+def test_retrieve_batch_matches_single_queries(make_retriever):
+    retriever = make_retriever()
+    bundles = [QueryBundle("a", embedding=[0.0, 0.0, 1.0, 0.2]), QueryBundle("b", embedding=[0.1, 0.0, 0.0, 1.0])]
+    batch = retriever.retrieve_batch(bundles)
+    single = [retriever.retrieve(bundle) for bundle in bundles]
+    assert [[n.node.node_id for n in nodes] for nodes in batch] == \
+        [[n.node.node_id for n in nodes] for nodes in single]
+
+
+def test_hybrid_retrieval_finds_lexical_matches_below_the_cutoff(make_retriever):
+    query = QueryBundle("Who lived in Petra?", embedding=[1.0, 0.0, 0.0, 0.0])
+    vector_only = make_retriever(similarity_cutoff=0.5)
+    assert [n.node.node_id for n in vector_only.retrieve(query)] == ['node-0']
+
+    hybrid = make_retriever(similarity_cutoff=0.5, lexical=True, lexical_min_score=1.0)
+    nodes = {n.node.node_id: n for n in hybrid.retrieve(query)}
+    assert set(nodes) == {'node-0', 'node-1'}
+    # Scores stay cosine similarities; the fused rank score is kept in metadata
+    assert nodes['node-0'].score == 1.0 and nodes['node-1'].score == 0.0
+    assert nodes['node-1'].node.metadata['rrf_score'] > 0
+    assert 'rrf_score' not in nodes['node-1'].node.get_content(metadata_mode=MetadataMode.LLM)
+
+
+def test_off_topic_query_sharing_a_common_word_finds_nothing(make_retriever):
+    hybrid = make_retriever(similarity_cutoff=0.6, lexical=True, lexical_min_score=1.0)
+    query = QueryBundle("What is the biggest planet?", embedding=[0.5, 0.5, 0.5, 0.5])
+    assert hybrid.retrieve(query) == []
+
+
+def test_swap_directory_repoints_a_symlink_and_keeps_the_previous_version(tmp_path):
+    target = str(tmp_path / 'Grade4_vector_db')
+    os.makedirs(target)  # persisted before versioning
+    for version in (1, 2, 3):
+        new_path = target + '.tmp'
+        os.makedirs(new_path)
+        with open(os.path.join(new_path, 'docstore.json'), 'w') as f:
+            f.write(str(version))
+        pinned = resolve_directory(target)
+        swap_directory(new_path, target)
+
+        assert os.path.islink(target)
+        with open(os.path.join(target, 'docstore.json')) as f:
+            assert f.read() == str(version)
+        # A reader that resolved the link before the swap still sees a complete directory
+        assert os.path.isdir(pinned)
+
+    assert sorted(os.listdir(tmp_path)) == ['Grade4_vector_db', 'Grade4_vector_db@2', 'Grade4_vector_db@3']
+
+
+def test_hash_registry_only_rehashes_when_files_change(tmp_path, monkeypatch):
+    path = tmp_path / 'docstore.json'
+    path.write_text('v1')
+    hashed = []
+    fingerprint = retrieval.persist_dir_fingerprint
+
+    def counting_fingerprint(persist_dir, mode='mtime'):
+        if mode == 'hash':
+            hashed.append(persist_dir)
+        return fingerprint(persist_dir, mode)
+    monkeypatch.setattr(retrieval, 'persist_dir_fingerprint', counting_fingerprint)
+
+    loads = []
+    registry = QueryEngineRegistry(fingerprint_mode='hash')
+    load = lambda: loads.append(path.read_text()) or len(loads)
+    for _ in range(3):
+        assert registry.get('Grade4', str(tmp_path), load) == 1
+    assert len(hashed) == 1
+
+    # Touched with the same contents: hashed again, not reloaded
+    os.utime(path, ns=(0, 0))
+    assert registry.get('Grade4', str(tmp_path), load) == 1
+    path.write_text('v2')
+    assert registry.get('Grade4', str(tmp_path), load) == 2
+    assert loads == ['v1', 'v2'] and len(hashed) == 3
+
+
+def test_builder_settings_do_not_change_other_registries():
+    assert QueryEngineRegistry.shared(None, 'mtime') is QueryEngineRegistry.shared(None, 'mtime')
+    assert QueryEngineRegistry.shared(2, 'hash').max_grades == 2
+    assert QueryEngineRegistry.shared(None, 'mtime').max_grades is None
+
+
+def test_incremental_build_diffs_the_manifest_and_drops_removed_files(tmp_path, monkeypatch):
+    import json
+    import yaml
+    from concurrent.futures import ThreadPoolExecutor
+    from llama_index.core import Settings
+
+    monkeypatch.setattr(Settings, '_embed_model', None)
+    monkeypatch.setattr(Settings, '_node_parser', None)
+    monkeypatch.setattr(retrieval, 'load_embed_model', lambda *args, **kwargs: MockEmbedding(embed_dim=8))
+    books = tmp_path / 'books' / 'Grade4'
+    books.mkdir(parents=True)
+    for name in ('whales.txt', 'plants.txt', 'petra.txt'):
+        (books / name).write_text(f"All about {name[:-4]}. " * 5)
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text(yaml.safe_dump({
+        'root_dir': str(tmp_path / 'books'), 'databases_dir': str(tmp_path / 'db'), 'grades': ['Grade4'],
+        'embedding_model': {'name': 'mock', 'chunk_size': 256, 'chunk_overlap': 0},
+        'query_config': {'top_k': 3, 'similarity_cutoff': 0.0},
+    }))
+    builder = retrieval.VectorDBBuilder(str(config_file))
+    builder.ingestion_pipeline._executor = ThreadPoolExecutor(max_workers=2)
+    db = str(tmp_path / 'db' / 'Grade4_vector_db')
+
+    builder.build_vector_db('Grade4')
+    first = builder.load_manifest(db)['files']
+    assert sorted(first) == ['petra.txt', 'plants.txt', 'whales.txt']
+    # Vectors are only kept in the binary store, which the next build starts from
+    assert not os.path.exists(os.path.join(db, 'default__vector_store.json'))
+    first_store = EmbeddingStore.load(db)
+    plants_vector = first_store.matrix[first_store.ref_doc_ids.index(first['plants.txt']['doc_ids'][0])].copy()
+
+    (books / 'whales.txt').write_text("Whales are the biggest animals. " * 5)
+    (books / 'petra.txt').unlink()
+    builder.build_vector_db('Grade4')
+    second = builder.load_manifest(db)['files']
+    assert sorted(second) == ['plants.txt', 'whales.txt']
+    assert second['plants.txt'] == first['plants.txt']
+    assert second['whales.txt']['sha256'] != first['whales.txt']['sha256']
+
+    # Nodes of the removed file are gone from the docstore and the embedding store
+    store = EmbeddingStore.load(db)
+    with open(os.path.join(db, 'docstore.json')) as f:
+        texts = json.dumps(json.load(f))
+    assert 'petra' not in texts and 'Whales are the biggest' in texts
+    assert len(store) == 2
+    np.testing.assert_allclose(store.matrix[store.ref_doc_ids.index(first['plants.txt']['doc_ids'][0])], plants_vector,
+                               atol=1e-6)
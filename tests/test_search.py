@@ -0,0 +1,56 @@
+import numpy as np
+from search import (ExactSearchIndex, IVFIndex, Int8SearchIndex, node_ids_fingerprint, normalize_rows,
+                    quantize_int8, recall_report)
+
+
+def random_matrix(rows=500, dim=32, seed=0):
+    return normalize_rows(np.random.default_rng(seed).normal(size=(rows, dim)))
+
+
+def test_quantize_int8_error_is_within_half_a_step():
+    matrix = random_matrix()
+    codes, scale, offset = quantize_int8(matrix, block_size=128)
+    assert codes.dtype == np.int8
+    assert np.all(np.abs(codes * scale + offset - matrix) <= scale / 2 + 1e-6)
+
+
+def test_int8_search_matches_exact_search_after_rescoring():
+    matrix = random_matrix()
+    queries = random_matrix(rows=20, seed=1)
+    exact = ExactSearchIndex(matrix).search(queries, top_k=5, similarity_cutoff=0.1)
+    int8 = Int8SearchIndex.build(matrix, rescore_factor=4).search(queries, top_k=5, similarity_cutoff=0.1)
+    for (exact_rows, exact_scores), (rows, scores) in zip(exact, int8):
+        assert list(rows) == list(exact_rows)
+        # Returned scores are the full-precision similarities, so the cutoff means the same thing
+        np.testing.assert_allclose(scores, exact_scores, rtol=1e-5)
+
+
+def test_int8_index_round_trip_and_stale_detection(tmp_path):
+    matrix = random_matrix()
+    Int8SearchIndex.build(matrix).save(str(tmp_path))
+    loaded = Int8SearchIndex.load(str(tmp_path), matrix, rescore_factor=2)
+    assert loaded.rescore_factor == 2
+    assert loaded.nbytes < matrix.nbytes / 3
+    assert Int8SearchIndex.load(str(tmp_path), matrix[:-1]) is None
+
+    node_ids = [f'node-{i}' for i in range(len(matrix))]
+    Int8SearchIndex.build(matrix).save(str(tmp_path), node_ids_fingerprint(node_ids))
+    assert Int8SearchIndex.load(str(tmp_path), matrix, source=node_ids_fingerprint(node_ids)) is not None
+    assert Int8SearchIndex.load(str(tmp_path), matrix, source=node_ids_fingerprint(node_ids[::-1])) is None
+
+
+def test_ivf_index_is_stale_when_built_from_other_nodes(tmp_path):
+    matrix = random_matrix()
+    node_ids = [f'node-{i}' for i in range(len(matrix))]
+    IVFIndex.build(matrix).save(str(tmp_path), node_ids_fingerprint(node_ids))
+    assert IVFIndex.load(str(tmp_path), matrix, source=node_ids_fingerprint(node_ids)) is not None
+    # Same row count, different nodes (e.g. a chunk replaced by a rebuild)
+    node_ids[7] = 'node-new'
+    assert IVFIndex.load(str(tmp_path), matrix, source=node_ids_fingerprint(node_ids)) is None
+
+
+def test_recall_report_covers_every_index():
+    report = recall_report(random_matrix(), nprobe_values=(1,), num_queries=20, rescore_factors=(4,))
+    assert [row['index'] for row in report] == ['exact', 'ivf(nlist=22)', 'int8']
+    assert report[2]['recall@3'] == 1.0
+    assert report[2]['memory_mb'] < report[0]['memory_mb'] / 3
@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from llama_index.core.schema import NodeWithScore, TextNode
+import server
+from server import ClientLimiter, RAGService
+
+
+class FakeService:
+    """Stands in for RAGService: ready at once, scripted retrieval and chat events."""
+    def __init__(self, config_file, events=None):
+        self.config = {}
+        self.status = 'ready'
+        self.phase = None
+        self.startup_error = None
+        self.startup_timings = {}
+        self.limiter = ClientLimiter(1)
+        self.response_cache = self.faq = self.sessions = self.builder = None
+        self.events = events or [{"type": "delta", "content": "Blue "}, {"type": "delta", "content": "whales."},
+                                 {"type": "done", "response": "Blue whales.", "cached": False, "stats": None}]
+        self.closed_while_in_flight = []
+
+    require_ready = RAGService.require_ready
+
+    async def start(self, started_at=None):
+        pass
+
+    async def close(self):
+        pass
+
+    async def retrieve(self, grade, question, trace_id=None):
+        if grade != "Grade4":
+            raise HTTPException(status_code=404, detail=f"Unknown grade: {grade}")
+        return None, [NodeWithScore(node=TextNode(id_='node-0', text="Whales live in the sea."), score=0.8)]
+
+    async def chat_events(self, request):
+        try:
+            for event in self.events:
+                if isinstance(event, Exception):
+                    raise event
+                yield event
+        finally:
+            self.closed_while_in_flight.append(bool(self.limiter._in_flight))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, 'RAGService', FakeService)
+    with TestClient(server.create_app()) as client:
+        yield client
+
+
+def sse_events(response):
+    return [json.loads(line[len('data: '):]) for line in response.text.splitlines() if line.startswith('data: ')]
+
+
+def test_client_limiter_caps_in_flight_requests():
+    limiter = ClientLimiter(2)
+    limiter.acquire('a')
+    limiter.acquire('a')
+    limiter.acquire('b')
+    with pytest.raises(HTTPException) as e:
+        limiter.acquire('a')
+    assert e.value.status_code == 429
+    limiter.release('a')
+    limiter.acquire('a')
+    for client_id in ('a', 'a', 'b'):
+        limiter.release(client_id)
+    assert limiter._in_flight == {}
+
+
+def test_query_returns_scored_nodes(client):
+    response = client.post('/query', json={"grade": "Grade4", "question": "Where do whales live?"})
+    assert response.status_code == 200
+    assert response.json() == {"nodes": [{"node_id": "node-0", "text": "Whales live in the sea.", "score": 0.8}]}
+    assert client.post('/query', json={"grade": "Grade9", "question": "?"}).status_code == 404
+    assert client.app.state.service.limiter._in_flight == {}
+
+
+def test_chat_streams_server_sent_events(client):
+    response = client.post('/chat', json={"grade": "Grade4", "model": "m", "question": "Biggest animal?"})
+    assert response.headers['content-type'].startswith('text/event-stream')
+    assert [event["type"] for event in sse_events(response)] == ["delta", "delta", "done"]
+    assert sse_events(response)[-1]["response"] == "Blue whales."
+    assert client.app.state.service.limiter._in_flight == {}
+
+
+def test_chat_stream_ends_with_an_error_event_when_anything_fails(client):
+    client.app.state.service.events = [{"type": "delta", "content": "Blue "}, FileNotFoundError("DB is gone")]
+    response = client.post('/chat', json={"grade": "Grade4", "model": "m", "question": "Biggest animal?"})
+    assert sse_events(response) == [{"type": "delta", "content": "Blue "}, {"type": "error", "message": "DB is gone"}]
+    assert client.app.state.service.limiter._in_flight == {}
+
+
+def test_non_streaming_chat_closes_the_event_generator(client):
+    service = client.app.state.service
+    response = client.post('/chat', json={"grade": "Grade4", "model": "m", "question": "Biggest animal?",
+                                          "stream": False})
+    assert response.json()["response"] == "Blue whales."
+    # The generator's cleanup ran before the request gave its slot back
+    assert service.closed_while_in_flight == [True]
+    assert service.limiter._in_flight == {}
+
+
+def test_clients_over_their_limit_get_429(client):
+    client.app.state.service.limiter.acquire('busy-client')
+    headers = {'x-client-id': 'busy-client'}
+    assert client.post('/query', json={"grade": "Grade4", "question": "?"}, headers=headers).status_code == 429
+    for stream in (True, False):
+        response = client.post('/chat', json={"grade": "Grade4", "model": "m", "question": "?", "stream": stream},
+                               headers=headers)
+        assert response.status_code == 429
+    # Other clients are not affected
+    assert client.post('/query', json={"grade": "Grade4", "question": "?"}).status_code == 200
+
+
+@pytest.fixture
+def real_service_app(tmp_path, monkeypatch):
+    """An app around the real RAGService whose startup waits for `warmed_up` to be set."""
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text('{}')
+    monkeypatch.setenv('GROQ_API_KEY', 'test-key')
+    warmed_up = threading.Event()
+
+    def start(self, started_at):
+        with self._phase('warm_up'):
+            if not warmed_up.wait(timeout=10):
+                raise TimeoutError("never warmed up")
+
+    monkeypatch.setattr(RAGService, '_start', start)
+    return server.create_app(str(config_file)), warmed_up
+
+
+def wait_for_status(client, status_code):
+    deadline = time.monotonic() + 5
+    while (response := client.get('/healthz')).status_code != status_code and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return response
+
+
+def test_healthz_is_503_until_warm_up_finishes(real_service_app):
+    app, warmed_up = real_service_app
+    with TestClient(app) as client:
+        response = client.get('/healthz')
+        assert response.status_code == 503
+        assert response.json()["status"] == 'starting'
+        assert response.json()["phase"] == 'warm_up'
+        assert client.post('/query', json={"grade": "Grade4", "question": "?"}).status_code == 503
+
+        warmed_up.set()
+        response = wait_for_status(client, 200)
+        assert response.status_code == 200
+        assert response.json()["status"] == 'ready'
+        assert 'warm_up' in response.json()["startup_seconds"]
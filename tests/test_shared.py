@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from embedding import EmbeddingStore
+from shared import GradePublisher, SharedGrade, current_generation
+
+TEXTS = ["Amman is the biggest city in Jordan.", "الماء ضروري للنباتات.", "Whales live in the sea."]
+
+
+def write_persist_dir(path, texts):
+    os.makedirs(path, exist_ok=True)
+    node_ids = [f'node-{i}' for i in range(len(texts))]
+    docstore = SimpleDocumentStore()
+    docstore.add_documents([TextNode(id_=node_id, text=text, metadata={'page': i})
+                            for i, (node_id, text) in enumerate(zip(node_ids, texts))])
+    docstore.persist(os.path.join(path, 'docstore.json'))
+    EmbeddingStore.write(path, node_ids, np.eye(len(texts), dtype=np.float32))
+
+
+def test_publish_and_attach_round_trip(tmp_path):
+    persist_dir = str(tmp_path / 'Grade4_vector_db')
+    write_persist_dir(persist_dir, TEXTS)
+    publisher = GradePublisher(str(tmp_path / 'shm'))
+    assert publisher.publish_if_changed('Grade4', persist_dir) == 1
+    assert publisher.publish_if_changed('Grade4', persist_dir) is None
+
+    grade = SharedGrade.attach(publisher.grade_dir('Grade4'))
+    assert grade.generation == 1
+    assert isinstance(grade.embedding_store.matrix, np.memmap)
+    node = grade.node_store.get_nodes(['node-1'])[0]
+    assert node.text == TEXTS[1]
+    assert node.metadata == {'page': 1}
+
+
+def test_republish_bumps_generation_and_keeps_attached_readers_working(tmp_path):
+    persist_dir = str(tmp_path / 'Grade4_vector_db')
+    write_persist_dir(persist_dir, TEXTS)
+    publisher = GradePublisher(str(tmp_path / 'shm'), keep_generations=1)
+    publisher.publish('Grade4', persist_dir)
+    old = SharedGrade.attach(publisher.grade_dir('Grade4'))
+
+    write_persist_dir(persist_dir, TEXTS + ["Plants need sunlight."])
+    assert publisher.publish('Grade4', persist_dir) == 2
+    assert current_generation(publisher.grade_dir('Grade4')) == 2
+    assert sorted(os.listdir(publisher.grade_dir('Grade4'))) == ['CURRENT', 'gen-2']
+
+    # The removed generation stays mapped for workers that have not switched yet
+    assert old.node_store.get_node('node-2').text == TEXTS[2]
+    assert len(SharedGrade.attach(publisher.grade_dir('Grade4')).node_store) == 4
+
+
+def test_publish_skips_a_persist_dir_whose_files_disagree(tmp_path):
+    persist_dir = str(tmp_path / 'Grade4_vector_db')
+    write_persist_dir(persist_dir, TEXTS)
+    # A rebuild rewrote the matrix but not yet the docstore
+    EmbeddingStore.write(persist_dir, ['node-0', 'node-9'], np.eye(2, dtype=np.float32))
+    publisher = GradePublisher(str(tmp_path / 'shm'))
+    with pytest.raises(ValueError):
+        publisher.publish('Grade4', persist_dir)
+    assert current_generation(publisher.grade_dir('Grade4')) is None
+    assert os.listdir(publisher.grade_dir('Grade4')) == []
+
+
+def test_remote_embedding_matches_the_served_model(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from llama_index.core.embeddings import MockEmbedding
+    from embedding import EmbeddingServer, EmbeddingService, RemoteEmbedding
+
+    model = MockEmbedding(embed_dim=4)
+    server = EmbeddingServer(EmbeddingService(model, max_wait_ms=50), str(tmp_path / 'embedding.sock')).start()
+    try:
+        remote = RemoteEmbedding(server.address, 'mock', connect_timeout_seconds=1)
+        assert remote.get_query_embedding("whales") == model.get_query_embedding("whales")
+        assert remote.get_text_embedding_batch(["a", "b", "c"]) == model.get_text_embedding_batch(["a", "b", "c"])
+        # Queries from several worker threads are embedded by the one served model
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            vectors = list(executor.map(remote.get_query_embedding, [f"question {i}" for i in range(8)]))
+        assert vectors == [model.get_query_embedding(f"question {i}") for i in range(8)]
+        assert server.service.stats()['batches'] < 9
+    finally:
+        server.close()
+
+    with pytest.raises(ConnectionError):
+        RemoteEmbedding(server.address, 'mock', connect_timeout_seconds=0.2).get_query_embedding("whales")
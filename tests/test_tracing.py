@@ -0,0 +1,51 @@
+import pytest
+import tracing
+from tracing import Tracer
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer(log_spans=False)
+    monkeypatch.setattr(tracing, 'tracer', tracer)
+    return tracer
+
+
+def test_span_and_decorator_record_stage_durations(tracer):
+    @tracing.traced('prompt_build')
+    def build():
+        return 'prompt'
+
+    with tracing.span('vector_search', grade='Grade4'):
+        pass
+    assert build() == 'prompt'
+
+    snapshot = tracer.snapshot()
+    assert snapshot['vector_search']['count'] == 1
+    assert snapshot['prompt_build']['count'] == 1
+    assert snapshot['prompt_build']['errors'] == 0
+
+
+def test_span_counts_errors_and_reraises(tracer):
+    with pytest.raises(ValueError):
+        with tracing.span('query_embedding'):
+            raise ValueError('boom')
+    assert tracer.snapshot()['query_embedding']['errors'] == 1
+
+
+def test_prometheus_text_has_cumulative_buckets(tracer):
+    tracing.record('llm_total', 0.2)
+    tracing.record('llm_total', 3.0)
+    text = tracer.prometheus_text()
+    assert 'rag_stage_duration_seconds_bucket{stage="llm_total",le="0.25"} 1' in text
+    assert 'rag_stage_duration_seconds_bucket{stage="llm_total",le="+Inf"} 2' in text
+    assert 'rag_stage_duration_seconds_count{stage="llm_total"} 2' in text
+
+
+def test_spans_are_logged_with_the_trace_id(tracer, caplog):
+    tracer.log_spans = True
+    with caplog.at_level('INFO', logger='rag.trace'):
+        with tracing.trace('abc123'):
+            with tracing.span('postprocessing'):
+                pass
+    assert '"trace_id": "abc123"' in caplog.text
+    assert '"span": "postprocessing"' in caplog.text
@@ -0,0 +1,55 @@
+import os
+import json
+import pytest
+from llama_index.core import Document
+from utils import TextCleaner, DocumentProcessor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+PAGES = load_fixture('text_cleaner_pages.json')
+GOLDEN = load_fixture('text_cleaner_golden.json')
+
+
+@pytest.mark.parametrize('page, expected', list(zip(PAGES, GOLDEN)))
+def test_clean_text_content_matches_golden_output(page, expected):
+    assert TextCleaner().clean_text_content(page) == expected
+
+
+def test_clean_pages_streams_pages_in_order():
+    cleaned = TextCleaner().clean_pages(iter(PAGES))
+    assert not isinstance(cleaned, list)
+    assert list(cleaned) == GOLDEN
+
+
+def test_process_documents_keeps_ids_and_hides_metadata():
+    documents = [Document(text=PAGES[2], id_='book.pdf_part_0', metadata={'file_path': '/books/book.pdf'})]
+    cleaned = DocumentProcessor(TextCleaner()).process_documents(documents)
+
+    assert cleaned[0].doc_id == 'book.pdf_part_0'
+    assert cleaned[0].text == '\n'.join(segment['content'] for segment in GOLDEN[2])
+    assert cleaned[0].metadata == {'file_path': '/books/book.pdf'}
+    assert 'book.pdf' not in cleaned[0].get_content(metadata_mode='embed')
+
+
+def test_page_hash_ignores_file_level_reader_metadata():
+    def read(pages, file_size):
+        # What SimpleDirectoryReader returns for a PDF: one Document per page, file metadata on each
+        return [Document(text=page, id_=f'book.pdf_part_{i}',
+                         metadata={'file_path': '/books/book.pdf', 'page_label': str(i + 1), 'file_size': file_size,
+                                   'last_modified_date': f'2026-10-{file_size % 28 + 1:02d}'})
+                for i, page in enumerate(pages)]
+
+    processor = DocumentProcessor(TextCleaner())
+    before = processor.process_documents(read(PAGES[:3], 1000))
+    edited = list(PAGES[:3])
+    edited[1] = PAGES[3]
+    after = processor.process_documents(read(edited, 1200))
+
+    assert [a.hash == b.hash for a, b in zip(before, after)] == [True, False, True]
+    assert after[0].metadata == {'file_path': '/books/book.pdf', 'page_label': '1'}